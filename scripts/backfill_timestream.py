@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Rebuild Timestream tables from the raw CTR data in the S3 lake
+
+After an outage in the Timestream Lambdas the CTR lake is the only
+complete record of what happened. This tool streams the partitioned
+objects and turns each document into Timestream records with the Lambda
+record builders:
+
+- agent events (documents with Agent and EventType) go through
+  persist_agent_event.process_agent_event into AgentEvent and
+  AgentEvent_Contact
+- CTRs are mapped onto a DISCONNECTED contact event and go through
+  persist_contact_event.process_contact_event into ContactEvent, and
+  through persist_agent_event.build_contact_record into ContactRecord
+  (set CONTACT_RECORD_ATTRIBUTES as for the Lambda to include attributes)
+
+Records keep the time of the original event rather than the time of the
+backfill. Timestream only accepts records inside the memory store
+retention, or inside the magnetic store retention when magnetic store
+writes are enabled on the table, so older records are counted and
+skipped instead of being rejected.
+
+Partitions are parsed in worker processes and written by a thread pool,
+limited to --rate records per second so live ingestion keeps its share
+of the table's write throughput. Writes go through the Lambdas'
+TimestreamWriter, so --secondary-region and --write-mode fail over or
+write to both regions as the Lambdas do. Each partition is recorded in the
+checkpoint file once all its records are written; a rerun skips those,
+and rewriting an interrupted partition is harmless because Timestream
+treats identical records as the same write. Partitions with records
+skipped only until magnetic store writes are enabled, or until their
+time is no longer in the future, are left out of the checkpoint so a
+rerun writes them.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', 'terraform', 'timestream', 'lambda_code'))
+
+import ctr_lake
+import persist_agent_event
+import persist_contact_event
+import timestream_common
+from timestream_common import RateLimiter, TimestreamWriter, WRITE_CHUNK_SIZE, write_chunk
+
+# Configuration defaults
+PREFIX = "connect-ctr-data/"        # Prefix Firehose delivers to
+DATABASE = "connect-analytics"      # Timestream database
+REGION = "eu-west-1"                # Timestream region
+TABLES = ["AgentEvent", "AgentEvent_Contact", "ContactEvent", "ContactRecord"]
+PARSE_WORKERS = 4                   # Processes parsing partitions
+WRITE_THREADS = 8                   # Threads writing to Timestream
+RATE = 500                          # Records per second across all threads (0 for no limit)
+CHECKPOINT_FILE = "timestream-backfill-checkpoint.json"
+
+# Timestream accepts nothing more than 15 minutes ahead of the current time
+FUTURE_LIMIT_MS = 15 * 60 * 1000
+
+# Used when describe_table is not available, matching the Terraform defaults
+DEFAULT_MEMORY_RETENTION_HOURS = 25
+DEFAULT_MAGNETIC_RETENTION_DAYS = 365
+
+# Parse a YYYY/MM/DD/HH argument into a UTC datetime
+def parse_hour(value):
+    return datetime.datetime.strptime(value, "%Y/%m/%d/%H").replace(tzinfo=datetime.timezone.utc)
+
+# Convert an ISO 8601 Connect timestamp to epoch milliseconds, or None
+def parse_event_time(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            parsed = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+# Drop empty values so the builders' "if key in" checks skip them
+def without_empty(values):
+    return {key: value for key, value in values.items() if value not in (None, '', {})}
+
+# Map a CTR onto the contact event detail persist_contact_event expects
+def ctr_to_contact_event(ctr):
+    queue = ctr.get('Queue') or {}
+    agent = ctr.get('Agent') or ctr.get('AgentInfo') or {}
+    
+    return without_empty({
+        'ContactId': ctr.get('ContactId'),
+        'InstanceArn': ctr.get('InstanceARN') or ctr.get('InstanceId'),
+        'Channel': ctr.get('Channel'),
+        'EventType': 'DISCONNECTED',
+        'InitiationMethod': ctr.get('InitiationMethod'),
+        'EventTimestamp': ctr.get('DisconnectTimestamp') or ctr.get('InitiationTimestamp'),
+        'InitiationTimestamp': ctr.get('InitiationTimestamp'),
+        'DisconnectTimestamp': ctr.get('DisconnectTimestamp'),
+        'Queue': without_empty({
+            'Name': queue.get('Name') or queue.get('QueueName'),
+            'ARN': queue.get('ARN'),
+            'EnqueueTimestamp': queue.get('EnqueueTimestamp'),
+            'DequeueTimestamp': queue.get('DequeueTimestamp'),
+        }),
+        'Agent': without_empty({
+            'ARN': agent.get('ARN') or agent.get('AgentId'),
+            'ConnectedToAgentTimestamp': agent.get('ConnectedToAgentTimestamp'),
+        }),
+        'CustomerEndpoint': ctr.get('CustomerEndpoint'),
+        'SystemEndpoint': ctr.get('SystemEndpoint'),
+    })
+
+# Build the records for one document with the Lambda builders, keyed by table
+def build_document_records(document):
+    if 'Agent' in document and 'EventType' in document:
+        agent_event_records = []
+        agent_event_contact_records = []
+        persist_agent_event.process_agent_event(document, agent_event_records, agent_event_contact_records)
+        records = {'AgentEvent': agent_event_records, 'AgentEvent_Contact': agent_event_contact_records}
+        event_time = parse_event_time(document.get('EventTimestamp'))
+    elif 'ContactId' in document:
+        detail = ctr_to_contact_event(document)
+        contact_event_records = []
+        persist_contact_event.process_contact_event(detail, contact_event_records)
+        contact_record = persist_agent_event.build_contact_record(document, "0")
+        records = {'ContactEvent': contact_event_records, 'ContactRecord': [contact_record]}
+        event_time = parse_event_time(detail.get('EventTimestamp'))
+    else:
+        return {}, None
+    
+    # The builders stamp the current time; a backfill keeps the event's own time
+    if event_time is not None:
+        for table_records in records.values():
+            for record in table_records:
+                record['Time'] = str(event_time)
+    
+    return records, event_time
+
+# Decide whether Timestream will accept a record of this age
+def classify_time(event_time, now_ms, limits):
+    if event_time is None:
+        return 'no_time'
+    age = now_ms - event_time
+    if age < -FUTURE_LIMIT_MS:
+        return 'future'
+    if age < limits['memory_ms']:
+        return 'ok'
+    if age >= limits['magnetic_ms']:
+        return 'expired'
+    return 'ok' if limits['magnetic_writes'] else 'needs_magnetic'
+
+# Every agent contact is written; the delta cache assumes events arrive in order
+def init_worker():
+    persist_agent_event.contact_state_cache = persist_agent_event.ContactStateCache(0, 0)
+
+# Parse one partition into records per table (runs in a worker process)
+def build_partition_records(store, keys, tables, limits, now_ms):
+    records = {table: [] for table in tables}
+    counters = {'documents': 0, 'errors': 0, 'no_time': 0, 'future': 0, 'expired': 0, 'needs_magnetic': 0}
+    
+    for key in keys:
+        for document in ctr_lake.iter_json_documents(store.read_bytes(key)):
+            counters['documents'] += 1
+            try:
+                document_records, event_time = build_document_records(document)
+            except Exception as e:
+                counters['errors'] += 1
+                print(f"Error building records from {key}: {str(e)}")
+                continue
+            
+            for table, table_records in document_records.items():
+                if table not in records or not table_records:
+                    continue
+                verdict = classify_time(event_time, now_ms, limits[table])
+                if verdict == 'ok':
+                    records[table].extend(table_records)
+                else:
+                    counters[verdict] += len(table_records)
+    
+    return records, counters
+
+# Read each table's retention and magnetic write settings
+def load_table_limits(client, database, tables):
+    limits = {}
+    for table in tables:
+        memory_hours = DEFAULT_MEMORY_RETENTION_HOURS
+        magnetic_days = DEFAULT_MAGNETIC_RETENTION_DAYS
+        magnetic_writes = False
+        try:
+            description = client.describe_table(DatabaseName=database, TableName=table)['Table']
+            retention = description.get('RetentionProperties', {})
+            memory_hours = retention.get('MemoryStoreRetentionPeriodInHours', memory_hours)
+            magnetic_days = retention.get('MagneticStoreRetentionPeriodInDays', magnetic_days)
+            magnetic_writes = description.get('MagneticStoreWriteProperties', {}).get('EnableMagneticStoreWrites', False)
+        except Exception as e:
+            print(f"Could not describe {table}, assuming Terraform defaults: {str(e)}")
+        
+        limits[table] = {
+            'memory_ms': memory_hours * 3600 * 1000,
+            'magnetic_ms': magnetic_days * 86400 * 1000,
+            'magnetic_writes': magnetic_writes,
+        }
+    return limits
+
+# Load the completed partitions from a checkpoint file
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {'completed': {}}
+    with open(path) as f:
+        return json.load(f)
+
+# Save the checkpoint atomically so an interrupted save never loses progress
+def save_checkpoint(path, checkpoint):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+# Backfill every partition not yet in the checkpoint through a TimestreamWriter and return the totals
+def run_backfill(store, writer, partitions, tables=TABLES, checkpoint_path=CHECKPOINT_FILE,
+                 parse_workers=PARSE_WORKERS, write_threads=WRITE_THREADS, rate=RATE, now_ms=None):
+    now_ms = now_ms or int(time.time() * 1000)
+    checkpoint = load_checkpoint(checkpoint_path)
+    pending = {partition: keys for partition, keys in sorted(partitions.items())
+               if '/'.join(partition) not in checkpoint['completed']}
+    limits = load_table_limits(writer.client(writer.primary_region), writer.database, tables)
+    limiter = RateLimiter(rate)
+    
+    totals = {'partitions': 0, 'failed_partitions': 0, 'incomplete_partitions': 0, 'written': 0, 'rejected': 0}
+    print(f"{len(pending)} partitions to backfill, {len(partitions) - len(pending)} already done")
+    start = time.time()
+    
+    with ProcessPoolExecutor(max_workers=parse_workers, initializer=init_worker) as parsers, \
+            ThreadPoolExecutor(max_workers=write_threads) as writers:
+        queue = iter(pending.items())
+        parsing = {}
+        
+        # Keep only a few parsed partitions in memory at once
+        def submit_next():
+            item = next(queue, None)
+            if item is not None:
+                partition, keys = item
+                future = parsers.submit(build_partition_records, store, keys, tables, limits, now_ms)
+                parsing[future] = partition
+        
+        for _ in range(parse_workers):
+            submit_next()
+        
+        while parsing:
+            done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+            for future in done:
+                partition = parsing.pop(future)
+                name = '/'.join(partition)
+                submit_next()
+                
+                try:
+                    records, counters = future.result()
+                    writes = [
+                        writers.submit(write_chunk, writer, table, table_records[i:i + WRITE_CHUNK_SIZE], limiter)
+                        for table, table_records in records.items()
+                        for i in range(0, len(table_records), WRITE_CHUNK_SIZE)
+                    ]
+                    rejected = sum(write.result() for write in writes)
+                    written = {table: len(table_records) for table, table_records in records.items()}
+                except Exception as e:
+                    totals['failed_partitions'] += 1
+                    print(f"Error backfilling {name}: {str(e)}")
+                    continue
+                
+                # Records that a later run can write keep the partition out of the checkpoint
+                if counters['needs_magnetic'] or counters['future']:
+                    totals['incomplete_partitions'] += 1
+                else:
+                    checkpoint['completed'][name] = dict(counters, written=written, rejected=rejected)
+                    save_checkpoint(checkpoint_path, checkpoint)
+                
+                totals['partitions'] += 1
+                totals['written'] += sum(written.values()) - rejected
+                totals['rejected'] += rejected
+                elapsed = max(time.time() - start, 1e-6)
+                skipped = counters['expired'] + counters['needs_magnetic'] + counters['future'] + counters['no_time']
+                print(f"{name}: {sum(written.values())} records, {skipped} skipped, {rejected} rejected "
+                      f"({totals['written'] / elapsed:.0f} records/s overall)")
+    
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild Timestream tables from the CTR lake")
+    parser.add_argument("location", help="s3://bucket or a local directory laid out like the bucket")
+    parser.add_argument("--prefix", default=PREFIX)
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--region", default=REGION)
+    parser.add_argument("--secondary-region", default=timestream_common.TIMESTREAM_SECONDARY_REGION,
+                        help="Secondary Timestream region, as TIMESTREAM_SECONDARY_REGION for the Lambdas")
+    parser.add_argument("--write-mode", default=timestream_common.TIMESTREAM_WRITE_MODE, choices=TimestreamWriter.MODES,
+                        help="How the secondary region is used, as TIMESTREAM_WRITE_MODE for the Lambdas")
+    parser.add_argument("--table", action="append", choices=TABLES, help="Table to rebuild (repeatable, default all)")
+    parser.add_argument("--since", type=parse_hour, help="First partition to backfill, YYYY/MM/DD/HH")
+    parser.add_argument("--until", type=parse_hour, help="Last partition to backfill, YYYY/MM/DD/HH")
+    parser.add_argument("--rate", type=float, default=RATE, help="Records per second (0 for no limit)")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS)
+    parser.add_argument("--write-threads", type=int, default=WRITE_THREADS)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="File recording completed partitions")
+    parser.add_argument("--dry-run", action="store_true", help="List the partitions that would be backfilled")
+    args = parser.parse_args()
+    
+    store = ctr_lake.open_store(args.location)
+    partitions = ctr_lake.list_partitions(store, args.prefix)
+    partitions = {
+        partition: keys for partition, keys in partitions.items()
+        if (args.since is None or parse_hour('/'.join(partition)) >= args.since)
+        and (args.until is None or parse_hour('/'.join(partition)) <= args.until)
+    }
+    
+    if args.dry_run:
+        completed = load_checkpoint(args.checkpoint)['completed']
+        for partition, keys in sorted(partitions.items()):
+            status = 'done' if '/'.join(partition) in completed else 'pending'
+            print(f"  {'/'.join(partition)}: {len(keys)} files, {status}")
+        return
+    
+    # Written like the Lambdas write, with adaptive retries that back off when the backfill is throttled
+    writer = TimestreamWriter(args.region, args.secondary_region, args.write_mode,
+                              timestream_common.TIMESTREAM_FAILOVER_SECONDS, max_connections=args.write_threads,
+                              database=args.database, retries={'max_attempts': 10, 'mode': 'adaptive'})
+    
+    totals = run_backfill(store, writer, partitions, args.table or TABLES, args.checkpoint,
+                          args.parse_workers, args.write_threads, args.rate)
+    print(f"Timestream writes: {json.dumps(writer.pop_stats())}")
+    
+    print(f"Backfilled {totals['partitions']} partitions, {totals['written']} records written, "
+          f"{totals['rejected']} rejected")
+    if totals['incomplete_partitions']:
+        print(f"{totals['incomplete_partitions']} partitions have records that need magnetic store writes or are "
+              f"in the future; they are not checkpointed, so a rerun writes them")
+    if totals['failed_partitions']:
+        sys.exit(f"{totals['failed_partitions']} partitions failed; rerun to retry them")
+
+if __name__ == "__main__":
+    main()
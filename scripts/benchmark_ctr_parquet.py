@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark Athena bytes scanned for raw JSON CTRs versus flattened Parquet
+
+Generates synthetic CTRs, writes them as Firehose would (concatenated
+JSON) and through the flattening transform (Parquet), then estimates
+the bytes Athena scans for the sample dashboard queries in
+docs/grafana_athena_setup.md. Athena reads whole JSON objects, but only
+the referenced column chunks of a Parquet file.
+
+Requires pyarrow (pip3 install pyarrow).
+"""
+import json
+import os
+import sys
+import tempfile
+
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ctr_to_parquet
+import generate_ctr_data
+from transform_ctr_record import flatten_ctr_record
+
+# Configuration
+RECORD_COUNT = 100000             # Number of CTR records to generate
+
+# Flattened columns referenced by each sample dashboard query
+DASHBOARD_QUERIES = {
+    "contacts by channel": ["channel"],
+    "avg queue duration by queue": ["queue_name", "queue_duration"],
+    "agent performance": ["agent_id", "attributes_agentname", "agent_interactionduration"],
+    "resolution breakdown": ["attributes_resolution"],
+    "hourly contact volume": ["initiationtimestamp", "year", "month", "day", "hour"],
+}
+
+# Bytes Athena would read from a Parquet file for the given columns
+def parquet_bytes_scanned(path, columns):
+    metadata = pq.ParquetFile(path).metadata
+    total = 0
+    for group in range(metadata.num_row_groups):
+        row_group = metadata.row_group(group)
+        for index in range(row_group.num_columns):
+            column = row_group.column(index)
+            if column.path_in_schema in columns:
+                total += column.total_compressed_size
+    return total
+
+def main():
+    print(f"Generating {RECORD_COUNT} CTR records")
+    records = [generate_ctr_data.generate_ctr_record() for _ in range(RECORD_COUNT)]
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        json_path = os.path.join(work_dir, "ctr.json")
+        parquet_path = os.path.join(work_dir, "ctr.parquet")
+        
+        # Firehose concatenates JSON documents without a delimiter
+        with open(json_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record))
+        
+        rows_written = ctr_to_parquet.write_parquet(
+            (flatten_ctr_record(record) for record in records), parquet_path)
+        metadata = ctr_to_parquet.verify_parquet(parquet_path, RECORD_COUNT)
+        
+        json_bytes = os.path.getsize(json_path)
+        parquet_bytes = os.path.getsize(parquet_path)
+        
+        print(f"JSON:    {json_bytes:>12} bytes")
+        print(f"Parquet: {parquet_bytes:>12} bytes, {rows_written} rows, {metadata.num_row_groups} row groups")
+        print()
+        
+        header = f"{'query':<30} {'JSON scanned':>14} {'Parquet scanned':>16} {'reduction':>10}"
+        print(header)
+        print("-" * len(header))
+        
+        for name, columns in DASHBOARD_QUERIES.items():
+            scanned = parquet_bytes_scanned(parquet_path, columns)
+            reduction = json_bytes / scanned if scanned else float('inf')
+            print(f"{name:<30} {json_bytes:>14} {scanned:>16} {reduction:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
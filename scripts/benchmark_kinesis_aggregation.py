@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark KPL aggregation and payload compression for the CTR stream
+
+Generates synthetic CTR records, packs them the way generate_ctr_data.py
+would for each aggregation/compression mode, decodes them with the
+kinesis_payload module the stream consumers share, and reports bytes
+per event, PUT payload units per event and the events per shard-second
+a single shard can take.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'terraform', 'timestream', 'lambda_code'))
+
+import generate_ctr_data
+import kinesis_payload
+
+# Configuration
+EVENT_COUNT = 5000                # Number of CTR records per mode
+BATCH_SIZE = 500                  # Records per PutRecords call (Kinesis maximum)
+
+# Kinesis per-shard write limits
+SHARD_RECORDS_PER_SECOND = 1000
+SHARD_BYTES_PER_SECOND = 1024 * 1024
+PUT_PAYLOAD_UNIT_BYTES = 25 * 1024
+
+MODES = [
+    ("plain", False, None),
+    ("gzip", False, "gzip"),
+    ("kpl", True, None),
+    ("kpl+gzip", True, "gzip"),
+]
+
+if kinesis_payload.zstandard is not None:
+    MODES += [("zstd", False, "zstd"), ("kpl+zstd", True, "zstd")]
+
+# Build the Kinesis entries for every batch in one mode
+def build_entries(records, aggregate, compression):
+    entries = []
+    for i in range(0, len(records), BATCH_SIZE):
+        batch = records[i:i + BATCH_SIZE]
+        entries.extend(generate_ctr_data.build_kinesis_records(batch, aggregate, compression))
+    return entries
+
+# Run one mode and return its metrics
+def run_mode(records, aggregate, compression):
+    entries = build_entries(records, aggregate, compression)
+    
+    total_bytes = sum(len(entry['Data']) + len(entry['PartitionKey']) for entry in entries)
+    payload_units = sum(-(-len(entry['Data']) // PUT_PAYLOAD_UNIT_BYTES) for entry in entries)
+    events_per_record = len(records) / len(entries)
+    
+    # A shard is limited by whichever of its record or byte limits is hit first
+    events_per_shard_second = min(
+        SHARD_RECORDS_PER_SECOND * events_per_record,
+        SHARD_BYTES_PER_SECOND / (total_bytes / len(records))
+    )
+    
+    # Time the consumer side decode of the same entries
+    start = time.perf_counter()
+    decoded = 0
+    for entry in entries:
+        decoded += len(kinesis_payload.decode_kinesis_payload(entry['Data']))
+    decode_seconds = time.perf_counter() - start
+    
+    if decoded != len(records):
+        raise RuntimeError(f"Decoded {decoded} events, expected {len(records)}")
+    
+    return {
+        'kinesis_records': len(entries),
+        'bytes_per_event': total_bytes / len(records),
+        'payload_units_per_event': payload_units / len(records),
+        'events_per_shard_second': events_per_shard_second,
+        'decode_events_per_second': decoded / decode_seconds,
+    }
+
+def main():
+    print(f"Generating {EVENT_COUNT} CTR records")
+    records = [generate_ctr_data.generate_ctr_record() for _ in range(EVENT_COUNT)]
+    
+    header = f"{'mode':<10} {'records':>8} {'bytes/event':>12} {'PPU/event':>10} {'events/shard-s':>15} {'decode ev/s':>12}"
+    print(header)
+    print("-" * len(header))
+    
+    for name, aggregate, compression in MODES:
+        result = run_mode(records, aggregate, compression)
+        print(f"{name:<10} {result['kinesis_records']:>8} {result['bytes_per_event']:>12.1f} "
+              f"{result['payload_units_per_event']:>10.4f} {result['events_per_shard_second']:>15.0f} "
+              f"{result['decode_events_per_second']:>12.0f}")
+
+if __name__ == "__main__":
+    main()
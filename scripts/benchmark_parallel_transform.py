@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Find the batch size at which the agent event Lambda's parallel transform pays off
+
+Builds synthetic Kinesis batches of agent events in a range of sizes and
+transforms each one through persist_agent_event, once in a single process
+and once split across TRANSFORM_PROCESSES pipe-connected workers, without
+writing anything. Reports the best of several runs for each size, the
+speedup, and the smallest batch size from which the worker processes are
+faster, which is the value to use for agent_event_transform_min_records.
+
+Run it on a machine with as many cores as the Lambda has vCPUs at its
+memory size (Lambda allocates one vCPU per 1,769 MB), or the crossover
+will not be representative.
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'terraform', 'timestream', 'lambda_code'))
+
+import persist_agent_event
+
+# Configuration defaults
+BATCH_SIZES = [100, 250, 500, 1000, 2500, 5000, 10000]   # Kinesis records per batch (10000 is the maximum)
+PROCESSES = max(2, os.cpu_count() or 1)                 # Worker processes
+AGENTS = 500                                            # Distinct agents across a batch
+REPEATS = 3                                             # Runs per size, the fastest is reported
+CONTACT_EVENTS = 4                                      # Events an agent keeps the same contacts for
+
+STATUSES = [("Available", "ROUTABLE"), ("Lunch", "CUSTOM"), ("Training", "CUSTOM"), ("Offline", "OFFLINE")]
+EVENT_TYPES = ["HEART_BEAT", "STATE_CHANGE", "CONTACTS_CHANGE"]
+
+# Build one synthetic agent event as published by Connect agent event streams
+# Each agent keeps its contacts for several events, mostly in the same state,
+# so the contact state cache suppresses rows as it does for heartbeats
+def build_agent_event(index, agents):
+    agent = index % agents
+    sequence = index // agents
+    status_name, status_type = random.choice(STATUSES)
+    contacts = [{
+        "ContactId": f"contact-{agent}-{sequence // CONTACT_EVENTS + offset}",
+        "Channel": "CHAT" if offset else "VOICE",
+        "InitiationMethod": "INBOUND",
+        "State": "CONNECTED" if sequence % CONTACT_EVENTS else "CONNECTING",
+        "StateStartTimestamp": "2024-01-01T10:00:00.000Z",
+        "ConnectedToAgentTimestamp": "2024-01-01T10:00:05.000Z",
+        "Queue": {"ARN": f"arn:aws:connect:eu-west-2:123456789012:instance/i/queue/q{agent % 5}",
+                  "Name": f"Queue {agent % 5}"}
+    } for offset in range(agent % 3)]
+    
+    return {
+        "AWSAccountId": "123456789012",
+        "InstanceId": "6e4f36f4-1b28-4725-a407-79a31c76a9b8",
+        "EventId": f"event-{index}",
+        "EventType": random.choice(EVENT_TYPES),
+        "EventTimestamp": f"2024-01-01T10:{index // 60 % 60:02d}:{index % 60:02d}.000Z",
+        "Version": "2017-10-01",
+        "Agent": {"ARN": f"arn:aws:connect:eu-west-2:123456789012:instance/i/agent/agent-{agent}"},
+        "CurrentAgentSnapshot": {
+            "AgentStatus": {"Name": status_name, "Type": status_type, "StartTimestamp": "2024-01-01T10:00:00.000Z"},
+            "Configuration": {
+                "Username": f"agent{agent}",
+                "FirstName": "Test",
+                "LastName": f"Agent {agent}",
+                "RoutingProfile": {"Name": "Basic Routing Profile"},
+                "AgentHierarchyGroups": {"Level1": {"Name": "Support"}, "Level2": {"Name": f"Team {agent % 10}"}}
+            },
+            "Contacts": contacts
+        },
+        "Contacts": contacts
+    }
+
+# Build a Kinesis batch as the Lambda receives it
+def build_batch(size, agents, compress):
+    records = []
+    for index in range(size):
+        data = json.dumps(build_agent_event(index, agents)).encode('utf-8')
+        if compress:
+            data = gzip.compress(data)
+        records.append({'kinesis': {'data': base64.b64encode(data).decode('ascii')}})
+    return records
+
+# Transform a batch with fresh caches and return the seconds taken and records built
+def time_transform(records, processes):
+    persist_agent_event.TRANSFORM_PROCESSES = processes
+    persist_agent_event.TRANSFORM_MIN_RECORDS = 0
+    persist_agent_event.contact_state_cache = persist_agent_event.ContactStateCache(
+        persist_agent_event.CONTACT_STATE_CACHE_SIZE, persist_agent_event.CONTACT_STATE_CACHE_TTL)
+    
+    built = 0
+    start = time.perf_counter()
+    for key, agent_event_records, contact_records, ctr_records in persist_agent_event.iter_processed_events(records):
+        built += len(agent_event_records) + len(contact_records) + len(ctr_records)
+    return time.perf_counter() - start, built
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the single-process and parallel agent event transform")
+    parser.add_argument("--processes", type=int, default=PROCESSES, help="Transform worker processes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=BATCH_SIZES, help="Batch sizes to compare")
+    parser.add_argument("--agents", type=int, default=AGENTS)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--gzip", action="store_true", help="Gzip each record, as with a compressed stream")
+    args = parser.parse_args()
+    
+    if args.processes < 2:
+        sys.exit("--processes must be at least 2")
+    
+    # Fork the workers up front, as a warm container would already have them
+    persist_agent_event.TRANSFORM_PROCESSES = args.processes
+    start = time.perf_counter()
+    persist_agent_event.get_transform_workers()
+    print(f"Started {args.processes} transform workers in {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"({os.cpu_count()} CPUs available)")
+    print()
+    
+    header = f"{'records':>8} {'single ms':>10} {'parallel ms':>12} {'speedup':>8}"
+    print(header)
+    print("-" * len(header))
+    
+    faster = []
+    for size in args.sizes:
+        records = build_batch(size, args.agents, args.gzip)
+        single = min(time_transform(records, 0) for _ in range(args.repeats))
+        parallel = min(time_transform(records, args.processes) for _ in range(args.repeats))
+        if single[1] != parallel[1]:
+            raise RuntimeError(f"Parallel transform built {parallel[1]} records, expected {single[1]}")
+        
+        faster.append((size, parallel[0] < single[0]))
+        print(f"{size:>8} {single[0] * 1000:>10.1f} {parallel[0] * 1000:>12.1f} {single[0] / parallel[0]:>7.2f}x")
+    
+    # The crossover is the smallest size from which every larger size is faster too
+    crossover = None
+    for size, is_faster in reversed(faster):
+        if not is_faster:
+            break
+        crossover = size
+    
+    print()
+    if crossover is None:
+        print(f"The parallel transform was not faster at any size with {args.processes} processes")
+    else:
+        print(f"The parallel transform is faster from {crossover} records per batch; "
+              f"set agent_event_transform_min_records = {crossover}")
+
+if __name__ == "__main__":
+    main()
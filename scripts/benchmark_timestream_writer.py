@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Exercise the Lambdas' Timestream writer against local stub endpoints
+
+Starts a primary and a secondary stub endpoint (stub_timestream_endpoint.py)
+with injected latency, then writes the same synthetic chunks through
+the TimestreamWriter in timestream_common.py in each scenario: a single pooled
+connection against a pool sized to the write concurrency, failover with the
+primary failing, and dual writes with a healthy and a failing secondary.
+For each scenario it reports the writer's per-region latency, the records
+each stub received, the connections opened and the chunks that failed.
+
+No AWS access is needed; the stubs are signed with dummy credentials.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', 'terraform', 'timestream', 'lambda_code'))
+
+# The stubs only need requests to be signed, not valid credentials
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'stub')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'stub')
+
+import timestream_common
+from stub_timestream_endpoint import StubEndpoint
+
+# Configuration defaults
+PRIMARY_REGION = "eu-west-1"
+SECONDARY_REGION = "eu-central-1"
+PRIMARY_LATENCY_MS = 20             # eu-west-2 to eu-west-1 round trip
+SECONDARY_LATENCY_MS = 30           # eu-west-2 to eu-central-1 round trip
+CONNECT_MS = 60                     # TCP and TLS handshake on a new connection
+CHUNKS = 200                        # Chunks of 100 records written per scenario
+CONCURRENCY = 8                     # Concurrent chunk writes (as with agent_event_pipeline_writers)
+
+# name, write mode, pool size (None for the concurrency), primary and secondary failure rates
+SCENARIOS = [
+    ("primary, 1 connection", "primary", 1, 0.0, 0.0),
+    ("primary, pooled", "primary", None, 0.0, 0.0),
+    ("failover, primary down", "failover", None, 1.0, 0.0),
+    ("dual", "dual", None, 0.0, 0.0),
+    ("dual, secondary down", "dual", None, 0.0, 1.0),
+]
+
+# Build a chunk of synthetic AgentEvent records
+def build_chunk(index, size=timestream_common.WRITE_CHUNK_SIZE):
+    now = int(time.time() * 1000)
+    return [{
+        'Dimensions': [{'Name': 'AgentARN', 'Value': f"agent-{index}-{i}"}],
+        'MeasureName': 'AgentEvent',
+        'MeasureValueType': 'MULTI',
+        'MeasureValues': [{'Name': 'EventId', 'Value': f"{index}-{i}", 'Type': 'VARCHAR'}],
+        'Time': str(now + i)
+    } for i in range(size)]
+
+# Write every chunk through the Lambda's write path and return the elapsed time and failed chunks
+def write_chunks(chunks, concurrency):
+    failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timestream_common.write_records_to_timestream, "AgentEvent", chunk)
+                   for chunk in chunks]
+        for future in futures:
+            if future.exception() is not None:
+                failed += 1
+    return time.perf_counter() - start, failed
+
+# Run one scenario with fresh stubs and a fresh writer
+def run_scenario(mode, max_connections, primary_failure, secondary_failure, args):
+    primary = StubEndpoint(PRIMARY_REGION, args.primary_latency_ms, connect_ms=args.connect_ms,
+                           failure_rate=primary_failure).start()
+    secondary = StubEndpoint(SECONDARY_REGION, args.secondary_latency_ms, connect_ms=args.connect_ms,
+                             failure_rate=secondary_failure).start()
+    try:
+        timestream_common.timestream_writer = timestream_common.TimestreamWriter(
+            PRIMARY_REGION, SECONDARY_REGION, mode, failover_seconds=60,
+            endpoint_urls={PRIMARY_REGION: primary.url, SECONDARY_REGION: secondary.url},
+            max_connections=max_connections or args.concurrency)
+        
+        chunks = [build_chunk(index) for index in range(args.chunks)]
+        # The write path logs every chunk; keep the benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, failed = write_chunks(chunks, args.concurrency)
+        return elapsed, failed, timestream_common.timestream_writer.pop_stats(), primary.summary(), secondary.summary()
+    finally:
+        primary.stop()
+        secondary.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Timestream writer against local stub endpoints")
+    parser.add_argument("--chunks", type=int, default=CHUNKS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--primary-latency-ms", type=float, default=PRIMARY_LATENCY_MS)
+    parser.add_argument("--secondary-latency-ms", type=float, default=SECONDARY_LATENCY_MS)
+    parser.add_argument("--connect-ms", type=float, default=CONNECT_MS)
+    args = parser.parse_args()
+    
+    print(f"{args.chunks} chunks of {timestream_common.WRITE_CHUNK_SIZE} records, "
+          f"{args.concurrency} concurrent writes")
+    print()
+    header = (f"{'scenario':<24} {'seconds':>8} {'failed':>7} {'region':<13} {'writes':>7} {'errors':>7} "
+              f"{'avg ms':>7} {'max ms':>7} {'stored':>8} {'conns':>6}")
+    print(header)
+    print("-" * len(header))
+    
+    for name, mode, max_connections, primary_failure, secondary_failure in SCENARIOS:
+        elapsed, failed, stats, primary, secondary = run_scenario(
+            mode, max_connections, primary_failure, secondary_failure, args)
+        
+        label = f"{name:<24} {elapsed:>8.2f} {failed:>7}"
+        for region, summary in ((PRIMARY_REGION, primary), (SECONDARY_REGION, secondary)):
+            region_stats = stats.get(region)
+            if region_stats is None:
+                continue
+            print(f"{label} {region:<13} {region_stats['writes']:>7} {region_stats['errors']:>7} "
+                  f"{region_stats['avg_ms']:>7.1f} {region_stats['max_ms']:>7.1f} "
+                  f"{sum(summary['records'].values()):>8} {summary['connections']:>6}")
+            label = " " * len(label)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Compact the small files in closed hour partitions of the CTR lake
+
+With a short Firehose buffer interval each year=/month=/day=/hour=
+partition collects hundreds of small objects, and Athena spends most
+of a query opening them. This tool merges every object in a closed
+partition into a few large compressed files, either gzip JSON (still
+readable by the raw CTR table) or flattened Parquet.
+
+Compacting in place never shows readers the inputs and the outputs of
+a partition together. Each partition is compacted as follows, so that an
+interrupted run can always be finished by running the tool again:
+
+1. Records are streamed one input object at a time into rolling local
+   output files, so memory use does not grow with the partition size.
+2. A hidden "_compaction-<run>.json" manifest lists inputs and outputs.
+3. The outputs are uploaded to a new location for the partition, under
+   --compacted-prefix, which nothing reads yet.
+4. One Glue UpdatePartition call moves the partition's Location to the
+   outputs, then the inputs (the Firehose objects and any earlier
+   compacted files) are deleted and the manifest removed. Manifests left
+   by an earlier run are finished, or rolled back if their uploads did
+   not complete, before any new work starts.
+
+Objects Firehose delivers to a compacted hour afterwards are merged by
+the next run. For a local directory, a _glue-<database>.<table>.json
+file in the lake stands in for the Glue catalog.
+
+With --output-prefix (for example to build the Parquet table from the
+raw JSON), the inputs are kept and the output partition is replaced:
+outputs are staged under hidden "_compacting-" names and renamed into
+place. Parquet is only written this way, never into the JSON table.
+
+Partitions are compacted in parallel worker processes.
+"""
+import argparse
+import datetime
+import gzip
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ctr_lake
+
+# Configuration defaults
+PREFIX = "connect-ctr-data/"       # Prefix Firehose delivers to
+COMPACTED_PREFIX = "connect-ctr-compacted/"  # Prefix in-place compaction writes new partition locations under
+DATABASE = "connect_ctr_database"  # Glue database of the raw CTR table
+TABLE = "connect_ctr_data"         # Glue table whose partition locations in-place compaction moves
+OUTPUT_FORMAT = "json-gzip"        # "json-gzip" or "parquet" (requires pyarrow)
+WORKERS = 4                        # Partitions compacted in parallel
+GRACE_MINUTES = 15                 # Wait after the hour ends before a partition counts as closed
+MIN_FILES = 2                      # Partitions with fewer visible objects are left alone
+TARGET_FILE_MB = 256               # Compressed size at which a JSON output file is rolled
+MAX_ROWS_PER_FILE = 2000000        # Rows at which a Parquet output file is rolled
+
+PARQUET_MAGIC = b'PAR1'
+OUTPUT_EXTENSIONS = {'json-gzip': '.json.gz', 'parquet': '.parquet'}
+
+# Yield the records stored in one object, which may be JSON or Parquet
+def iter_object_records(store, key, output_format):
+    data = store.read_bytes(key)
+    
+    if data.startswith(PARQUET_MAGIC):
+        if output_format != 'parquet':
+            raise ValueError(f"{key} is Parquet and can only be compacted to Parquet")
+        import pyarrow.parquet as pq
+        yield from pq.read_table(io.BytesIO(data)).to_pylist()
+        return
+    
+    for document in ctr_lake.iter_json_documents(data):
+        if output_format == 'parquet':
+            from ctr_to_parquet import flatten_ctr_record
+            yield flatten_ctr_record(document)
+        else:
+            yield document
+
+# Write records to gzip JSON files in work_dir, rolling at target_bytes
+def write_json_gzip(records, work_dir, target_bytes):
+    paths = []
+    raw = None
+    out = None
+    
+    try:
+        for record in records:
+            if out is None:
+                path = os.path.join(work_dir, f"part-{len(paths):04d}.json.gz")
+                paths.append(path)
+                raw = open(path, 'wb')
+                out = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6)
+            
+            out.write((json.dumps(record) + '\n').encode('utf-8'))
+            
+            if raw.tell() >= target_bytes:
+                out.close()
+                raw.close()
+                out = raw = None
+    finally:
+        if out is not None:
+            out.close()
+            raw.close()
+    
+    return paths
+
+# Write records to Parquet files in work_dir, rolling at max_rows rows
+def write_parquet_files(records, work_dir, max_rows):
+    import ctr_to_parquet
+    
+    paths = []
+    records = iter(records)
+    while True:
+        first = next(records, None)
+        if first is None:
+            break
+        path = os.path.join(work_dir, f"part-{len(paths):04d}.parquet")
+        ctr_to_parquet.write_parquet(itertools.chain([first], itertools.islice(records, max_rows - 1)), path)
+        paths.append(path)
+    
+    return paths
+
+# Finish the compaction a manifest records: switch the partition to the
+# new location (in place) or rename staged outputs, then delete the inputs
+def publish(store, catalog, manifest_key, manifest):
+    outputs = set(manifest['outputs'])
+    
+    if manifest.get('location'):
+        # Uploads that never completed are rolled back; the inputs are still read
+        if not all(store.exists(key) for key in manifest['outputs']):
+            store.delete(manifest['outputs'])
+            store.delete([manifest_key])
+            return False
+        
+        catalog.set_location(tuple(manifest['partition']), manifest['location'])
+        store.delete([key for key in manifest['inputs'] if key not in outputs])
+        store.delete([manifest_key])
+        return True
+    
+    pending = [(staged_key, output_key) for staged_key, output_key in zip(manifest['staged'], manifest['outputs'])
+               if not store.exists(output_key)]
+    if not all(store.exists(staged_key) for staged_key, output_key in pending):
+        store.delete(manifest['staged'])
+        store.delete([manifest_key])
+        return False
+    
+    for staged_key, output_key in pending:
+        store.rename(staged_key, output_key)
+    
+    # Replaced outputs are deleted (and the inputs, for manifests of earlier in-place runs)
+    obsolete = manifest['replaces'] + (manifest['inputs'] if manifest.get('delete_inputs') else [])
+    store.delete([key for key in obsolete if key not in outputs])
+    store.delete([manifest_key])
+    return True
+
+# Finish any compaction a previous run left half way, and remove orphaned staged files
+def recover(store, catalog, prefix):
+    manifests = 0
+    orphans = []
+    
+    for key in store.list_keys(prefix):
+        name = os.path.basename(key)
+        if name.startswith('_compaction-') and name.endswith('.json'):
+            publish(store, catalog, key, json.loads(store.read_bytes(key)))
+            manifests += 1
+        elif name.startswith('_compacting-'):
+            orphans.append(key)
+    
+    # Staged files whose manifest was published have been renamed by now
+    orphans = [key for key in orphans if store.exists(key)]
+    store.delete(orphans)
+    
+    return manifests, len(orphans)
+
+# Compact one partition into new files and write the manifest that publishes them
+def compact_partition(store, partition, keys, output_prefix, output_format, in_place=True,
+                      target_bytes=TARGET_FILE_MB * 1024 * 1024, max_rows=MAX_ROWS_PER_FILE):
+    start = time.time()
+    run_id = uuid.uuid4().hex[:12]
+    extension = OUTPUT_EXTENSIONS[output_format]
+    counter = {'records': 0}
+
+    def records():
+        for key in keys:
+            for record in iter_object_records(store, key, output_format):
+                counter['records'] += 1
+                yield record
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        if output_format == 'parquet':
+            paths = write_parquet_files(records(), work_dir, max_rows)
+        else:
+            paths = write_json_gzip(records(), work_dir, target_bytes)
+        
+        if in_place:
+            # A location of its own, which readers only see once the partition is moved to it
+            location = ctr_lake.partition_prefix(f"{output_prefix}{run_id}/", partition)
+            manifest = {
+                'partition': list(partition),
+                'location': location,
+                'inputs': keys,
+                'outputs': [f"{location}part-{index:04d}{extension}" for index in range(len(paths))],
+                'records': counter['records'],
+            }
+            uploads = manifest['outputs']
+        else:
+            # Outputs already in a separate output partition are replaced, not added to
+            partition_key_prefix = ctr_lake.partition_prefix(output_prefix, partition)
+            manifest = {
+                'inputs': keys,
+                'replaces': [key for key in store.list_keys(partition_key_prefix) if not ctr_lake.is_hidden(key)],
+                'staged': [f"{partition_key_prefix}_compacting-{run_id}-{index:04d}{extension}"
+                           for index in range(len(paths))],
+                'outputs': [f"{partition_key_prefix}compacted-{run_id}-{index:04d}{extension}"
+                            for index in range(len(paths))],
+                'records': counter['records'],
+            }
+            uploads = manifest['staged']
+        
+        # The manifest comes first, so an interrupted upload can be rolled back
+        manifest_key = f"{output_prefix}_compaction-{run_id}.json"
+        store.write_bytes(manifest_key, json.dumps(manifest).encode('utf-8'))
+        for path, key in zip(paths, uploads):
+            store.put_file(path, key)
+        output_bytes = sum(os.path.getsize(path) for path in paths)
+    
+    return {
+        'partition': '/'.join(partition),
+        'input_files': len(keys),
+        'output_files': len(paths),
+        'records': counter['records'],
+        'output_bytes': output_bytes,
+        'seconds': time.time() - start,
+        'manifest_key': manifest_key,
+        'manifest': manifest,
+    }
+
+# Add the files at each partition's current location to its Firehose objects,
+# so objects delivered after a compaction are merged with its outputs
+def in_place_inputs(store, prefix, partitions, locations):
+    inputs = {}
+    for partition, keys in partitions.items():
+        location = locations.get(partition, ctr_lake.partition_prefix(prefix, partition))
+        if location != ctr_lake.partition_prefix(prefix, partition):
+            keys = [key for key in store.list_keys(location) if not ctr_lake.is_hidden(key)] + keys
+        inputs[partition] = keys
+    return inputs
+
+# Pick the partitions that are closed and still fragmented
+def select_partitions(partitions, now, grace_minutes, min_files, only=None):
+    selected = {}
+    for partition, keys in sorted(partitions.items()):
+        if only and '/'.join(partition) not in only:
+            continue
+        if ctr_lake.partition_end(partition) + datetime.timedelta(minutes=grace_minutes) > now:
+            continue
+        if len(keys) < min_files:
+            continue
+        selected[partition] = keys
+    return selected
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact small files in closed CTR lake partitions")
+    parser.add_argument("location", help="s3://bucket or a local directory laid out like the bucket")
+    parser.add_argument("--prefix", default=PREFIX, help="Prefix holding the partitions to compact")
+    parser.add_argument("--output-prefix", help="Prefix of a separate table to write compacted files to "
+                        "(by default partitions are compacted in place)")
+    parser.add_argument("--compacted-prefix", default=COMPACTED_PREFIX,
+                        help="Prefix under which in-place compaction writes the new partition locations")
+    parser.add_argument("--database", default=DATABASE, help="Glue database of the table compacted in place")
+    parser.add_argument("--table", default=TABLE, help="Glue table whose partition locations are moved")
+    parser.add_argument("--region", help="AWS region of the bucket and the Glue catalog")
+    parser.add_argument("--format", default=OUTPUT_FORMAT, choices=sorted(OUTPUT_EXTENSIONS))
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--grace-minutes", type=int, default=GRACE_MINUTES)
+    parser.add_argument("--min-files", type=int, default=MIN_FILES)
+    parser.add_argument("--target-file-mb", type=int, default=TARGET_FILE_MB)
+    parser.add_argument("--partition", action="append", help="Only compact YYYY/MM/DD/HH (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="List the partitions that would be compacted")
+    args = parser.parse_args()
+    
+    in_place = not args.output_prefix or args.output_prefix == args.prefix
+    if in_place and args.format == 'parquet':
+        parser.error("--format parquet would mix Parquet into the JSON table's partitions; "
+                     "write it to the Parquet table with --output-prefix")
+    
+    store = ctr_lake.open_store(args.location, args.region)
+    catalog = ctr_lake.open_catalog(store, args.database, args.table, args.region) if in_place else None
+    output_prefix = args.compacted_prefix if in_place else args.output_prefix
+    
+    manifests, orphans = recover(store, catalog, output_prefix)
+    if manifests or orphans:
+        print(f"Finished {manifests} interrupted compactions, removed {orphans} orphaned files")
+    
+    partitions = ctr_lake.list_partitions(store, args.prefix)
+    if in_place:
+        partitions = in_place_inputs(store, args.prefix, partitions, catalog.locations())
+    
+    now = datetime.datetime.now(datetime.timezone.utc)
+    partitions = select_partitions(partitions, now, args.grace_minutes, args.min_files, args.partition)
+    
+    # When converting to another prefix, skip partitions converted before unless asked for
+    if not in_place and not args.partition:
+        converted = ctr_lake.list_partitions(store, output_prefix)
+        partitions = {partition: keys for partition, keys in partitions.items() if partition not in converted}
+    
+    print(f"{len(partitions)} partitions to compact in {store}")
+    if args.dry_run:
+        for partition, keys in partitions.items():
+            print(f"  {'/'.join(partition)}: {len(keys)} files")
+        return
+    
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(compact_partition, store, partition, keys, output_prefix,
+                            args.format, in_place, args.target_file_mb * 1024 * 1024): partition
+            for partition, keys in partitions.items()
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+                # Publishing from this process keeps catalog updates one at a time
+                if not publish(store, catalog, result['manifest_key'], result['manifest']):
+                    raise RuntimeError("outputs missing after upload")
+                print(f"{result['partition']}: {result['input_files']} files -> {result['output_files']} "
+                      f"({result['records']} records, {result['output_bytes']} bytes, {result['seconds']:.1f}s)")
+            except Exception as e:
+                failed += 1
+                print(f"Error compacting {'/'.join(futures[future])}: {str(e)}")
+    
+    if failed:
+        sys.exit(f"{failed} partitions failed; rerun to retry them")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Access to the partitioned CTR data lake
+
+Firehose delivers CTRs under year=YYYY/month=MM/day=DD/hour=HH/ prefixes.
+The stores here expose the same key layout for an S3 bucket and for a
+local directory, so the lake tools in this directory can be run and
+tested offline against a copy of the bucket on disk.
+"""
+import datetime
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import sys
+
+# Documents are parsed with the module the Lambdas reading the stream use
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'terraform', 'timestream', 'lambda_code'))
+
+from kinesis_payload import parse_json_documents
+
+PARTITION_PATTERN = re.compile(r'year=(\d{4})/month=(\d{2})/day=(\d{2})/hour=(\d{2})/')
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Object names starting with these are ignored by Athena and Glue
+HIDDEN_PREFIXES = ('_', '.')
+
+class LocalStore:
+    """A directory laid out like the S3 bucket, keys relative to the root"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def __repr__(self):
+        return f"LocalStore({self.root!r})"
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def list_keys(self, prefix=''):
+        # Walk from the deepest directory in the prefix, then filter like S3 does
+        start = self.path(prefix.rsplit('/', 1)[0]) if '/' in prefix else self.root
+        
+        keys = []
+        for root, dirs, names in os.walk(start):
+            dirs.sort()
+            for name in sorted(names):
+                relative = os.path.relpath(os.path.join(root, name), self.root)
+                keys.append(relative.replace(os.sep, '/'))
+        return [key for key in keys if key.startswith(prefix)]
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def read_bytes(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def write_bytes(self, key, data):
+        self.put_file_from(io.BytesIO(data), key)
+
+    def put_file(self, local_path, key):
+        with open(local_path, 'rb') as f:
+            self.put_file_from(f, key)
+
+    def put_file_from(self, fileobj, key):
+        # Write to a temporary name and rename so readers never see a partial object
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp-{os.getpid()}"
+        with open(temp_path, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+        os.replace(temp_path, path)
+
+    def rename(self, source_key, target_key):
+        target = self.path(target_key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(self.path(source_key), target)
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+class S3Store:
+    """An S3 bucket; the boto3 client is created lazily so stores can be sent to worker processes"""
+
+    def __init__(self, bucket, region=None):
+        self.bucket = bucket
+        self.region = region
+        self._client = None
+
+    def __repr__(self):
+        return f"S3Store({self.bucket!r})"
+
+    def __getstate__(self):
+        return {'bucket': self.bucket, 'region': self.region, '_client': None}
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('s3', region_name=self.region)
+        return self._client
+
+    def list_keys(self, prefix=''):
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(item['Key'] for item in page.get('Contents', []))
+        return keys
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def read_bytes(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def write_bytes(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def put_file(self, local_path, key):
+        self.client.upload_file(local_path, self.bucket, key)
+
+    def rename(self, source_key, target_key):
+        self.client.copy_object(Bucket=self.bucket, Key=target_key,
+                                CopySource={'Bucket': self.bucket, 'Key': source_key})
+        self.delete([source_key])
+
+    def delete(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True}
+            )
+
+    def exists(self, key):
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=key, MaxKeys=1)
+        return any(item['Key'] == key for item in response.get('Contents', []))
+
+# Open a store from an s3://bucket URL or a local directory path
+def open_store(location, region=None):
+    if location.startswith('s3://'):
+        return S3Store(location[len('s3://'):].split('/')[0], region)
+    return LocalStore(location)
+
+class GlueCatalog:
+    """Partition locations of a Glue table, as key prefixes in its bucket"""
+
+    def __init__(self, database, table, bucket, region=None):
+        self.database = database
+        self.table = table
+        self.bucket = bucket
+        self.region = region
+        self._client = None
+
+    def __getstate__(self):
+        return dict(self.__dict__, _client=None)
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('glue', region_name=self.region)
+        return self._client
+
+    def locations(self):
+        locations = {}
+        base = f"s3://{self.bucket}/"
+        paginator = self.client.get_paginator('get_partitions')
+        for page in paginator.paginate(DatabaseName=self.database, TableName=self.table):
+            for partition in page['Partitions']:
+                location = partition['StorageDescriptor'].get('Location', '')
+                if location.startswith(base):
+                    locations[tuple(partition['Values'])] = location[len(base):].rstrip('/') + '/'
+        return locations
+
+    def set_location(self, partition, location):
+        # One UpdatePartition call moves every reader to the new location at once
+        values = list(partition)
+        try:
+            current = self.client.get_partition(DatabaseName=self.database, TableName=self.table,
+                                                PartitionValues=values)['Partition']
+        except self.client.exceptions.EntityNotFoundException:
+            current = None
+        
+        if current is None:
+            descriptor = self.client.get_table(DatabaseName=self.database, Name=self.table)['Table']['StorageDescriptor']
+            storage = {key: descriptor[key] for key in ('Columns', 'InputFormat', 'OutputFormat', 'SerdeInfo',
+                                                        'Compressed', 'Parameters') if key in descriptor}
+            storage['Location'] = f"s3://{self.bucket}/{location}"
+            self.client.create_partition(DatabaseName=self.database, TableName=self.table,
+                                         PartitionInput={'Values': values, 'StorageDescriptor': storage})
+            return
+        
+        storage = dict(current['StorageDescriptor'], Location=f"s3://{self.bucket}/{location}")
+        partition_input = {'Values': values, 'StorageDescriptor': storage}
+        if current.get('Parameters'):
+            partition_input['Parameters'] = current['Parameters']
+        self.client.update_partition(DatabaseName=self.database, TableName=self.table,
+                                     PartitionValueList=values, PartitionInput=partition_input)
+
+class FileCatalog:
+    """Partition locations of a local lake's table, kept in a JSON file in the lake
+    
+    Stands in for the Glue catalog offline. Partitions missing from the
+    file are read from their Firehose prefix.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def locations(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return {tuple(value.split('/')): location for value, location in json.load(f).items()}
+
+    def set_location(self, partition, location):
+        locations = {'/'.join(values): value for values, value in self.locations().items()}
+        locations['/'.join(partition)] = location
+        temp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(temp_path, 'w') as f:
+            json.dump(locations, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+# Open the partition catalog of a table: Glue for a bucket, a file in the lake for a directory
+def open_catalog(store, database, table, region=None):
+    if isinstance(store, S3Store):
+        return GlueCatalog(database, table, store.bucket, region)
+    return FileCatalog(store.path(f"_glue-{database}.{table}.json"))
+
+# Return the visible keys a table reads for each partition under its prefix,
+# following the catalog for partitions moved elsewhere (e.g. by compaction)
+def list_table_partitions(store, prefix, locations):
+    partitions = list_partitions(store, prefix)
+    for partition, location in locations.items():
+        if location != partition_prefix(prefix, partition):
+            partitions[partition] = [key for key in store.list_keys(location) if not is_hidden(key)]
+    return partitions
+
+# Return True for objects Athena and Glue skip (temporary and marker files)
+def is_hidden(key):
+    return os.path.basename(key).startswith(HIDDEN_PREFIXES) or '.tmp-' in key
+
+# Return the (year, month, day, hour) partition of a key, or None
+def partition_of(key):
+    match = PARTITION_PATTERN.search(key)
+    return match.groups() if match else None
+
+# Build the key prefix of a partition under a base prefix
+def partition_prefix(prefix, partition):
+    year, month, day, hour = partition
+    return f"{prefix}year={year}/month={month}/day={day}/hour={hour}/"
+
+# Return the UTC time at which a partition's hour ends
+def partition_end(partition):
+    year, month, day, hour = (int(part) for part in partition)
+    return datetime.datetime(year, month, day, hour, tzinfo=datetime.timezone.utc) + datetime.timedelta(hours=1)
+
+# Group the visible objects under a prefix by partition
+def list_partitions(store, prefix):
+    partitions = {}
+    for key in store.list_keys(prefix):
+        partition = partition_of(key[len(prefix):])
+        if partition is not None and not is_hidden(key):
+            partitions.setdefault(partition, []).append(key)
+    return partitions
+
+# Parse every JSON document in an object body (gzip, NDJSON and concatenated JSON all work)
+def iter_json_documents(data):
+    if data.startswith(GZIP_MAGIC):
+        data = gzip.decompress(data)
+    return iter(parse_json_documents(data.decode('utf-8')))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Convert raw CTR JSON into flattened, compressed Parquet
+
+Runs the same flattening as the Firehose transform Lambda
+(terraform/data_pipeline/lambda_code/transform_ctr_record.py) so the
+columnar layout can be produced and checked locally: JSON in, Parquet
+out, with the schema and row counts verified after writing.
+
+Requires pyarrow (pip3 install pyarrow).
+"""
+import argparse
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'terraform', 'data_pipeline', 'lambda_code'))
+# The transform decodes payloads with the module it shares with the Timestream Lambdas
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'terraform', 'timestream', 'lambda_code'))
+
+import ctr_lake
+from transform_ctr_record import CTR_COLUMNS, flatten_ctr_record
+
+# Parquet layout tuned for Athena: large row groups keep per-file and
+# per-row-group overhead low while still allowing parallel splits
+COMPRESSION = "snappy"
+ROW_GROUP_BYTES = 128 * 1024 * 1024
+MIN_ROW_GROUP_ROWS = 10000
+SAMPLE_ROWS = 1000
+
+ARROW_TYPES = {
+    'string': pa.string(),
+    'bigint': pa.int64(),
+    'timestamp': pa.timestamp('ms', tz='UTC'),
+}
+
+# Build the Arrow schema matching the Glue table columns
+def build_arrow_schema():
+    return pa.schema([(name, ARROW_TYPES[column_type]) for name, column_type in CTR_COLUMNS])
+
+# Yield every JSON document in a file (Firehose concatenates them, NDJSON also works)
+def read_json_documents(path):
+    with open(path, 'rb') as f:
+        return ctr_lake.iter_json_documents(f.read())
+
+# List the JSON files under a file or directory path, in a stable order
+def list_json_files(path):
+    if os.path.isfile(path):
+        return [path]
+    
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            if not name.startswith('.') and not name.endswith('.parquet'):
+                files.append(os.path.join(root, name))
+    return files
+
+# Yield flattened rows from every CTR found under the input path
+def iter_flattened_rows(input_path):
+    for path in list_json_files(input_path):
+        for document in read_json_documents(path):
+            yield flatten_ctr_record(document)
+
+# Turn a list of flattened rows into an Arrow table
+def rows_to_table(rows, schema):
+    columns = {name: [row.get(name) for row in rows] for name in schema.names}
+    return pa.Table.from_pydict(columns, schema=schema)
+
+# Stream flattened rows into a Parquet file, one row group at a time
+def write_parquet(rows, output_path, compression=COMPRESSION, row_group_bytes=ROW_GROUP_BYTES):
+    schema = build_arrow_schema()
+    writer = pq.ParquetWriter(output_path, schema, compression=compression)
+    rows_written = 0
+    rows_per_group = None
+    buffer = []
+    
+    try:
+        for row in rows:
+            buffer.append(row)
+            
+            # Size row groups from the in-memory width of the first sample
+            if rows_per_group is None and len(buffer) >= SAMPLE_ROWS:
+                sample = rows_to_table(buffer, schema)
+                bytes_per_row = max(1, sample.nbytes // sample.num_rows)
+                rows_per_group = max(MIN_ROW_GROUP_ROWS, row_group_bytes // bytes_per_row)
+            
+            if rows_per_group is not None and len(buffer) >= rows_per_group:
+                writer.write_table(rows_to_table(buffer, schema))
+                rows_written += len(buffer)
+                buffer = []
+        
+        if buffer or rows_written == 0:
+            writer.write_table(rows_to_table(buffer, schema))
+            rows_written += len(buffer)
+    finally:
+        writer.close()
+    
+    return rows_written
+
+# Check a written Parquet file has the expected schema and row count
+def verify_parquet(output_path, expected_rows):
+    parquet_file = pq.ParquetFile(output_path)
+    schema = parquet_file.schema_arrow
+    
+    if not schema.equals(build_arrow_schema()):
+        raise ValueError(f"Schema mismatch in {output_path}:\n{schema}")
+    
+    if parquet_file.metadata.num_rows != expected_rows:
+        raise ValueError(f"Row count mismatch in {output_path}: "
+                         f"{parquet_file.metadata.num_rows} != {expected_rows}")
+    
+    return parquet_file.metadata
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert raw CTR JSON to flattened Parquet")
+    parser.add_argument("input", help="JSON file or directory of Firehose output")
+    parser.add_argument("output", help="Parquet file to write")
+    parser.add_argument("--compression", default=COMPRESSION, help="Parquet codec (snappy, gzip, zstd)")
+    args = parser.parse_args()
+    
+    rows_written = write_parquet(iter_flattened_rows(args.input), args.output, args.compression)
+    metadata = verify_parquet(args.output, rows_written)
+    
+    print(f"Wrote {rows_written} rows in {metadata.num_row_groups} row groups to {args.output}")
+    print(f"Output size: {os.path.getsize(args.output)} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Generate Amazon Connect contact event lifecycles for load testing persist_contact_event
+
+Simulates contacts arriving at random and moving through INITIATED,
+QUEUED, CONNECTED_TO_AGENT and DISCONNECTED, with lognormal IVR, queue
+wait and handle times. A share of queued contacts abandon, and a share
+of connected contacts are transferred: the original contact disconnects
+and a new TRANSFER contact is queued elsewhere. Contacts arrive at the
+rate that produces --rate events per second, so at realistic timings
+thousands of contacts are in flight at once; --time-scale shortens every
+duration for quicker tests. The simulation is warmed up first, so the
+run starts with the steady-state number of contacts in flight.
+
+Events are wrapped in the EventBridge "Amazon Connect Contact Event"
+envelope with the detail fields persist_contact_event reads, and sent on
+the simulated schedule (or as fast as possible with --max-speed) to:
+
+- file: one envelope per line, to a file or stdout
+- eventbridge: PutEvents, 10 entries per call. Custom events cannot use
+  the aws.connect source, so add --source to contact_event_sources in
+  the Timestream module first
+- handler: persist_contact_event.lambda_handler, called in --containers
+  processes that each stand in for a warm Lambda container, writing to a
+  local stub Timestream endpoint unless --no-stub is given
+
+A share of events can be delayed behind later ones (--out-of-order) or
+delivered twice (--duplicates), as EventBridge may do. The run reports
+the events sent against the target rate and, for the handler sink, the
+per-event handler latency, the delay from each event's scheduled time
+to the end of its invocation, and Timestream writes per second.
+"""
+import argparse
+import contextlib
+import heapq
+import json
+import math
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', 'terraform', 'timestream', 'lambda_code'))
+
+# Configuration defaults
+RATE = 100                          # Target events per second
+DURATION = 60                       # Seconds of events to send
+TIME_SCALE = 1.0                    # Divides every simulated duration
+SINK = "file"                       # file, eventbridge or handler
+OUTPUT = "-"                        # File sink path ("-" for stdout)
+CONTAINERS = 1                      # Handler sink processes
+STUB_LATENCY_MS = 20                # Stub Timestream write latency for the handler sink
+OUT_OF_ORDER = 0.0                  # Share of events delayed behind later ones
+DUPLICATES = 0.0                    # Share of events delivered twice
+REORDER_SECONDS = 5                 # Maximum delay of an out-of-order event or duplicate
+REGION = "eu-west-2"                # Region of the Connect instance and event bus
+EVENT_BUS = "default"               # Event bus for the eventbridge sink
+CONNECT_SOURCE = "aws.connect"      # Source of real Connect events
+LOAD_TEST_SOURCE = "connect.loadtest"  # Default source for PutEvents
+
+ACCOUNT_ID = "123456789012"
+INSTANCE_ARN = f"arn:aws:connect:{REGION}:{ACCOUNT_ID}:instance/6e4f36f4-1b28-4725-a407-79a31c76a9b8"
+DETAIL_TYPE = "Amazon Connect Contact Event"
+
+# Contact mix and timing: (median seconds, sigma) of lognormal distributions
+CHANNELS = [("VOICE", 0.7), ("CHAT", 0.25), ("TASK", 0.05)]
+QUEUES = ["GeneralQueue", "SalesQueue", "SupportQueue", "BillingQueue", "TechnicalQueue"]
+AGENTS = 500
+IVR_TIME = (15, 0.5)                # Initiation to QUEUED
+QUEUE_WAIT = (30, 1.0)              # QUEUED to CONNECTED_TO_AGENT
+HANDLE_TIME = (240, 0.6)            # CONNECTED_TO_AGENT to DISCONNECTED
+TRANSFER_QUEUE_TIME = (2, 0.3)      # Transfer to QUEUED on the new contact
+ABANDON_RATE = 0.08                 # Share of queued contacts that hang up before an agent answers
+TRANSFER_RATE = 0.1                 # Share of connected contacts transferred to another queue
+MAX_TRANSFERS = 3                   # Transfers in one chain
+
+# PutEvents accepts at most 10 entries per call
+PUT_EVENTS_BATCH = 10
+
+# Format epoch seconds as a Connect timestamp
+def iso_timestamp(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+# Draw a duration from a (median, sigma) lognormal
+def draw(distribution, time_scale):
+    median, sigma = distribution
+    return random.lognormvariate(math.log(median), sigma) / time_scale
+
+# Mean of a (median, sigma) lognormal
+def mean(distribution):
+    median, sigma = distribution
+    return median * math.exp(sigma * sigma / 2)
+
+# Events per arriving contact, including the contacts its transfers create
+def events_per_arrival(abandon_rate, transfer_rate):
+    # INITIATED and QUEUED, then DISCONNECTED, or CONNECTED_TO_AGENT and DISCONNECTED
+    events = 2 + abandon_rate + (1 - abandon_rate) * 2
+    return events / (1 - (1 - abandon_rate) * transfer_rate)
+
+# Simulates contacts and yields their events in time order
+class ContactSimulator:
+    def __init__(self, rate, time_scale, abandon_rate, transfer_rate):
+        self.time_scale = time_scale
+        self.abandon_rate = abandon_rate
+        self.transfer_rate = transfer_rate
+        self.arrival_rate = rate / events_per_arrival(abandon_rate, transfer_rate)
+        # Abandoned contacts leave part way through the wait, transferred ones part way through handling
+        self.lifetime = (mean(IVR_TIME) + abandon_rate * mean(QUEUE_WAIT) / 2 +
+                         (1 - abandon_rate) * (mean(QUEUE_WAIT) + mean(HANDLE_TIME) * (1 - transfer_rate / 2))) / time_scale
+        self.origin = time.time()
+        self.timeline = []
+        self.sequence = 0
+        self.next_arrival = 0.0
+        self.active = 0
+        self.counters = {'contacts': 0, 'transfers': 0, 'abandons': 0}
+    
+    # Contacts in flight at steady state (Little's law)
+    def expected_concurrency(self):
+        return self.arrival_rate * self.lifetime / (1 - (1 - self.abandon_rate) * self.transfer_rate)
+    
+    # Yield (time, detail) from start to end, in time order
+    def events(self, start, end):
+        self.next_arrival = start
+        while True:
+            while not self.timeline or self.next_arrival <= self.timeline[0][0]:
+                self.add_contact(self.next_arrival)
+                self.next_arrival += random.expovariate(self.arrival_rate)
+            
+            event_time, _, detail = heapq.heappop(self.timeline)
+            if event_time > end:
+                return
+            
+            if detail['EventType'] == 'INITIATED':
+                self.active += 1
+            elif detail['EventType'] == 'DISCONNECTED':
+                self.active -= 1
+            yield event_time, detail
+
+    def timestamp(self, event_time):
+        return iso_timestamp(self.origin + event_time)
+
+    def schedule(self, event_time, state, event_type, **fields):
+        detail = dict(state, EventType=event_type, EventTimestamp=self.timestamp(event_time), **fields)
+        heapq.heappush(self.timeline, (event_time, self.sequence, detail))
+        self.sequence += 1
+    
+    # Schedule the lifecycle of one contact, and of the contacts it is transferred to
+    def add_contact(self, start, previous=None, transfers=0):
+        # Contacts started during the warm-up are not counted
+        if start >= 0:
+            self.counters['contacts'] += 1
+        channel = previous['Channel'] if previous else random.choices(
+            [name for name, _ in CHANNELS], [weight for _, weight in CHANNELS])[0]
+        state = {
+            'ContactId': str(uuid.uuid4()),
+            'InstanceArn': INSTANCE_ARN,
+            'Channel': channel,
+            'InitiationMethod': 'TRANSFER' if previous else ('API' if channel == 'TASK' else 'INBOUND'),
+            'InitiationTimestamp': self.timestamp(start)
+        }
+        if previous:
+            state['PreviousContactId'] = previous['ContactId']
+        if channel == 'VOICE':
+            state['CustomerEndpoint'] = {'Type': 'TELEPHONE_NUMBER', 'Address': f"+4420{random.randint(10000000, 99999999)}"}
+            state['SystemEndpoint'] = {'Type': 'TELEPHONE_NUMBER', 'Address': "+442000000000"}
+        self.schedule(start, state, 'INITIATED')
+        
+        # Queue, avoiding the queue the contact was transferred from
+        queued = start + draw(TRANSFER_QUEUE_TIME if previous else IVR_TIME, self.time_scale)
+        queue_name = random.choice([name for name in QUEUES if not previous or name != previous['Queue']['Name']])
+        queue = {
+            'Name': queue_name,
+            'ARN': f"{INSTANCE_ARN}/queue/{queue_name.lower()}",
+            'EnqueueTimestamp': self.timestamp(queued)
+        }
+        state['Queue'] = queue
+        self.schedule(queued, state, 'QUEUED')
+        
+        wait = draw(QUEUE_WAIT, self.time_scale)
+        if random.random() < self.abandon_rate:
+            if start >= 0:
+                self.counters['abandons'] += 1
+            abandoned = queued + random.uniform(0, wait)
+            state['Queue'] = dict(queue, DequeueTimestamp=self.timestamp(abandoned))
+            self.schedule(abandoned, state, 'DISCONNECTED', DisconnectTimestamp=self.timestamp(abandoned))
+            return
+        
+        connected = queued + wait
+        state['Queue'] = dict(queue, DequeueTimestamp=self.timestamp(connected))
+        state['Agent'] = {
+            'ARN': f"{INSTANCE_ARN}/agent/agent-{random.randrange(AGENTS)}",
+            'ConnectedToAgentTimestamp': self.timestamp(connected)
+        }
+        self.schedule(connected, state, 'CONNECTED_TO_AGENT')
+        
+        handle = draw(HANDLE_TIME, self.time_scale)
+        if transfers < MAX_TRANSFERS and random.random() < self.transfer_rate:
+            # The agent transfers part way through; Connect starts a new contact
+            if start >= 0:
+                self.counters['transfers'] += 1
+            transferred = connected + random.uniform(0.2, 0.8) * handle
+            self.schedule(transferred, state, 'DISCONNECTED', DisconnectTimestamp=self.timestamp(transferred))
+            self.add_contact(transferred, state, transfers + 1)
+            return
+        
+        disconnected = connected + handle
+        self.schedule(disconnected, state, 'DISCONNECTED', DisconnectTimestamp=self.timestamp(disconnected))
+
+# Wrap a contact event detail in an EventBridge envelope
+def build_envelope(detail, source, event_time):
+    return {
+        'version': '0',
+        'id': str(uuid.uuid4()),
+        'detail-type': DETAIL_TYPE,
+        'source': source,
+        'account': ACCOUNT_ID,
+        'time': iso_timestamp(event_time)[:19] + "Z",
+        'region': REGION,
+        'resources': [INSTANCE_ARN],
+        'detail': detail
+    }
+
+# Writes each envelope as a line of JSON
+class FileSink:
+    def __init__(self, path):
+        self.file = sys.stdout if path == "-" else open(path, "w")
+        self.sent = 0
+
+    def send(self, envelope, scheduled):
+        self.file.write(json.dumps(envelope) + "\n")
+        self.sent += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+        return {'sent': self.sent}
+
+# Sends envelopes to an event bus with PutEvents
+class EventBridgeSink:
+    def __init__(self, region, event_bus):
+        import boto3
+        self.client = boto3.client('events', region_name=region)
+        self.event_bus = event_bus
+        self.entries = []
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, envelope, scheduled):
+        self.entries.append({
+            'Time': datetime.fromisoformat(envelope['time'].replace('Z', '+00:00')),
+            'Source': envelope['source'],
+            'Resources': envelope['resources'],
+            'DetailType': envelope['detail-type'],
+            'Detail': json.dumps(envelope['detail']),
+            'EventBusName': self.event_bus
+        })
+        if len(self.entries) >= PUT_EVENTS_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.entries:
+            return
+        try:
+            response = self.client.put_events(Entries=self.entries)
+            self.failed += response.get('FailedEntryCount', 0)
+        except Exception as e:
+            print(f"PutEvents failed: {str(e)}", file=sys.stderr)
+            self.failed += len(self.entries)
+        self.sent += len(self.entries)
+        self.entries = []
+
+    def close(self):
+        self.flush()
+        return {'sent': self.sent, 'failed': self.failed}
+
+# Invoke the handler for each event received, as one warm Lambda container
+def run_container(events, results):
+    import persist_contact_event
+    
+    handler_ms = []
+    delay_ms = []
+    errors = 0
+    # The handler logs every event; discard it as CloudWatch would keep it
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            scheduled, envelope = item
+            start = time.perf_counter()
+            try:
+                persist_contact_event.lambda_handler(envelope, None)
+            except Exception:
+                errors += 1
+            end = time.perf_counter()
+            handler_ms.append((end - start) * 1000)
+            delay_ms.append((time.time() - scheduled) * 1000)
+    results.put((handler_ms, delay_ms, errors))
+
+# Calls persist_contact_event.lambda_handler in worker processes
+class HandlerSink:
+    def __init__(self, containers, stub_latency_ms):
+        self.endpoint = None
+        if stub_latency_ms is not None:
+            from stub_timestream_endpoint import StubEndpoint
+            # The stub only needs requests to be signed, not valid credentials
+            os.environ.setdefault('AWS_ACCESS_KEY_ID', 'stub')
+            os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'stub')
+            region = os.environ.setdefault('TIMESTREAM_REGION', 'eu-west-1')
+            self.endpoint = StubEndpoint(region, stub_latency_ms, jitter_ms=stub_latency_ms / 4).start()
+            os.environ['TIMESTREAM_ENDPOINT_URLS'] = json.dumps({region: self.endpoint.url})
+            # Write the catalog too, as the deployed Lambda does
+            os.environ.setdefault('DIMENSION_CATALOG_TABLE', 'DimensionCatalog')
+        
+        self.events = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.containers = [multiprocessing.Process(target=run_container, args=(self.events, self.results), daemon=True)
+                           for _ in range(containers)]
+        for container in self.containers:
+            container.start()
+        self.sent = 0
+        self.start = time.time()
+
+    def send(self, envelope, scheduled):
+        self.events.put((scheduled, envelope))
+        self.sent += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        for _ in self.containers:
+            self.events.put(None)
+        handler_ms, delay_ms, errors = [], [], 0
+        for _ in self.containers:
+            container_handler_ms, container_delay_ms, container_errors = self.results.get()
+            handler_ms.extend(container_handler_ms)
+            delay_ms.extend(container_delay_ms)
+            errors += container_errors
+        for container in self.containers:
+            container.join()
+        elapsed = time.time() - self.start
+        
+        stats = {'sent': self.sent, 'errors': errors, 'elapsed': elapsed,
+                 'handler_ms': handler_ms, 'delay_ms': delay_ms}
+        if self.endpoint is not None:
+            stats['timestream'] = self.endpoint.summary()
+            self.endpoint.stop()
+        return stats
+
+# Percentile of a list of values (nearest rank)
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+# Send the simulated events to a sink on schedule and return the generator's counters
+def run(simulator, sink, args):
+    warmup = 3 * simulator.lifetime
+    start = time.time()
+    simulator.origin = start
+    counters = {'events': 0, 'delayed': 0, 'duplicates': 0, 'peak_active': 0, 'max_lag': 0.0}
+    counters.update({event_type: 0 for event_type in ('INITIATED', 'QUEUED', 'CONNECTED_TO_AGENT', 'DISCONNECTED')})
+    active = []
+    
+    # Events delayed for reordering or duplicated wait here, keyed by send time
+    held = []
+    sequence = 0
+
+    def emit_until(limit):
+        while held and held[0][0] <= limit:
+            send_time, _, envelope = heapq.heappop(held)
+            emit(send_time, envelope)
+
+    def emit(send_time, envelope):
+        scheduled = start + send_time
+        if not args.max_speed:
+            wait = scheduled - time.time()
+            if wait > 0:
+                sink.flush()
+                time.sleep(wait)
+            counters['max_lag'] = max(counters['max_lag'], time.time() - scheduled)
+        sink.send(envelope, scheduled if not args.max_speed else time.time())
+        counters['events'] += 1
+    
+    for event_time, detail in simulator.events(-warmup, args.duration):
+        if event_time < 0:
+            continue
+        
+        counters[detail['EventType']] += 1
+        counters['peak_active'] = max(counters['peak_active'], simulator.active)
+        active.append(simulator.active)
+        envelope = build_envelope(detail, args.source, start + event_time)
+        emit_until(event_time)
+        
+        if random.random() < args.duplicates:
+            counters['duplicates'] += 1
+            heapq.heappush(held, (event_time + random.uniform(0, args.reorder_seconds), sequence, envelope))
+            sequence += 1
+        
+        if random.random() < args.out_of_order:
+            counters['delayed'] += 1
+            heapq.heappush(held, (event_time + random.uniform(0, args.reorder_seconds), sequence, envelope))
+            sequence += 1
+        else:
+            emit(event_time, envelope)
+    
+    emit_until(math.inf)
+    counters['elapsed'] = time.time() - start
+    counters['mean_active'] = statistics.mean(active) if active else 0
+    return counters
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Connect contact event lifecycles for load testing")
+    parser.add_argument("--rate", type=float, default=RATE, help="Target events per second")
+    parser.add_argument("--duration", type=float, default=DURATION, help="Seconds of events to send")
+    parser.add_argument("--time-scale", type=float, default=TIME_SCALE, help="Divide every contact duration by this")
+    parser.add_argument("--abandon-rate", type=float, default=ABANDON_RATE)
+    parser.add_argument("--transfer-rate", type=float, default=TRANSFER_RATE)
+    parser.add_argument("--out-of-order", type=float, default=OUT_OF_ORDER, help="Share of events delayed")
+    parser.add_argument("--duplicates", type=float, default=DUPLICATES, help="Share of events delivered twice")
+    parser.add_argument("--reorder-seconds", type=float, default=REORDER_SECONDS,
+                        help="Maximum delay of a delayed event or duplicate")
+    parser.add_argument("--sink", choices=["file", "eventbridge", "handler"], default=SINK)
+    parser.add_argument("--output", default=OUTPUT, help="File sink path (- for stdout)")
+    parser.add_argument("--event-bus", default=EVENT_BUS)
+    parser.add_argument("--region", default=REGION, help="Region of the event bus")
+    parser.add_argument("--source", help=f"Event source (default {CONNECT_SOURCE}, or {LOAD_TEST_SOURCE} for PutEvents)")
+    parser.add_argument("--containers", type=int, default=CONTAINERS, help="Handler sink processes")
+    parser.add_argument("--stub-latency-ms", type=float, default=STUB_LATENCY_MS)
+    parser.add_argument("--no-stub", action="store_true",
+                        help="Let the handler write where its environment points instead of a local stub")
+    parser.add_argument("--max-speed", action="store_true", help="Send as fast as the sink accepts")
+    parser.add_argument("--seed", type=int, help="Random seed, for a repeatable event sequence")
+    args = parser.parse_args()
+    
+    if not 0 <= args.abandon_rate <= 1 or not 0 <= args.transfer_rate < 1:
+        sys.exit("--abandon-rate must be between 0 and 1 and --transfer-rate below 1")
+    if args.source is None:
+        args.source = LOAD_TEST_SOURCE if args.sink == "eventbridge" else CONNECT_SOURCE
+    if args.sink == "eventbridge" and args.source.startswith("aws."):
+        sys.exit("PutEvents rejects sources starting with aws.; use --source with a source in contact_event_sources")
+    if args.seed is not None:
+        random.seed(args.seed)
+    
+    simulator = ContactSimulator(args.rate, args.time_scale, args.abandon_rate, args.transfer_rate)
+    # Reports go to stderr so the file sink can write to stdout
+    log = sys.stderr
+    print(f"{simulator.arrival_rate:.1f} contacts/s arriving, about {simulator.expected_concurrency():.0f} in flight, "
+          f"mean contact lifetime {simulator.lifetime:.0f} s", file=log)
+    
+    if args.sink == "file":
+        sink = FileSink(args.output)
+    elif args.sink == "eventbridge":
+        sink = EventBridgeSink(args.region, args.event_bus)
+    else:
+        sink = HandlerSink(args.containers, None if args.no_stub else args.stub_latency_ms)
+    
+    try:
+        counters = run(simulator, sink, args)
+    finally:
+        stats = sink.close()
+    
+    print(file=log)
+    print(f"Contacts started: {simulator.counters['contacts']} "
+          f"({simulator.counters['transfers']} transfers, {simulator.counters['abandons']} abandons)", file=log)
+    print(f"In flight: mean {counters['mean_active']:.0f}, peak {counters['peak_active']}", file=log)
+    print("Events: " + ", ".join(f"{event_type} {counters[event_type]}" for event_type in
+                                 ('INITIATED', 'QUEUED', 'CONNECTED_TO_AGENT', 'DISCONNECTED')) +
+          f"; {counters['delayed']} delayed, {counters['duplicates']} duplicated", file=log)
+    print(f"Sent {stats['sent']} events in {counters['elapsed']:.1f} s: {stats['sent'] / counters['elapsed']:.1f}/s "
+          f"against a target of {args.rate:.1f}/s" +
+          ("" if args.max_speed else f", at most {counters['max_lag']:.2f} s behind schedule"), file=log)
+    if 'failed' in stats:
+        print(f"PutEvents entries failed: {stats['failed']}", file=log)
+    
+    if args.sink == "handler" and stats['handler_ms']:
+        print(f"Handler errors: {stats['errors']}", file=log)
+        for name in ('handler_ms', 'delay_ms'):
+            values = stats[name]
+            print(f"{name:<11} p50 {percentile(values, 0.5):>8.1f}  p95 {percentile(values, 0.95):>8.1f}  "
+                  f"p99 {percentile(values, 0.99):>8.1f}  max {max(values):>8.1f}", file=log)
+        
+        timestream = stats.get('timestream')
+        if timestream:
+            records = sum(timestream['records'].values())
+            writes = timestream['requests'] - timestream['failures']
+            print(f"Timestream: {writes / stats['elapsed']:.1f} writes/s, {records / stats['elapsed']:.1f} records/s, "
+                  f"{timestream['failures']} failed; records per table {json.dumps(timestream['records'])}", file=log)
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import json
 import time
 import random
 import uuid
+import gzip
+import hashlib
 import datetime
 import boto3
 from botocore.exceptions import ClientError
@@ -14,6 +16,12 @@ RECORD_COUNT = 100                 # Number of records to generate
 BATCH_SIZE = 25                    # Records per batch
 DELAY_BETWEEN_BATCHES = 1          # Seconds between batches
 VALIDATE_STREAM = True             # Validate that stream exists before sending data
+AGGREGATE_RECORDS = False          # Pack each batch into KPL aggregated records
+COMPRESSION = None                 # None, "gzip" or "zstd" (zstd needs the zstandard package)
+
+# Kinesis limits used when packing aggregated records
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+MAX_KINESIS_RECORD_BYTES = 1024 * 1024
 
 # Initialize AWS clients
 kinesis_client = boto3.client('kinesis', region_name=REGION)
@@ -114,8 +122,8 @@ def generate_ctr_record():
             "Status": "AVAILABLE" if random.random() > 0.2 else "UNAVAILABLE"
         },
         "CustomerVoiceActivity": {
-            "TalkTime": random.randint(10, agent_interaction_duration - 10 if agent_interaction_duration > 10 else 1),
-            "ListenTime": random.randint(10, agent_interaction_duration - 10 if agent_interaction_duration > 10 else 1)
+            "TalkTime": random.randint(10, max(10, agent_interaction_duration - 10)),
+            "ListenTime": random.randint(10, max(10, agent_interaction_duration - 10))
         },
         "Attributes": {
             "CustomerFirstName": customer_first_name,
@@ -140,16 +148,93 @@ def generate_ctr_record():
     
     return record
 
+# Compress a payload with the configured codec
+def compress_payload(data, compression=COMPRESSION):
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.compress(data)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+# Encode an integer as a protobuf varint
+def encode_varint(value):
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+# Encode a length-delimited protobuf field
+def encode_bytes_field(field_number, data):
+    return encode_varint((field_number << 3) | 2) + encode_varint(len(data)) + data
+
+# Build a single KPL aggregated record from (partition key, data) pairs
+def build_aggregated_record(entries):
+    partition_keys = []
+    key_indexes = {}
+    records = b''
+    
+    for partition_key, data in entries:
+        if partition_key not in key_indexes:
+            key_indexes[partition_key] = len(partition_keys)
+            partition_keys.append(partition_key)
+        
+        # Record message: partition_key_index (1) and data (3)
+        inner = encode_varint(1 << 3) + encode_varint(key_indexes[partition_key])
+        inner += encode_bytes_field(3, data)
+        records += encode_bytes_field(3, inner)
+    
+    message = b''.join(encode_bytes_field(1, key.encode('utf-8')) for key in partition_keys)
+    message += records
+    
+    return KPL_MAGIC + message + hashlib.md5(message).digest()
+
+# Pack (partition key, data) pairs into as few aggregated records as fit the Kinesis record limit
+def aggregate_records(entries, max_bytes=MAX_KINESIS_RECORD_BYTES):
+    aggregated = []
+    current = []
+    current_size = 0
+    
+    for partition_key, data in entries:
+        # Rough per-entry size including protobuf framing overhead
+        entry_size = len(data) + len(partition_key) + 16
+        if current and current_size + entry_size > max_bytes - 64:
+            aggregated.append((current[0][0], build_aggregated_record(current)))
+            current = []
+            current_size = 0
+        current.append((partition_key, data))
+        current_size += entry_size
+    
+    if current:
+        aggregated.append((current[0][0], build_aggregated_record(current)))
+    
+    return aggregated
+
+# Convert CTR records into Kinesis PutRecords entries
+# When aggregating, the whole aggregated record is compressed rather than each CTR
+def build_kinesis_records(records, aggregate=AGGREGATE_RECORDS, compression=COMPRESSION):
+    entries = [(record['ContactId'], json.dumps(record).encode('utf-8')) for record in records]
+    
+    if aggregate:
+        entries = aggregate_records(entries)
+    
+    return [
+        {'Data': compress_payload(data, compression), 'PartitionKey': partition_key}
+        for partition_key, data in entries
+    ]
+
 # Send records to Kinesis
 def send_to_kinesis(records):
     try:
         # Prepare records for Kinesis
-        kinesis_records = [
-            {
-                'Data': json.dumps(record),
-                'PartitionKey': record['ContactId']
-            } for record in records
-        ]
+        kinesis_records = build_kinesis_records(records)
         
         # Send to Kinesis
         response = kinesis_client.put_records(
@@ -162,7 +247,7 @@ def send_to_kinesis(records):
         if failed_count:
             print(f"Failed to send {failed_count} records")
         else:
-            print(f"Successfully sent {len(records)} records to Kinesis")
+            print(f"Successfully sent {len(records)} records to Kinesis in {len(kinesis_records)} PUTs")
             
         return response
     except ClientError as e:
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic CTR lake in a local directory
+
+Writes synthetic CTRs (from generate_ctr_data.py) in the layout Firehose
+delivers to S3: concatenated JSON objects under
+connect-ctr-data/year=/month=/day=/hour=/, spread evenly over the hours
+ending now. With --format parquet the flattened Parquet table layout
+under connect-ctr-parquet/ is written instead. Hours are generated in
+parallel worker processes, so corpora of 10M+ CTRs for
+query_ctr_lake.py take minutes rather than hours.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ctr_lake
+import generate_ctr_data
+
+# Configuration defaults
+RECORD_COUNT = 1000000             # Total CTRs to generate
+HOURS = 24                         # Hours of data, ending at the current hour
+FILES_PER_HOUR = 12                # Objects per partition (a 5 minute Firehose buffer)
+WORKERS = 4                        # Hours generated in parallel
+OUTPUT_PREFIXES = {'json': 'connect-ctr-data/', 'parquet': 'connect-ctr-parquet/'}
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+# Move every *Timestamp field of a record by the same offset
+def shift_timestamps(record, offset):
+    for key, value in record.items():
+        if isinstance(value, dict):
+            shift_timestamps(value, offset)
+        elif key.endswith('Timestamp') and isinstance(value, str):
+            shifted = datetime.datetime.strptime(value, TIMESTAMP_FORMAT) + offset
+            record[key] = shifted.strftime(TIMESTAMP_FORMAT)
+
+# Generate a CTR initiated at a random time within the given hour
+def generate_record_in_hour(hour_start):
+    record = generate_ctr_data.generate_ctr_record()
+    initiated = datetime.datetime.strptime(record['InitiationTimestamp'], TIMESTAMP_FORMAT)
+    target = hour_start + datetime.timedelta(seconds=random.randint(0, 3599))
+    shift_timestamps(record, target - initiated)
+    return record
+
+# Write one hour partition and return the number of records written
+def write_hour(root, output_format, hour_start, count, files):
+    # Forked workers inherit the parent's random state, so reseed each one
+    random.seed()
+    store = ctr_lake.LocalStore(root)
+    partition = (f"{hour_start:%Y}", f"{hour_start:%m}", f"{hour_start:%d}", f"{hour_start:%H}")
+    prefix = ctr_lake.partition_prefix(OUTPUT_PREFIXES[output_format], partition)
+    
+    written = 0
+    for index in range(files):
+        file_count = count // files + (1 if index < count % files else 0)
+        if file_count == 0:
+            continue
+        records = (generate_record_in_hour(hour_start) for _ in range(file_count))
+        delivered = hour_start + datetime.timedelta(minutes=index * 60 // files)
+        name = f"connect-ctr-delivery-1-{delivered:%Y-%m-%d-%H-%M-%S}-{uuid.uuid4()}"
+        
+        if output_format == 'parquet':
+            import ctr_to_parquet
+            from transform_ctr_record import flatten_ctr_record
+            path = store.path(f"{prefix}{name}.parquet")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            ctr_to_parquet.write_parquet((flatten_ctr_record(record) for record in records), path)
+        else:
+            # Firehose concatenates JSON documents without a delimiter
+            body = ''.join(json.dumps(record) for record in records)
+            store.write_bytes(f"{prefix}{name}", body.encode('utf-8'))
+        written += file_count
+    
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic CTR lake in a local directory")
+    parser.add_argument("location", help="Directory to write the lake to")
+    parser.add_argument("--records", type=int, default=RECORD_COUNT)
+    parser.add_argument("--hours", type=int, default=HOURS)
+    parser.add_argument("--files-per-hour", type=int, default=FILES_PER_HOUR)
+    parser.add_argument("--format", default="json", choices=sorted(OUTPUT_PREFIXES))
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    
+    now = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    hours = [now - datetime.timedelta(hours=offset) for offset in range(args.hours - 1, -1, -1)]
+    
+    total = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(write_hour, args.location, args.format, hour_start,
+                            args.records // args.hours + (1 if index < args.records % args.hours else 0),
+                            args.files_per_hour)
+            for index, hour_start in enumerate(hours)
+        ]
+        for future in futures:
+            total += future.result()
+            print(f"Generated {total}/{args.records} records", end='\r')
+    
+    print(f"\nWrote {total} CTRs over {args.hours} hours to {args.location}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+"""
+Recommend Kinesis and Lambda settings for the agent event pipeline
+
+Models the stream feeding persist_agent_event: the shard write and read
+limits, the event source mapping's batching (kinesis_batch_size and
+kinesis_batch_window) and concurrency (shards times
+kinesis_parallelization_factor), the handler's duration at each
+lambda_memory_size, and the Timestream write rate. It then picks the
+cheapest settings that keep up with the peak event rate within the target
+latency, and predicts their iterator age, latency and monthly cost.
+
+The handler's cost is measured by running lambda_handler on synthetic
+batches against a local stub Timestream endpoint
+(stub_timestream_endpoint.py). CPU time, which scales with the memory
+size's share of a vCPU, and time spent waiting on writes, which does not,
+are each fitted as a cost per batch plus a cost per record. The target
+rate is given directly or taken from exported CloudWatch or Prometheus
+metrics (IncomingRecords, IncomingBytes, IteratorAgeMilliseconds), in
+which case the current settings are checked against the observed
+iterator age as well.
+
+--validate checks the model against a discrete event simulation of the
+event source mapping in which each invocation takes a duration drawn from
+the measured handler runs.
+
+No AWS access is needed. Prices are us-east-1 list prices; the costs are
+for comparing settings, not a forecast of the bill.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', 'terraform', 'timestream', 'lambda_code'))
+
+# The stub only needs requests to be signed, not valid credentials
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'stub')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'stub')
+
+# Kinesis limits
+SHARD_WRITE_RECORDS = 1000          # Records per second per shard
+SHARD_WRITE_BYTES = 1024 * 1024     # Bytes per second per shard
+SHARD_READ_BYTES = 2 * 1024 * 1024  # Bytes per second per shard, shared by standard consumers
+PUT_PAYLOAD_UNIT_BYTES = 25 * 1024  # PUT payload unit
+MAX_BATCH_BYTES = 6 * 1024 * 1024   # Lambda invocation payload limit
+
+# Lambda behaviour
+VCPU_MEMORY_MB = 1769               # Memory size at which a function gets a whole vCPU
+POLL_INTERVAL = 1.0                 # Seconds between polls of a shard with no new records
+INVOKE_OVERHEAD_MS = 10             # Event source mapping to handler, per invocation
+
+# Prices (us-east-1)
+SHARD_HOUR_PRICE = 0.015
+PUT_UNIT_PRICE = 0.014 / 1e6
+LAMBDA_GB_SECOND_PRICE = 0.0000166667
+LAMBDA_REQUEST_PRICE = 0.20 / 1e6
+TIMESTREAM_WRITE_PRICE = 0.50 / 1e6  # Per 1 KB written
+SECONDS_PER_MONTH = 730 * 3600
+
+# Configuration defaults
+REGION = "eu-west-1"                # Timestream region of the stub
+WRITE_LATENCY_MS = 20               # Stub write round trip (eu-west-2 to eu-west-1)
+MEASURE_SIZES = [10, 50, 100, 250, 500, 1000]  # Batch sizes the handler is measured at
+MEASURE_REPEATS = 3                 # Runs per measured batch size
+MAX_LATENCY = 10.0                  # Seconds from reaching the stream to being written
+HEADROOM = 0.7                      # Highest shard and Lambda utilization planned for
+COST_TOLERANCE = 0.1                # Extra Kinesis and Lambda cost accepted for lower latency
+CONCURRENCY_LIMIT = 1000            # Account concurrency available to the function
+CONSUMERS = 2                       # Standard consumers of the stream (this Lambda and Firehose)
+LAMBDA_TIMEOUT = 300                # lambda_timeout
+VALIDATE_SECONDS = 600              # Simulated seconds per validation run
+
+# Settings as deployed by default (terraform variable defaults)
+CURRENT = {'shards': 1, 'batch_size': 100, 'batch_window': 5, 'parallelization_factor': 10, 'memory': 256}
+
+# Settings the search considers
+BATCH_SIZES = [10, 25, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+BATCH_WINDOWS = [0, 1, 2, 5, 10]
+PARALLELIZATION_FACTORS = range(1, 11)
+MEMORY_SIZES = [128, 256, 512, 1024, 1769, 3008]
+EXTRA_SHARDS = 3                    # Shards tried beyond the minimum the write limits need
+
+# Terraform variable for each setting
+VARIABLES = [
+    ('shards', 'kinesis_shard_count'),
+    ('batch_size', 'kinesis_batch_size'),
+    ('batch_window', 'kinesis_batch_window'),
+    ('parallelization_factor', 'kinesis_parallelization_factor'),
+    ('memory', 'lambda_memory_size'),
+]
+
+# Handler duration fitted from stubbed runs
+class HandlerCost:
+    def __init__(self, cpu_batch_ms, cpu_record_ms, wait_batch_ms, wait_record_ms,
+                 rows_per_record, record_bytes, variation, samples=None):
+        self.cpu_batch_ms = cpu_batch_ms
+        self.cpu_record_ms = cpu_record_ms
+        self.wait_batch_ms = wait_batch_ms
+        self.wait_record_ms = wait_record_ms
+        self.rows_per_record = rows_per_record
+        self.record_bytes = record_bytes
+        self.variation = variation
+        self.samples = samples or []
+
+    def duration(self, batch, memory):
+        """Seconds an invocation with this many records takes at a memory size"""
+        cpu_ms = (self.cpu_batch_ms + self.cpu_record_ms * batch) * max(1.0, VCPU_MEMORY_MB / memory)
+        wait_ms = self.wait_batch_ms + self.wait_record_ms * batch
+        return (INVOKE_OVERHEAD_MS + cpu_ms + wait_ms) / 1000
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+    def describe(self):
+        return (f"{self.cpu_batch_ms:.1f} ms + {self.cpu_record_ms:.3f} ms/record CPU at 1 vCPU, "
+                f"{self.wait_batch_ms:.1f} ms + {self.wait_record_ms:.3f} ms/record waiting on writes, "
+                f"{self.rows_per_record:.2f} rows and {self.record_bytes:.0f} bytes per record")
+
+# Least squares fit of y = a + b * x
+def fit_line(points):
+    xs = [x for x, y in points]
+    ys = [y for x, y in points]
+    mean_x = statistics.mean(xs)
+    mean_y = statistics.mean(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread if spread else 0.0
+    slope = max(slope, 0.0)
+    return max(mean_y - slope * mean_x, 0.0), slope
+
+# Run the handler on synthetic batches against a stub endpoint and fit its cost
+def measure_handler_cost(args):
+    import benchmark_parallel_transform
+    import persist_agent_event
+    import timestream_common
+    from stub_timestream_endpoint import StubEndpoint
+    
+    endpoint = StubEndpoint(REGION, args.write_latency_ms, jitter_ms=args.write_latency_ms / 4, connect_ms=0).start()
+    timestream_common.timestream_writer = timestream_common.TimestreamWriter(
+        REGION, '', 'primary', failover_seconds=60, endpoint_urls={REGION: endpoint.url})
+    
+    samples = []
+    record_bytes = []
+    try:
+        for size in MEASURE_SIZES:
+            records = benchmark_parallel_transform.build_batch(size, benchmark_parallel_transform.AGENTS, args.gzip)
+            record_bytes.extend(len(record['kinesis']['data']) * 3 / 4 for record in records)
+            for _ in range(MEASURE_REPEATS):
+                persist_agent_event.contact_state_cache = persist_agent_event.ContactStateCache(
+                    persist_agent_event.CONTACT_STATE_CACHE_SIZE, persist_agent_event.CONTACT_STATE_CACHE_TTL)
+                
+                # Writes run on this thread, so its CPU time excludes the stub's
+                start_cpu = time.thread_time()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    persist_agent_event.lambda_handler({'Records': records}, None)
+                wall_ms = (time.perf_counter() - start) * 1000
+                cpu_ms = (time.thread_time() - start_cpu) * 1000
+                samples.append((size, cpu_ms, wall_ms))
+        summary = endpoint.summary()
+    finally:
+        endpoint.stop()
+    
+    if summary['failures']:
+        sys.exit(f"{summary['failures']} stub writes failed while measuring")
+    
+    cpu_batch_ms, cpu_record_ms = fit_line([(size, cpu_ms) for size, cpu_ms, wall_ms in samples])
+    wait_batch_ms, wait_record_ms = fit_line([(size, wall_ms - cpu_ms) for size, cpu_ms, wall_ms in samples])
+    cost = HandlerCost(cpu_batch_ms, cpu_record_ms, wait_batch_ms, wait_record_ms,
+                       rows_per_record=sum(summary['records'].values()) / (MEASURE_REPEATS * sum(MEASURE_SIZES)),
+                       record_bytes=statistics.mean(record_bytes), variation=0.0, samples=samples)
+    
+    # Spread of the runs around the fit, used to vary simulated durations
+    ratios = [wall_ms / 1000 / (cost.duration(size, VCPU_MEMORY_MB) - INVOKE_OVERHEAD_MS / 1000)
+              for size, cpu_ms, wall_ms in samples]
+    cost.variation = statistics.pstdev(ratios) / statistics.mean(ratios)
+    return cost
+
+# Parse an ISO 8601 or epoch timestamp into epoch seconds
+def parse_time(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+# Read CloudWatch get-metric-data or Prometheus query_range output into named series
+def load_metrics(path):
+    with open(path) as f:
+        doc = json.load(f)
+    
+    series = {}
+    if 'MetricDataResults' in doc:
+        for result in doc['MetricDataResults']:
+            points = [(parse_time(t), float(v)) for t, v in zip(result['Timestamps'], result['Values'])]
+            series[result.get('Label') or result['Id']] = sorted(points)
+    elif 'data' in doc and 'result' in doc['data']:
+        for result in doc['data']['result']:
+            points = [(parse_time(t), float(v)) for t, v in result.get('values', [result.get('value')]) if v is not None]
+            series[result['metric'].get('__name__', json.dumps(result['metric']))] = sorted(points)
+    else:
+        sys.exit(f"{path} is not CloudWatch get-metric-data or Prometheus query_range output")
+    
+    # Match the Kinesis and Lambda metric names however the exporter spells them
+    found = {}
+    for name, points in series.items():
+        key = name.lower().replace('_', '').replace('.', '')
+        for metric in ('incomingrecords', 'incomingbytes', 'iteratorage'):
+            if metric in key and points:
+                found.setdefault(metric, points)
+    return found
+
+# Summarise exported metrics into rates and the observed iterator age
+def summarise_metrics(metrics, period):
+    if 'incomingrecords' not in metrics:
+        sys.exit("The metrics export has no IncomingRecords series")
+    
+    records = metrics['incomingrecords']
+    if period is None:
+        gaps = [b[0] - a[0] for a, b in zip(records, records[1:]) if b[0] > a[0]]
+        period = min(gaps) if gaps else 60
+    
+    rates = [value / period for t, value in records]
+    summary = {'period': period, 'peak_rate': max(rates), 'average_rate': statistics.mean(rates)}
+    
+    if 'incomingbytes' in metrics:
+        total_records = sum(value for t, value in records)
+        total_bytes = sum(value for t, value in metrics['incomingbytes'])
+        if total_records:
+            summary['record_bytes'] = total_bytes / total_records
+    
+    if 'iteratorage' in metrics:
+        ages = [value / 1000 for t, value in metrics['iteratorage']]
+        summary['iterator_age_max'] = max(ages)
+        summary['iterator_age_mean'] = statistics.mean(ages)
+    
+    return summary
+
+# Predict how one lane of the event source mapping behaves at a rate
+def predict(settings, rate, cost, record_bytes, consumers=CONSUMERS):
+    lanes = settings['shards'] * settings['parallelization_factor']
+    batch_size = settings['batch_size']
+    window = settings['batch_window']
+    memory = settings['memory']
+    lane_rate = rate / lanes
+    
+    # Records that arrive while a batch is handled wait for the next one, so
+    # the batch size depends on the handler's duration and the other way round
+    batch = 1.0
+    for _ in range(100):
+        duration = cost.duration(batch, memory)
+        if lane_rate * duration >= 1:
+            # Busy: records pile up during the invocation and the window that follows
+            gathered = lane_rate * (duration + window)
+        else:
+            # Idle: the first record waits for a poll, then the window fills
+            gathered = 1 + lane_rate * (POLL_INTERVAL / 2 + window)
+        batch = min(batch_size, max(1.0, gathered))
+    duration = cost.duration(batch, memory)
+    
+    busy = lane_rate * duration >= 1
+    cycle = batch / lane_rate
+    utilization = duration / cycle
+    stable = lane_rate * cost.duration(batch_size, memory) < batch_size
+    
+    if not stable:
+        latency = iterator_age = math.inf
+    elif busy:
+        # A batch holds the records that arrived over the last cycle
+        latency = cycle / 2 + duration
+        iterator_age = 0.0 if batch >= batch_size else min(1 / lane_rate, window or duration)
+    else:
+        # The first record waits for a poll, those read by the poll for about
+        # half as long, and the rest of the batch for part of the window
+        polled = min(batch, 1 + lane_rate * POLL_INTERVAL / 2)
+        gather = min(window, (batch - polled) / lane_rate)
+        waited = (POLL_INTERVAL / 2 + gather) + (polled - 1) * (POLL_INTERVAL / 4 + gather) + (batch - polled) * gather / 2
+        latency = waited / batch + duration
+        iterator_age = 0.0 if batch >= batch_size else min(1 / lane_rate, window or POLL_INTERVAL / 2)
+    
+    # Closer to saturation, invocations that run long delay the next batch
+    if stable and utilization < 1:
+        latency += duration * cost.variation ** 2 * utilization / (2 * (1 - utilization))
+    
+    bytes_per_second = rate * record_bytes
+    shard_utilization = max(
+        rate / (settings['shards'] * SHARD_WRITE_RECORDS),
+        bytes_per_second / (settings['shards'] * SHARD_WRITE_BYTES),
+        bytes_per_second * consumers / (settings['shards'] * SHARD_READ_BYTES)
+    )
+    
+    return {
+        'lanes': lanes,
+        'batch': batch,
+        'duration': duration,
+        'utilization': utilization,
+        'shard_utilization': shard_utilization,
+        'iterator_age': iterator_age,
+        'latency': latency,
+        'stable': stable,
+        'invocations_per_second': rate / batch,
+        'rows_per_second': rate * cost.rows_per_record,
+    }
+
+# Monthly cost of running the settings at an average rate
+def monthly_cost(settings, rate, cost, record_bytes):
+    prediction = predict(settings, rate, cost, record_bytes)
+    invocations = prediction['invocations_per_second'] * SECONDS_PER_MONTH
+    kinesis = (settings['shards'] * 730 * SHARD_HOUR_PRICE
+               + rate * SECONDS_PER_MONTH * math.ceil(record_bytes / PUT_PAYLOAD_UNIT_BYTES) * PUT_UNIT_PRICE)
+    lambda_cost = (invocations * LAMBDA_REQUEST_PRICE
+                   + invocations * prediction['duration'] * settings['memory'] / 1024 * LAMBDA_GB_SECOND_PRICE)
+    timestream = prediction['rows_per_second'] * SECONDS_PER_MONTH * TIMESTREAM_WRITE_PRICE
+    return {'kinesis': kinesis, 'lambda': lambda_cost, 'timestream': timestream,
+            'total': kinesis + lambda_cost + timestream}
+
+# Reasons the settings cannot serve the peak rate, if any
+def check(settings, prediction, cost, record_bytes, args):
+    problems = []
+    if not prediction['stable']:
+        problems.append("Lambda cannot keep up")
+    elif prediction['utilization'] > args.headroom:
+        problems.append(f"Lambda utilization above {args.headroom:.0%}")
+    if prediction['shard_utilization'] > args.headroom:
+        problems.append(f"shard utilization above {args.headroom:.0%}")
+    if prediction['latency'] > args.max_latency:
+        problems.append(f"latency above {args.max_latency:g}s")
+    if prediction['lanes'] > args.concurrency_limit:
+        problems.append(f"more than {args.concurrency_limit} concurrent invocations")
+    if cost.duration(settings['batch_size'], settings['memory']) > args.lambda_timeout:
+        problems.append("a full batch exceeds lambda_timeout")
+    if settings['batch_size'] * record_bytes > MAX_BATCH_BYTES:
+        problems.append("a full batch exceeds the 6 MB payload limit")
+    if args.timestream_rows_per_second and prediction['rows_per_second'] > args.timestream_rows_per_second:
+        problems.append("Timestream write rate above the quota")
+    return problems
+
+# Search the settings that serve the peak rate; those costing at most the
+# tolerance more than the cheapest (in Kinesis and Lambda, as Timestream
+# writes cost the same whatever the settings) are ranked by latency
+def recommend(peak_rate, average_rate, cost, record_bytes, args):
+    bytes_per_second = peak_rate * record_bytes
+    min_shards = max(1, math.ceil(max(
+        peak_rate / (SHARD_WRITE_RECORDS * args.headroom),
+        bytes_per_second / (SHARD_WRITE_BYTES * args.headroom),
+        bytes_per_second * args.consumers / (SHARD_READ_BYTES * args.headroom)
+    )))
+    
+    candidates = []
+    for shards in range(min_shards, min_shards + EXTRA_SHARDS + 1):
+        for parallelization_factor in PARALLELIZATION_FACTORS:
+            for batch_size in BATCH_SIZES:
+                for batch_window in BATCH_WINDOWS:
+                    for memory in MEMORY_SIZES:
+                        settings = {'shards': shards, 'batch_size': batch_size, 'batch_window': batch_window,
+                                    'parallelization_factor': parallelization_factor, 'memory': memory}
+                        prediction = predict(settings, peak_rate, cost, record_bytes, args.consumers)
+                        if check(settings, prediction, cost, record_bytes, args):
+                            continue
+                        costs = monthly_cost(settings, average_rate, cost, record_bytes)
+                        candidates.append((costs['kinesis'] + costs['lambda'], prediction['latency'], settings))
+    
+    if not candidates:
+        return []
+    
+    budget = min(candidate[0] for candidate in candidates) * (1 + args.cost_tolerance)
+    affordable = sorted((candidate for candidate in candidates if candidate[0] <= budget),
+                        key=lambda candidate: (candidate[1], candidate[0]))
+    return [settings for total, latency, settings in affordable]
+
+# Simulate one lane of the event source mapping with measured handler durations
+def simulate(settings, rate, cost, seconds, seed=1):
+    rng = random.Random(seed)
+    lane_rate = rate / (settings['shards'] * settings['parallelization_factor'])
+    batch_size = settings['batch_size']
+    window = settings['batch_window']
+    
+    arrivals = []
+    t = rng.expovariate(lane_rate)
+    while t < seconds:
+        arrivals.append(t)
+        t += rng.expovariate(lane_rate)
+    
+    now = 0.0
+    busy = 0.0
+    index = 0
+    batches = []
+    ages = []
+    latencies = []
+    while index < len(arrivals):
+        if arrivals[index] > now:
+            # Nothing to read until a poll after the next record arrives
+            polls = math.ceil((arrivals[index] - now) / POLL_INTERVAL)
+            now += polls * POLL_INTERVAL
+        
+        # Read until the batch is full or the window closes
+        close = now + window
+        end = index
+        while end < len(arrivals) and end - index < batch_size and arrivals[end] <= close:
+            end += 1
+        invoke = now if window == 0 else (close if end - index < batch_size else max(now, arrivals[end - 1]))
+        
+        batch = end - index
+        duration = cost.duration(batch, settings['memory']) * max(0.0, rng.gauss(1, cost.variation))
+        done = invoke + duration
+        batches.append(batch)
+        ages.append(invoke - arrivals[end - 1])
+        latencies.extend(done - arrival for arrival in arrivals[index:end])
+        busy += duration
+        now = done
+        index = end
+    
+    latencies.sort()
+    return {
+        'batch': statistics.mean(batches),
+        'utilization': busy / max(now, seconds),
+        'iterator_age': statistics.mean(ages),
+        'latency': statistics.mean(latencies),
+        'latency_p99': latencies[int(len(latencies) * 0.99)],
+    }
+
+def format_settings_table(columns, cost, record_bytes, peak_rate, average_rate):
+    rows = [(variable, [str(settings[key]) for settings in columns.values()]) for key, variable in VARIABLES]
+    predictions = [predict(settings, peak_rate, cost, record_bytes) for settings in columns.values()]
+    costs = [monthly_cost(settings, average_rate, cost, record_bytes) for settings in columns.values()]
+    
+    rows.append(("concurrent invocations", [str(p['lanes']) for p in predictions]))
+    rows.append(("records per batch", [f"{p['batch']:.0f}" for p in predictions]))
+    rows.append(("handler duration (ms)", [f"{p['duration'] * 1000:.0f}" for p in predictions]))
+    rows.append(("Lambda utilization", [f"{p['utilization']:.0%}" if p['stable'] else "overloaded" for p in predictions]))
+    rows.append(("shard utilization", [f"{p['shard_utilization']:.0%}" for p in predictions]))
+    rows.append(("iterator age (s)", [f"{p['iterator_age']:.2f}" for p in predictions]))
+    rows.append(("latency to Timestream (s)", [f"{p['latency']:.2f}" for p in predictions]))
+    rows.append(("Timestream rows per second", [f"{p['rows_per_second']:.0f}" for p in predictions]))
+    for part in ('kinesis', 'lambda', 'timestream', 'total'):
+        rows.append((f"monthly cost, {part} ($)", [f"{c[part]:.2f}" for c in costs]))
+    
+    width = max(len(name) for name, values in rows)
+    lines = [f"{'':<{width}} " + " ".join(f"{name:>12}" for name in columns)]
+    lines.append("-" * len(lines[0]))
+    lines.extend(f"{name:<{width}} " + " ".join(f"{value:>12}" for value in values) for name, values in rows)
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend Kinesis and Lambda settings for the agent event pipeline")
+    parser.add_argument("--peak-rate", type=float, help="Peak Kinesis records per second to plan for")
+    parser.add_argument("--average-rate", type=float, help="Average records per second, for the cost (default: the peak)")
+    parser.add_argument("--metrics", help="CloudWatch get-metric-data or Prometheus query_range JSON export")
+    parser.add_argument("--metrics-period", type=float, help="Seconds per metrics data point (default: inferred)")
+    parser.add_argument("--record-bytes", type=float, help="Average Kinesis record size (default: metrics or measured)")
+    parser.add_argument("--cost-file", help="Load the handler cost from a previous --save-cost instead of measuring")
+    parser.add_argument("--save-cost", help="Save the measured handler cost to this file")
+    parser.add_argument("--write-latency-ms", type=float, default=WRITE_LATENCY_MS, help="Stub write round trip")
+    parser.add_argument("--gzip", action="store_true", help="Measure with gzip compressed records")
+    parser.add_argument("--max-latency", type=float, default=MAX_LATENCY, help="Seconds from stream to Timestream")
+    parser.add_argument("--headroom", type=float, default=HEADROOM, help="Highest utilization planned for")
+    parser.add_argument("--cost-tolerance", type=float, default=COST_TOLERANCE,
+                        help="Share above the cheapest Kinesis and Lambda cost accepted for lower latency")
+    parser.add_argument("--concurrency-limit", type=int, default=CONCURRENCY_LIMIT)
+    parser.add_argument("--consumers", type=int, default=CONSUMERS, help="Standard consumers sharing the read limit")
+    parser.add_argument("--lambda-timeout", type=float, default=LAMBDA_TIMEOUT)
+    parser.add_argument("--timestream-rows-per-second", type=float, help="Timestream ingestion quota to stay under")
+    for key, variable in VARIABLES:
+        parser.add_argument(f"--current-{key.replace('_', '-')}", dest=f"current_{key}", type=int,
+                            default=CURRENT[key], help=f"Deployed {variable}")
+    parser.add_argument("--validate", action="store_true", help="Compare the model with simulated runs")
+    parser.add_argument("--validate-seconds", type=float, default=VALIDATE_SECONDS)
+    args = parser.parse_args()
+    
+    observed = None
+    if args.metrics:
+        observed = summarise_metrics(load_metrics(args.metrics), args.metrics_period)
+    peak_rate = args.peak_rate or (observed and observed['peak_rate'])
+    if not peak_rate:
+        sys.exit("Give --peak-rate or --metrics")
+    average_rate = args.average_rate or (observed['average_rate'] if observed else peak_rate)
+    
+    if args.cost_file:
+        with open(args.cost_file) as f:
+            cost = HandlerCost.from_dict(json.load(f))
+    else:
+        print(f"Measuring the handler against a stub endpoint with {args.write_latency_ms:g} ms writes")
+        cost = measure_handler_cost(args)
+    if args.save_cost:
+        with open(args.save_cost, 'w') as f:
+            json.dump(cost.to_dict(), f, indent=2)
+    
+    record_bytes = args.record_bytes or (observed or {}).get('record_bytes') or cost.record_bytes
+    
+    print(f"Handler cost: {cost.describe()}")
+    print(f"Planning for a peak of {peak_rate:.0f} and an average of {average_rate:.0f} records per second "
+          f"of {record_bytes:.0f} bytes")
+    
+    current = {key: getattr(args, f"current_{key}") for key, variable in VARIABLES}
+    if observed and 'iterator_age_max' in observed:
+        prediction = predict(current, peak_rate, cost, record_bytes, args.consumers)
+        print(f"Observed iterator age: {observed['iterator_age_mean']:.2f}s mean, {observed['iterator_age_max']:.2f}s "
+              f"max; the model predicts {prediction['iterator_age']:.2f}s for the current settings at the peak")
+    print()
+    
+    candidates = recommend(peak_rate, average_rate, cost, record_bytes, args)
+    if not candidates:
+        sys.exit("No settings considered keep up with the peak rate; raise --max-latency or --headroom")
+    
+    columns = {'current': current, 'recommended': candidates[0]}
+    for index, settings in enumerate(candidates[1:3], 1):
+        columns[f"option {index}"] = settings
+    print(format_settings_table(columns, cost, record_bytes, peak_rate, average_rate))
+    
+    problems = check(current, predict(current, peak_rate, cost, record_bytes, args.consumers), cost, record_bytes, args)
+    if problems:
+        print()
+        print(f"The current settings do not meet the plan: {', '.join(problems)}")
+    
+    print()
+    print("Recommended settings:")
+    for key, variable in VARIABLES:
+        print(f"  {variable:<32} = {candidates[0][key]}")
+    
+    if args.validate:
+        print()
+        header = (f"{'settings':<12} {'':<10} {'batch':>7} {'util':>6} {'iter age s':>11} "
+                  f"{'latency s':>10} {'p99 s':>7}")
+        print(header)
+        print("-" * len(header))
+        for name in ('current', 'recommended'):
+            prediction = predict(columns[name], peak_rate, cost, record_bytes, args.consumers)
+            result = simulate(columns[name], peak_rate, cost, args.validate_seconds)
+            print(f"{name:<12} {'model':<10} {prediction['batch']:>7.1f} {prediction['utilization']:>6.0%} "
+                  f"{prediction['iterator_age']:>11.2f} {prediction['latency']:>10.2f} {'':>7}")
+            print(f"{'':<12} {'simulated':<10} {result['batch']:>7.1f} {result['utilization']:>6.0%} "
+                  f"{result['iterator_age']:>11.2f} {result['latency']:>10.2f} {result['latency_p99']:>7.2f}")
+
+if __name__ == "__main__":
+    main()
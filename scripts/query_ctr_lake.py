@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Run the Athena dashboard queries against a local copy of the CTR lake
+
+Reads the partitioned CTR layout from a directory (raw JSON under
+connect-ctr-data/, flattened Parquet under connect-ctr-parquet/) with
+DuckDB, exposes it under the same database and table names as the Glue
+catalog, and runs the dashboard SQL from docs/grafana_athena_setup.md
+(or any SQL file). Like Athena, each query reads only the partitions
+that satisfy its own conditions on the year/month/day/hour columns; a
+table scanned without such conditions is read in full. For each query
+the tool reports rows returned, partitions read, rows and bytes scanned
+(whole objects for JSON, referenced column chunks for Parquet), the
+bytes Athena would bill (rounded up to the megabyte, 10 MB minimum per
+query) and latency, so schema and layout changes can be benchmarked on
+a laptop.
+
+Grafana macros ($__timeFrom, $__timeTo, $__timeFilter) and the Athena
+functions used by the dashboards (DATE_FORMAT, PARSE_DATETIME) are
+translated to DuckDB equivalents.
+
+Requires duckdb (pip3 install duckdb).
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+import duckdb
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import ctr_lake
+
+# Configuration defaults
+DATABASE = "connect_ctr_database"
+TABLES = {                          # Glue table name -> prefix in the lake
+    "connect_ctr_data": "connect-ctr-data/",
+    "connect_ctr_flat": "connect-ctr-parquet/",
+}
+DASHBOARD_DOC = os.path.join(SCRIPT_DIR, '..', 'docs', 'grafana_athena_setup.md')
+RANGE_HOURS = 24                    # Default dashboard time range, ending now
+REPEAT = 3                          # Timed runs per query
+BILLING_UNIT_BYTES = 1024 * 1024    # Athena rounds bytes scanned up to the megabyte
+MINIMUM_BILLED_BYTES = 10 * 1024 * 1024  # and bills at least 10 MB per query
+
+SQL_BLOCK_PATTERN = re.compile(r'^###[ \t]+([^\n]+)\n```sql\n(.*?)```', re.S | re.M)
+TIME_FILTER_PATTERN = re.compile(r'\$__timeFilter\(([^)]+)\)')
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+PARTITION_COLUMNS = ('year', 'month', 'day', 'hour')
+
+# Athena functions used by the dashboard queries. DATE_FORMAT's specifiers
+# match strftime for %Y %m %d %H; PARSE_DATETIME only needs the
+# 'yyyy-MM-dd HH:mm:ss' pattern the hourly trend query uses.
+ATHENA_MACROS = [
+    "CREATE MACRO date_format(ts, fmt) AS strftime(ts, fmt)",
+    "CREATE MACRO parse_datetime(text, fmt) AS strptime(text, '%Y-%m-%d %H:%M:%S')",
+    "CREATE MACRO from_iso8601_timestamp(text) AS CAST(text AS TIMESTAMP)",
+]
+
+# Parse an ISO 8601 time argument as UTC
+def parse_time(value):
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.astimezone(datetime.timezone.utc)
+
+# Read the named SQL blocks from the dashboard documentation
+def load_dashboard_queries(path=DASHBOARD_DOC):
+    with open(path) as f:
+        text = f.read()
+    return {title.strip(): sql.strip() for title, sql in SQL_BLOCK_PATTERN.findall(text)}
+
+# Replace Grafana time macros with timestamp literals
+def substitute_macros(sql, time_from, time_to):
+    start = f"TIMESTAMP '{time_from:%Y-%m-%d %H:%M:%S}'"
+    end = f"TIMESTAMP '{time_to:%Y-%m-%d %H:%M:%S}'"
+    
+    sql = TIME_FILTER_PATTERN.sub(lambda match: f"({match.group(1)} BETWEEN {start} AND {end})", sql)
+    sql = re.sub(r'\$__timeFrom(\(\))?', start, sql)
+    return re.sub(r'\$__timeTo(\(\))?', end, sql)
+
+# Parse SQL into DuckDB's JSON syntax tree, or None if DuckDB cannot parse it
+def parse_sql(connection, sql):
+    tree = json.loads(connection.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+    return None if tree.get('error') else tree
+
+# Yield every node of a syntax tree with the given class or type
+def iter_nodes(tree, kind):
+    if isinstance(tree, dict):
+        if kind in (tree.get('class'), tree.get('type')):
+            yield tree
+        for value in tree.values():
+            yield from iter_nodes(value, kind)
+    elif isinstance(tree, list):
+        for value in tree:
+            yield from iter_nodes(value, kind)
+
+# Return True if a FROM clause is a plain scan of the named lake table
+def is_table_scan(from_table, name):
+    return (from_table.get('type') == 'BASE_TABLE' and from_table['table_name'] == name
+            and from_table['schema_name'] in ('', DATABASE))
+
+# Split a WHERE clause into its AND-ed conditions
+def split_conditions(expression):
+    if expression is None:
+        return []
+    if expression.get('type') == 'CONJUNCTION_AND':
+        return [condition for child in expression['children'] for condition in split_conditions(child)]
+    return [expression]
+
+# Return True for a condition on partition columns alone, which Athena evaluates before reading data
+def is_partition_condition(condition):
+    columns = {ref['column_names'][-1].lower() for ref in iter_nodes(condition, 'COLUMN_REF')}
+    return bool(columns) and columns <= set(PARTITION_COLUMNS) and not any(iter_nodes(condition, 'SUBQUERY'))
+
+# Return the partitions that satisfy every condition, evaluated by DuckDB on the partition values
+def filter_partitions(connection, partitions, conditions):
+    if not partitions:
+        return set()
+    
+    columns = ', '.join(f"{column} VARCHAR" for column in PARTITION_COLUMNS)
+    connection.execute(f"CREATE OR REPLACE TEMP TABLE lake_partitions ({columns})")
+    connection.executemany("INSERT INTO lake_partitions VALUES (?, ?, ?, ?)", [list(partition) for partition in partitions])
+    
+    selected = set(partitions)
+    template = parse_sql(connection, f"SELECT {', '.join(PARTITION_COLUMNS)} FROM lake_partitions WHERE TRUE")
+    for condition in conditions:
+        tree = copy.deepcopy(template)
+        tree['statements'][0]['node']['where_clause'] = copy.deepcopy(condition)
+        # Drop table aliases so the columns resolve against lake_partitions
+        for ref in iter_nodes(tree, 'COLUMN_REF'):
+            ref['column_names'] = ref['column_names'][-1:]
+        sql = connection.execute("SELECT json_deserialize_sql(?::JSON)", [json.dumps(tree)]).fetchone()[0]
+        selected &= set(connection.execute(sql).fetchall())
+    return selected
+
+# Return the partitions of a table a query reads: every partition, unless each scan of the
+# table has conditions on the partition columns, in which case only those that satisfy them
+def select_partitions(connection, sql, name, partitions):
+    tree = parse_sql(connection, sql)
+    if tree is None:
+        return dict(partitions)
+    
+    scans = [table for table in iter_nodes(tree, 'BASE_TABLE') if is_table_scan(table, name)]
+    scan_conditions = [
+        [condition for condition in split_conditions(node.get('where_clause')) if is_partition_condition(condition)]
+        for node in iter_nodes(tree, 'SELECT_NODE') if is_table_scan(node['from_table'], name)
+    ]
+    # A scan under a join, or one without partition conditions, reads the whole table
+    if len(scan_conditions) < len(scans) or not all(scan_conditions):
+        return dict(partitions)
+    
+    selected = set()
+    for conditions in scan_conditions:
+        selected |= filter_partitions(connection, partitions, conditions)
+    return {partition: partitions[partition] for partition in sorted(selected)}
+
+# Return the bytes Athena bills for a query that scans the given bytes
+def billed_bytes(bytes_scanned):
+    units = -(-bytes_scanned // BILLING_UNIT_BYTES)
+    return max(units * BILLING_UNIT_BYTES, MINIMUM_BILLED_BYTES)
+
+# A lake table, with per-file statistics gathered as queries read its files
+class LakeTable:
+    def __init__(self, store, name, prefix):
+        self.store = store
+        self.name = name
+        # Partitions moved by in-place compaction are read where the catalog file points
+        locations = ctr_lake.open_catalog(store, DATABASE, name).locations()
+        self.partitions = ctr_lake.list_table_partitions(store, prefix, locations)
+        self.all_paths = self.paths(self.partitions)
+        self.is_parquet = bool(self.all_paths) and is_parquet_file(self.all_paths[0])
+        self.file_bytes = {path: os.path.getsize(path) for path in self.all_paths}
+        self.total_bytes = sum(self.file_bytes.values())
+        self.file_rows = {}
+        self.file_columns = {}
+
+    def paths(self, partitions):
+        return [self.store.path(key) for partition in sorted(partitions) for key in partitions[partition]]
+
+    def source_sql(self, paths):
+        # Partition values stay VARCHAR, as in the Glue tables
+        options = "hive_partitioning = true, hive_types_autocast = false"
+        if self.is_parquet:
+            return f"read_parquet({paths!r}, {options})"
+        return f"read_json({paths!r}, format = 'auto', union_by_name = true, {options})"
+
+    def load_statistics(self, connection, paths):
+        # Statistics are kept per file, so each file is counted once however many queries read it
+        paths = [path for path in paths if path not in self.file_rows]
+        if not paths:
+            return
+        for path in paths:
+            self.file_rows[path] = 0
+            self.file_columns[path] = {}
+        
+        # Parquet footers give row counts and column sizes without reading data
+        if self.is_parquet:
+            rows = connection.execute(
+                "SELECT file_name, row_group_id, path_in_schema, row_group_num_rows, total_compressed_size "
+                f"FROM parquet_metadata({paths!r})"
+            ).fetchall()
+            row_groups = set()
+            for path, group, column, group_rows, size in rows:
+                columns = self.file_columns[path]
+                columns[column.lower()] = columns.get(column.lower(), 0) + size
+                if (path, group) not in row_groups:
+                    row_groups.add((path, group))
+                    self.file_rows[path] += group_rows
+        else:
+            counts = connection.execute(
+                f"SELECT filename, COUNT(*) FROM read_json({paths!r}, format = 'auto', union_by_name = true, "
+                "filename = true) GROUP BY filename"
+            ).fetchall()
+            self.file_rows.update(counts)
+
+    def rows_scanned(self, paths):
+        return sum(self.file_rows[path] for path in paths)
+
+    def bytes_scanned(self, sql, paths):
+        # Athena reads whole JSON objects, but only the referenced Parquet columns
+        if not self.is_parquet:
+            return sum(self.file_bytes[path] for path in paths)
+        identifiers = {token.lower() for token in IDENTIFIER_PATTERN.findall(sql)}
+        return sum(size for path in paths for column, size in self.file_columns[path].items()
+                   if column in identifiers and column not in PARTITION_COLUMNS)
+
+# Return True if the file starts with the Parquet magic bytes
+def is_parquet_file(path):
+    with open(path, 'rb') as f:
+        return f.read(4) == b'PAR1'
+
+# Open DuckDB with the Athena compatibility macros and the catalog schema
+def create_connection(threads=None):
+    connection = duckdb.connect()
+    if threads:
+        connection.execute(f"SET threads = {int(threads)}")
+    
+    for macro in ATHENA_MACROS:
+        connection.execute(macro)
+    
+    connection.execute(f"CREATE SCHEMA {DATABASE}")
+    return connection
+
+# Run a query repeatedly over the partitions it reads and measure it
+def run_query(connection, tables, sql, repeat=REPEAT, prune=True):
+    referenced = [table for name, table in tables.items() if re.search(rf'\b{name}\b', sql)]
+    
+    # Each table's view covers only the files the query reads, as Athena's scan would
+    selections = []
+    for table in referenced:
+        partitions = select_partitions(connection, sql, table.name, table.partitions) if prune else table.partitions
+        paths = table.paths(partitions)
+        if not paths:
+            raise ValueError(f"No data in the partitions the query reads from {table.name}")
+        connection.execute(f"CREATE OR REPLACE VIEW {DATABASE}.{table.name} AS SELECT * FROM {table.source_sql(paths)}")
+        table.load_statistics(connection, paths)
+        selections.append((table, partitions, paths))
+    
+    timings = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = connection.execute(sql).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    
+    bytes_scanned = sum(table.bytes_scanned(sql, paths) for table, partitions, paths in selections)
+    return {
+        'rows_returned': len(result),
+        'rows_scanned': sum(table.rows_scanned(paths) for table, partitions, paths in selections),
+        'bytes_scanned': bytes_scanned,
+        'bytes_billed': billed_bytes(bytes_scanned),
+        'partitions': sum(len(partitions) for table, partitions, paths in selections),
+        'first_ms': timings[0],
+        'median_ms': statistics.median(timings[1:] or timings),
+        'result': result,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run dashboard SQL against a local CTR lake with DuckDB")
+    parser.add_argument("location", help="Local directory laid out like the CTR bucket")
+    parser.add_argument("--from", dest="time_from", type=parse_time, help="Dashboard range start for the Grafana macros (ISO 8601, UTC)")
+    parser.add_argument("--to", dest="time_to", type=parse_time, help="Dashboard range end for the Grafana macros (default now)")
+    parser.add_argument("--query", action="append", help="Dashboard query title to run (repeatable, default all)")
+    parser.add_argument("--sql", help="File of SQL to run instead of the dashboard queries")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Timed runs per query")
+    parser.add_argument("--threads", type=int, help="DuckDB worker threads (default all cores)")
+    parser.add_argument("--no-prune", action="store_true", help="Read every partition, ignoring the queries' partition conditions")
+    parser.add_argument("--show", action="store_true", help="Print the result rows of each query")
+    args = parser.parse_args()
+    
+    if args.location.startswith('s3://'):
+        sys.exit("Copy the lake to a local directory first, e.g. aws s3 sync s3://<ctr-bucket> ./bucket-copy")
+    
+    time_to = args.time_to or datetime.datetime.now(datetime.timezone.utc)
+    time_from = args.time_from or time_to - datetime.timedelta(hours=RANGE_HOURS)
+    
+    if args.sql:
+        with open(args.sql) as f:
+            queries = {os.path.basename(args.sql): f.read()}
+    else:
+        queries = load_dashboard_queries()
+        if args.query:
+            unknown = set(args.query) - set(queries)
+            if unknown:
+                sys.exit(f"Unknown queries: {', '.join(sorted(unknown))}. Available: {', '.join(queries)}")
+            queries = {title: queries[title] for title in args.query}
+    
+    store = ctr_lake.LocalStore(args.location)
+    tables = {name: LakeTable(store, name, prefix) for name, prefix in TABLES.items()}
+    
+    print(f"Range {time_from:%Y-%m-%d %H:%M} to {time_to:%Y-%m-%d %H:%M} UTC")
+    for table in tables.values():
+        kind = 'Parquet' if table.is_parquet else 'JSON'
+        print(f"  {table.name}: {len(table.partitions)} partitions, "
+              f"{len(table.all_paths)} {kind} files, {table.total_bytes} bytes")
+    print()
+    
+    connection = create_connection(args.threads)
+    header = (f"{'query':<45} {'rows out':>9} {'partitions':>10} {'rows scanned':>13} {'bytes scanned':>14} "
+              f"{'bytes billed':>13} {'first ms':>9} {'median ms':>10}")
+    print(header)
+    print("-" * len(header))
+    
+    failed = 0
+    for title, sql in queries.items():
+        try:
+            stats = run_query(connection, tables, substitute_macros(sql, time_from, time_to), args.repeat,
+                              prune=not args.no_prune)
+        except (duckdb.Error, ValueError) as e:
+            failed += 1
+            print(f"{title[:45]:<45} error: {str(e).splitlines()[0]}")
+            continue
+        
+        print(f"{title[:45]:<45} {stats['rows_returned']:>9} {stats['partitions']:>10} {stats['rows_scanned']:>13} "
+              f"{stats['bytes_scanned']:>14} {stats['bytes_billed']:>13} {stats['first_ms']:>9.1f} "
+              f"{stats['median_ms']:>10.1f}")
+        if args.show:
+            for row in stats['result']:
+                print(f"    {row}")
+    
+    if failed:
+        sys.exit(f"{failed} queries failed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Replay failed Timestream batches captured by the persist Lambdas
+
+When a Timestream write fails, persist_agent_event and
+persist_contact_event store the original payloads with the error in the
+failure spool (FAILURE_SPOOL: an S3 prefix, or a local directory when
+run locally). This tool re-drives the captured batches and writes them
+with a thread pool, capped at --rate records per second, through the
+Lambdas' TimestreamWriter: --secondary-region and --write-mode (defaulting
+to the Lambdas' TIMESTREAM_* variables) fail over or write to both
+regions as the Lambdas do.
+
+When every record of a batch was built before it failed, the capture
+holds the records that were not written, with their original times, and
+only those are written: chunks that succeeded before the failure are not
+written again, and a record replayed twice is the same record, which
+Timestream accepts as an upsert. Other captures (a batch that failed
+while building records, or a contact event, whose single chunk is either
+written or not) are rebuilt from their payloads through the same
+transform code as the Lambdas. Each rebuilt record is given the capture
+time (plus its position in the batch, so records never collide), so a
+capture replayed twice writes identical records. Captures that replay
+without errors are moved under replayed/; records Timestream rejects are
+reported as permanently rejected, and captures that fail again are kept
+for the next run.
+
+With --sqs-queue-url, events that reached the contact-event Lambda's
+on-failure destination are replayed too. Kinesis on-failure messages only
+hold the shard and sequence range of the batch, so they are listed for
+the batch to be read back from the stream while it is still retained.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', 'terraform', 'timestream', 'lambda_code'))
+
+import ctr_lake
+import persist_agent_event
+import persist_contact_event
+import timestream_common
+from timestream_common import RateLimiter, TimestreamWriter, WRITE_CHUNK_SIZE, write_chunk
+
+# Configuration defaults
+SPOOL_PREFIX = "failed-batches/"    # Prefix the Lambdas capture to
+REPLAYED_DIR = "replayed/"          # Under the spool prefix, for captures already replayed
+DATABASE = "connect-analytics"      # Timestream database
+REGION = "eu-west-1"                # Timestream region
+CONCURRENCY = 8                     # Captures replayed in parallel
+RATE = 500                          # Records per second across all threads (0 for no limit)
+
+# Replays need every contact row, not just the ones that changed since the last event
+persist_agent_event.contact_state_cache = persist_agent_event.ContactStateCache(0, 0)
+
+# Return the Timestream records of a capture, keyed by table
+def build_capture_records(capture):
+    # The unwritten records keep the times the Lambda gave them
+    if capture.get('records') is not None:
+        return {table: records for table, records in capture['records'].items() if records}
+    
+    contact_records = []
+    if capture['source'] == 'agent-event':
+        tables = {'AgentEvent': [], 'AgentEvent_Contact': []}
+        for data in persist_agent_event.iter_documents(capture['payloads']):
+            if persist_agent_event.is_agent_event(data):
+                persist_agent_event.process_agent_event(data, tables['AgentEvent'], tables['AgentEvent_Contact'])
+            elif persist_agent_event.is_contact_trace_record(data):
+                contact_records.append(persist_agent_event.build_contact_record(data, str(capture['captured_at'])))
+    elif capture['source'] == 'contact-event':
+        tables = {'ContactEvent': []}
+        for event in capture['payloads']:
+            persist_contact_event.process_contact_event(event.get('detail', {}), tables['ContactEvent'])
+    else:
+        raise ValueError(f"Unknown capture source {capture['source']}")
+    
+    # Pin times to the capture so repeated replays write the same records
+    for records in tables.values():
+        for index, record in enumerate(records):
+            record['Time'] = str(capture['captured_at'] + index)
+    
+    # Contact records are already timed at the disconnect, as the Lambda writes them
+    if contact_records:
+        tables['ContactRecord'] = contact_records
+    
+    return tables
+
+# Replay one capture and return the records recovered and rejected
+def replay_capture(writer, capture, limiter):
+    recovered = 0
+    rejected = 0
+    for table, records in build_capture_records(capture).items():
+        for i in range(0, len(records), WRITE_CHUNK_SIZE):
+            chunk = records[i:i + WRITE_CHUNK_SIZE]
+            chunk_rejected = write_chunk(writer, table, chunk, limiter)
+            recovered += len(chunk) - chunk_rejected
+            rejected += chunk_rejected
+    return recovered, rejected
+
+# List the captures in the spool that have not been replayed yet
+def list_captures(store, prefix):
+    return [key for key in store.list_keys(prefix)
+            if key.endswith('.json') and not key.startswith(prefix + REPLAYED_DIR)]
+
+# Read the on-failure destination messages and turn async invocation failures into captures
+def receive_destination_captures(sqs, queue_url, max_messages):
+    captures = []
+    pointers = []
+    while len(captures) + len(pointers) < max_messages:
+        response = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10,
+                                       WaitTimeSeconds=1, VisibilityTimeout=900)
+        messages = response.get('Messages', [])
+        if not messages:
+            break
+        for message in messages:
+            body = json.loads(message['Body'])
+            if 'requestPayload' in body:
+                failed_at = body.get('timestamp', '')
+                try:
+                    captured_at = int(datetime.datetime.fromisoformat(failed_at.replace('Z', '+00:00')).timestamp() * 1000)
+                except ValueError:
+                    captured_at = int(time.time() * 1000)
+                captures.append(({
+                    'source': 'contact-event',
+                    'captured_at': captured_at,
+                    'error': body.get('responsePayload', {}).get('errorMessage', ''),
+                    'payloads': [body['requestPayload']],
+                }, message['ReceiptHandle']))
+            else:
+                pointers.append(body.get('KinesisBatchInfo', body))
+    return captures, pointers
+
+# Replay every (key, capture, receipt) work item and return the totals
+def replay_all(store, prefix, writer, work, concurrency=CONCURRENCY, rate=RATE, sqs=None, queue_url=None):
+    limiter = RateLimiter(rate)
+    totals = {'replayed': 0, 'failed': 0, 'recovered': 0, 'rejected': 0}
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(replay_capture, writer, capture, limiter): (key, receipt)
+            for key, capture, receipt in work
+        }
+        for future in as_completed(futures):
+            key, receipt = futures[future]
+            try:
+                recovered, rejected = future.result()
+            except Exception as e:
+                totals['failed'] += 1
+                print(f"Error replaying {key or 'sqs message'}: {str(e)}")
+                continue
+            
+            # Done with this capture; rejected records will never be accepted
+            if key is not None:
+                store.rename(key, prefix + REPLAYED_DIR + key[len(prefix):])
+            else:
+                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt)
+            
+            totals['replayed'] += 1
+            totals['recovered'] += recovered
+            totals['rejected'] += rejected
+    
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay failed Timestream batches from the failure spool")
+    parser.add_argument("location", help="s3://bucket or a local directory holding the spool")
+    parser.add_argument("--prefix", default=SPOOL_PREFIX, help="Spool prefix within the location")
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--region", default=REGION)
+    parser.add_argument("--secondary-region", default=timestream_common.TIMESTREAM_SECONDARY_REGION,
+                        help="Secondary Timestream region, as TIMESTREAM_SECONDARY_REGION for the Lambdas")
+    parser.add_argument("--write-mode", default=timestream_common.TIMESTREAM_WRITE_MODE, choices=TimestreamWriter.MODES,
+                        help="How the secondary region is used, as TIMESTREAM_WRITE_MODE for the Lambdas")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=RATE, help="Records per second (0 for no limit)")
+    parser.add_argument("--sqs-queue-url", help="On-failure destination queue to replay as well")
+    parser.add_argument("--max-messages", type=int, default=1000, help="Messages to read from the queue per run")
+    parser.add_argument("--dry-run", action="store_true", help="Summarise the captures without writing")
+    args = parser.parse_args()
+    
+    import boto3
+    
+    store = ctr_lake.open_store(args.location)
+    work = [(key, json.loads(store.read_bytes(key)), None) for key in list_captures(store, args.prefix)]
+    
+    pointers = []
+    sqs = None
+    if args.sqs_queue_url:
+        sqs = boto3.client('sqs', region_name=args.region)
+        captures, pointers = receive_destination_captures(sqs, args.sqs_queue_url, args.max_messages)
+        work.extend((None, capture, receipt) for capture, receipt in captures)
+    
+    print(f"{len(work)} captured batches to replay")
+    if args.dry_run:
+        for key, capture, receipt in work:
+            unwritten = sum(len(records) for records in (capture.get('records') or {}).values())
+            print(f"  {key or 'sqs'}: {capture['source']}, {len(capture['payloads'])} payloads, "
+                  f"{unwritten} unwritten records, error: {capture.get('error', '')[:100]}")
+        return
+    
+    # Written like the Lambdas write, with adaptive retries that back off when the replay is throttled
+    writer = TimestreamWriter(args.region, args.secondary_region, args.write_mode,
+                              timestream_common.TIMESTREAM_FAILOVER_SECONDS, max_connections=args.concurrency,
+                              database=args.database, retries={'max_attempts': 10, 'mode': 'adaptive'})
+    
+    start = time.time()
+    totals = replay_all(store, args.prefix, writer, work, args.concurrency, args.rate, sqs, args.sqs_queue_url)
+    print(f"Timestream writes: {json.dumps(writer.pop_stats())}")
+    
+    print(f"Replayed {totals['replayed']} batches in {time.time() - start:.1f}s: {totals['recovered']} records "
+          f"recovered, {totals['rejected']} permanently rejected, {totals['failed']} batches still failing")
+    
+    for pointer in pointers:
+        print(f"Kinesis batch not captured, read it back from the stream: {json.dumps(pointer)}")
+    
+    if totals['failed']:
+        sys.exit(f"{totals['failed']} batches failed again; rerun to retry them")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Local stub of a Timestream write endpoint with injected latency and failures
+
+Answers WriteRecords and DescribeEndpoints over the same JSON protocol as
+the real service, so the persist Lambdas can be pointed at it through
+TIMESTREAM_ENDPOINT_URLS (e.g. '{"eu-west-1": "http://127.0.0.1:8001"}').
+Each request is delayed by --latency-ms (plus up to --jitter-ms), the
+first request on a new connection additionally by --connect-ms to stand
+in for the cross-region TCP and TLS handshake, and a share of requests
+fails with InternalServerException or ThrottlingException. Records are
+counted per table and not stored.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configuration defaults
+PORT = 8001                         # Port to listen on
+LATENCY_MS = 20                     # Added to every request (eu-west-2 to eu-west-1 round trip)
+JITTER_MS = 5                       # Random extra latency per request
+CONNECT_MS = 60                     # Added to the first request of each connection
+
+TARGET_PREFIX = "Timestream_20181101."
+
+# A stub endpoint serving one region from a background thread
+class StubEndpoint:
+    def __init__(self, region, latency_ms=LATENCY_MS, jitter_ms=JITTER_MS, connect_ms=CONNECT_MS,
+                 failure_rate=0.0, throttle_rate=0.0):
+        self.region = region
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.connect_ms = connect_ms
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.lock = threading.Lock()
+        self.server = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.records = {}
+            self.requests = 0
+            self.failures = 0
+            self.connections = 0
+
+    def start(self, port=0, host="127.0.0.1"):
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps connections open, as the real endpoint does
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.first_request = True
+                with endpoint.lock:
+                    endpoint.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                operation = self.headers.get('X-Amz-Target', '')[len(TARGET_PREFIX):]
+                delay_ms = endpoint.latency_ms + random.uniform(0, endpoint.jitter_ms)
+                if self.first_request:
+                    delay_ms += endpoint.connect_ms
+                    self.first_request = False
+                time.sleep(delay_ms / 1000)
+                status, response = endpoint.handle(operation, json.loads(body or b'{}'), self.headers.get('Host'))
+                payload = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/x-amz-json-1.0')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def handle(self, operation, request, host):
+        with self.lock:
+            self.requests += 1
+        
+        if operation == 'DescribeEndpoints':
+            return 200, {'Endpoints': [{'Address': host, 'CachePeriodInMinutes': 1440}]}
+        if operation != 'WriteRecords':
+            return 400, {'__type': 'ValidationException', 'message': f"Stub does not implement {operation}"}
+        
+        roll = random.random()
+        if roll < self.failure_rate:
+            with self.lock:
+                self.failures += 1
+            return 500, {'__type': 'InternalServerException', 'message': f"Injected failure in {self.region}"}
+        if roll < self.failure_rate + self.throttle_rate:
+            with self.lock:
+                self.failures += 1
+            return 400, {'__type': 'ThrottlingException', 'message': f"Injected throttle in {self.region}"}
+        
+        count = len(request.get('Records', []))
+        with self.lock:
+            table = request.get('TableName', 'unknown')
+            self.records[table] = self.records.get(table, 0) + count
+        return 200, {'RecordsIngested': {'Total': count, 'MemoryStore': count, 'MagneticStore': 0}}
+
+    def summary(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'failures': self.failures,
+                'connections': self.connections,
+                'records': dict(self.records),
+            }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Timestream write endpoint stub")
+    parser.add_argument("--region", default="eu-west-1", help="Region name reported in errors")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_MS)
+    parser.add_argument("--connect-ms", type=float, default=CONNECT_MS, help="Extra latency on a new connection")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of writes failing with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of writes throttled")
+    args = parser.parse_args()
+    
+    endpoint = StubEndpoint(args.region, args.latency_ms, args.jitter_ms, args.connect_ms,
+                            args.failure_rate, args.throttle_rate).start(args.port)
+    print(f"Stub Timestream endpoint for {args.region} listening on {endpoint.url} (Ctrl-C to stop)")
+    
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        endpoint.stop()
+    
+    print(json.dumps(endpoint.summary(), indent=2))
+
+if __name__ == "__main__":
+    main()
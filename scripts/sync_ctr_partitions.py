@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Register missing CTR lake partitions in Glue without running the crawler
+
+Lists the hour partitions present in the lake (S3 or a local copy),
+compares them with the partitions already registered on the Glue table,
+and creates only the missing ones in batches. With --since, only the
+day prefixes from that hour onwards are listed, so old data is never
+rescanned. The same diff and registration code runs in the
+register_ctr_partitions Lambda that reacts to new objects.
+
+--projection prints Athena partition projection properties instead, for
+tables where partitions should not be registered at all.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', 'terraform', 'data_pipeline', 'lambda_code'))
+
+import ctr_lake
+import register_ctr_partitions as registrar
+
+# Configuration defaults
+PREFIX = "connect-ctr-data/"
+DATABASE = "connect_ctr_database"
+TABLE = "connect_ctr_data"
+PROJECTION_START_YEAR = 2024
+
+# Parse a YYYY/MM/DD/HH argument into a UTC datetime
+def parse_hour(value):
+    return datetime.datetime.strptime(value, "%Y/%m/%d/%H").replace(tzinfo=datetime.timezone.utc)
+
+# Find the partitions present under a prefix, listing only days from `since` when given
+def find_partitions(store, prefix, since=None, until=None):
+    if since is None:
+        return set(ctr_lake.list_partitions(store, prefix))
+    
+    until = until or datetime.datetime.now(datetime.timezone.utc)
+    found = set()
+    day = since.replace(hour=0)
+    while day <= until:
+        day_prefix = f"{prefix}year={day:%Y}/month={day:%m}/day={day:%d}/"
+        for key in store.list_keys(day_prefix):
+            partition = registrar.partition_values_from_key(key, prefix)
+            if partition is not None and parse_hour('/'.join(partition)) >= since:
+                found.add(partition)
+        day += datetime.timedelta(days=1)
+    return found
+
+# Read the partitions already registered on the Glue table
+def registered_from_glue(database, table):
+    registered = set()
+    paginator = registrar.glue.get_paginator('get_partitions')
+    for page in paginator.paginate(DatabaseName=database, TableName=table):
+        registered.update(tuple(partition['Values']) for partition in page['Partitions'])
+    return registered
+
+# Read registered partitions from a JSON list of "YYYY/MM/DD/HH" strings (for offline runs)
+def registered_from_file(path):
+    with open(path) as f:
+        return {tuple(value.split('/')) for value in json.load(f)}
+
+# Athena partition projection properties for a year/month/day/hour partitioned table
+def projection_properties(location):
+    current_year = datetime.datetime.now(datetime.timezone.utc).year
+    return {
+        'projection.enabled': 'true',
+        'projection.year.type': 'integer',
+        'projection.year.range': f'{PROJECTION_START_YEAR},{current_year + 5}',
+        'projection.month.type': 'integer',
+        'projection.month.range': '1,12',
+        'projection.month.digits': '2',
+        'projection.day.type': 'integer',
+        'projection.day.range': '1,31',
+        'projection.day.digits': '2',
+        'projection.hour.type': 'integer',
+        'projection.hour.range': '0,23',
+        'projection.hour.digits': '2',
+        'storage.location.template': f"{location.rstrip('/')}/year=${{year}}/month=${{month}}/day=${{day}}/hour=${{hour}}/",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Register new CTR partitions in Glue")
+    parser.add_argument("location", help="s3://bucket or a local directory laid out like the bucket")
+    parser.add_argument("--prefix", default=PREFIX)
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--table", default=TABLE)
+    parser.add_argument("--since", type=parse_hour, help="Only list partitions from YYYY/MM/DD/HH onwards")
+    parser.add_argument("--registered-file", help="JSON list of registered partitions, instead of asking Glue")
+    parser.add_argument("--dry-run", action="store_true", help="Print the new partitions without registering them")
+    parser.add_argument("--projection", action="store_true", help="Print partition projection properties and exit")
+    args = parser.parse_args()
+    
+    if args.projection:
+        location = args.location.rstrip('/') + '/' + args.prefix
+        properties = projection_properties(location)
+        assignments = ',\n  '.join(f"'{key}' = '{value}'" for key, value in properties.items())
+        print(f"ALTER TABLE {args.database}.{args.table} SET TBLPROPERTIES (\n  {assignments}\n);")
+        return
+    
+    store = ctr_lake.open_store(args.location)
+    found = find_partitions(store, args.prefix, args.since)
+    
+    if args.registered_file:
+        registered = registered_from_file(args.registered_file)
+    else:
+        registered = registered_from_glue(args.database, args.table)
+    
+    new_partitions = registrar.diff_partitions(found, registered)
+    print(f"{len(found)} partitions found, {len(registered)} registered, {len(new_partitions)} new")
+    
+    if args.dry_run or not new_partitions:
+        for partition in new_partitions:
+            print(f"  {'/'.join(partition)}")
+        return
+    
+    registrar.database_name = args.database
+    registrar.table_name = args.table
+    registrar.bucket_name = args.location[len('s3://'):].split('/')[0] if args.location.startswith('s3://') else ''
+    registrar.s3_prefix = args.prefix
+    
+    created = registrar.register_partitions(new_partitions)
+    print(f"Created {created} partitions")
+
+if __name__ == "__main__":
+    main()
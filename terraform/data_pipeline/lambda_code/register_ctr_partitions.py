@@ -0,0 +1,145 @@
+import json
+import os
+import re
+import boto3
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote_plus
+
+# Initialize Glue client
+glue = boto3.client('glue', region_name=os.environ.get('AWS_REGION', 'eu-west-2'))
+
+database_name = os.environ.get('GLUE_DATABASE_NAME', 'connect_ctr_database')
+table_name = os.environ.get('GLUE_TABLE_NAME', 'connect_ctr_data')
+bucket_name = os.environ.get('S3_BUCKET_NAME', '')
+s3_prefix = os.environ.get('S3_PREFIX', 'connect-ctr-data/')
+
+PARTITION_PATTERN = re.compile(r'year=(\d{4})/month=(\d{2})/day=(\d{2})/hour=(\d{2})/')
+
+# Glue accepts at most 100 partitions per BatchCreatePartition call
+BATCH_CREATE_LIMIT = 100
+
+# Partitions known to be registered, kept across warm invocations
+registered_partitions = set()
+
+# Table storage descriptor and location, fetched once per container
+table_storage = {}
+
+def lambda_handler(event, context):
+    """
+    Register new CTR partitions in the Glue catalog
+    
+    Invoked by S3 object-created notifications for the CTR prefix, and by
+    a schedule shortly before each hour boundary. Only the partitions of
+    the new objects (or the current and next hour) are registered; no
+    existing data is listed or rescanned.
+    """
+    
+    if 'Records' in event:
+        keys = [unquote_plus(record['s3']['object']['key']) for record in event['Records']
+                if 's3' in record]
+        candidates = {partition_values_from_key(key, s3_prefix) for key in keys}
+        candidates.discard(None)
+    else:
+        # Scheduled run: register the current and upcoming hour ahead of the data
+        now = datetime.now(timezone.utc)
+        candidates = set(hour_partitions(now, now + timedelta(hours=1)))
+    
+    new_partitions = diff_partitions(candidates, registered_partitions)
+    created = register_partitions(new_partitions) if new_partitions else 0
+    
+    print(f"{len(candidates)} partitions seen, {len(new_partitions)} new, {created} created")
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'Registered {created} partitions')
+    }
+
+def partition_values_from_key(key, prefix):
+    """Return the (year, month, day, hour) partition of an object key, or None"""
+    
+    if not key.startswith(prefix):
+        return None
+    
+    # Hidden objects (staging and manifest files) never need a partition
+    if os.path.basename(key).startswith(('_', '.')):
+        return None
+    
+    match = PARTITION_PATTERN.match(key[len(prefix):])
+    return match.groups() if match else None
+
+def hour_partitions(start, end):
+    """Return the partition values of every hour from start to end inclusive"""
+    
+    partitions = []
+    current = start.replace(minute=0, second=0, microsecond=0)
+    while current <= end:
+        partitions.append((current.strftime('%Y'), current.strftime('%m'),
+                           current.strftime('%d'), current.strftime('%H')))
+        current += timedelta(hours=1)
+    return partitions
+
+def diff_partitions(candidates, registered):
+    """Return the candidate partitions that are not registered yet, in time order"""
+    
+    return sorted(set(candidates) - set(registered))
+
+def build_partition_input(descriptor, location, values):
+    """Build a Glue PartitionInput that inherits the table's storage settings"""
+    
+    year, month, day, hour = values
+    storage = dict(descriptor)
+    storage['Location'] = f"{location.rstrip('/')}/year={year}/month={month}/day={day}/hour={hour}/"
+    
+    return {
+        'Values': list(values),
+        'StorageDescriptor': storage
+    }
+
+def get_table_storage():
+    """Fetch and cache the table's storage descriptor and base location"""
+    
+    if not table_storage:
+        table = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']
+        descriptor = table['StorageDescriptor']
+        table_storage['descriptor'] = {
+            key: descriptor[key]
+            for key in ('Columns', 'InputFormat', 'OutputFormat', 'SerdeInfo', 'Compressed', 'Parameters')
+            if key in descriptor
+        }
+        table_storage['location'] = descriptor.get('Location') or f"s3://{bucket_name}/{s3_prefix}"
+    
+    return table_storage['descriptor'], table_storage['location']
+
+def register_partitions(partitions):
+    """Create partitions in batches, treating existing ones as registered"""
+    
+    try:
+        descriptor, location = get_table_storage()
+    except glue.exceptions.EntityNotFoundException:
+        print(f"Table {database_name}.{table_name} does not exist yet; run the Glue crawler once to create it")
+        return 0
+    
+    created = 0
+    for i in range(0, len(partitions), BATCH_CREATE_LIMIT):
+        batch = partitions[i:i + BATCH_CREATE_LIMIT]
+        
+        response = glue.batch_create_partition(
+            DatabaseName=database_name,
+            TableName=table_name,
+            PartitionInputList=[build_partition_input(descriptor, location, values) for values in batch]
+        )
+        
+        existing = 0
+        failed = set()
+        for error in response.get('Errors', []):
+            if error.get('ErrorDetail', {}).get('ErrorCode') == 'AlreadyExistsException':
+                existing += 1
+            else:
+                print(f"Error registering partition {error.get('PartitionValues')}: {error.get('ErrorDetail')}")
+                failed.add(tuple(error.get('PartitionValues', [])))
+        
+        # Failed partitions stay out of the cache so the next event retries them
+        registered_partitions.update(values for values in batch if values not in failed)
+        created += len(batch) - existing - len(failed)
+    
+    return created
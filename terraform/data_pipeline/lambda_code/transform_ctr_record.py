@@ -0,0 +1,195 @@
+import json
+import base64
+from datetime import datetime, timezone
+from kinesis_payload import decode_kinesis_payload
+
+# Flattened CTR schema, in column order. Types are Glue/Athena types and
+# must match the columns of the connect_ctr_flat table in main.tf.
+CTR_COLUMNS = [
+    ('awsaccountid', 'string'),
+    ('instanceid', 'string'),
+    ('contactid', 'string'),
+    ('initialcontactid', 'string'),
+    ('previouscontactid', 'string'),
+    ('channel', 'string'),
+    ('initiationmethod', 'string'),
+    ('disconnectreason', 'string'),
+    ('initiationtimestamp', 'timestamp'),
+    ('connectedtosystemtimestamp', 'timestamp'),
+    ('disconnecttimestamp', 'timestamp'),
+    ('customerendpoint_type', 'string'),
+    ('customerendpoint_address', 'string'),
+    ('systemendpoint_address', 'string'),
+    ('queue_name', 'string'),
+    ('queue_id', 'string'),
+    ('queue_arn', 'string'),
+    ('queue_enqueuetimestamp', 'timestamp'),
+    ('queue_dequeuetimestamp', 'timestamp'),
+    ('queue_duration', 'bigint'),
+    ('agent_id', 'string'),
+    ('agent_arn', 'string'),
+    ('agent_username', 'string'),
+    ('agent_connectedtoagenttimestamp', 'timestamp'),
+    ('agent_interactionduration', 'bigint'),
+    ('agent_aftercontactworkduration', 'bigint'),
+    ('recording_status', 'string'),
+    ('recording_location', 'string'),
+    ('customervoiceactivity_talktime', 'bigint'),
+    ('customervoiceactivity_listentime', 'bigint'),
+    ('attributes_customerfirstname', 'string'),
+    ('attributes_customerlastname', 'string'),
+    ('attributes_agentname', 'string'),
+    ('attributes_sentiment', 'string'),
+    ('attributes_resolution', 'string'),
+    ('attributes_other', 'string'),
+]
+
+# Attributes that get their own column; any others go to attributes_other as JSON
+KNOWN_ATTRIBUTES = {
+    'CustomerFirstName': 'attributes_customerfirstname',
+    'CustomerLastName': 'attributes_customerlastname',
+    'AgentName': 'attributes_agentname',
+    'Sentiment': 'attributes_sentiment',
+    'Resolution': 'attributes_resolution',
+}
+
+def lambda_handler(event, context):
+    """
+    Flatten CTR records delivered by Kinesis Firehose
+    
+    This Lambda is the Firehose transformation stage. Each nested CTR is
+    flattened into the fixed CTR_COLUMNS schema so that Firehose can
+    convert it to Parquet before delivering it to S3.
+    
+    Records are decoded like the stream's other consumers decode them, so
+    KPL aggregated and gzip or zstd compressed records are accepted. A
+    record carrying several CTRs becomes newline-delimited rows, as
+    Firehose needs exactly one output record per input record.
+    """
+    
+    output = []
+    failed = 0
+    rows_written = 0
+    
+    for record in event['records']:
+        try:
+            documents = decode_kinesis_payload(base64.b64decode(record['data']))
+            rows = [flatten_ctr_record(ctr) for ctr in documents]
+            
+            if not rows:
+                output.append({'recordId': record['recordId'], 'result': 'Dropped', 'data': record['data']})
+                continue
+            
+            data = ''.join(json.dumps(row) + '\n' for row in rows)
+            output.append({
+                'recordId': record['recordId'],
+                'result': 'Ok',
+                'data': base64.b64encode(data.encode('utf-8')).decode('utf-8')
+            })
+            rows_written += len(rows)
+        
+        except Exception as e:
+            print(f"Error transforming record {record.get('recordId')}: {str(e)}")
+            failed += 1
+            
+            # Failed records are written to the Firehose error output prefix
+            output.append({
+                'recordId': record['recordId'],
+                'result': 'ProcessingFailed',
+                'data': record['data']
+            })
+    
+    print(f"Transformed {len(output) - failed} records into {rows_written} rows, {failed} failed")
+    
+    return {'records': output}
+
+def flatten_ctr_record(ctr):
+    """Flatten a nested CTR into a dict keyed by the CTR_COLUMNS names
+    
+    Handles both the Connect CTR shape (Queue.Name, Agent.*) and the
+    shape produced by generate_ctr_data.py (Queue.QueueName, AgentInfo.*).
+    Timestamps are returned as epoch milliseconds.
+    """
+    
+    queue = ctr.get('Queue') or {}
+    agent = ctr.get('Agent') or ctr.get('AgentInfo') or {}
+    customer_endpoint = ctr.get('CustomerEndpoint') or {}
+    system_endpoint = ctr.get('SystemEndpoint') or {}
+    recording = ctr.get('Recording') or {}
+    voice_activity = ctr.get('CustomerVoiceActivity') or {}
+    attributes = ctr.get('Attributes') or {}
+    
+    row = {
+        'awsaccountid': ctr.get('AWSAccountId'),
+        'instanceid': ctr.get('InstanceId') or id_from_arn(ctr.get('InstanceARN')),
+        'contactid': ctr.get('ContactId'),
+        'initialcontactid': ctr.get('InitialContactId'),
+        'previouscontactid': ctr.get('PreviousContactId'),
+        'channel': ctr.get('Channel'),
+        'initiationmethod': ctr.get('InitiationMethod'),
+        'disconnectreason': ctr.get('DisconnectReason'),
+        'initiationtimestamp': parse_timestamp(ctr.get('InitiationTimestamp')),
+        'connectedtosystemtimestamp': parse_timestamp(ctr.get('ConnectedToSystemTimestamp')),
+        'disconnecttimestamp': parse_timestamp(ctr.get('DisconnectTimestamp')),
+        'customerendpoint_type': customer_endpoint.get('Type'),
+        'customerendpoint_address': customer_endpoint.get('Address'),
+        'systemendpoint_address': system_endpoint.get('Address'),
+        'queue_name': queue.get('Name') or queue.get('QueueName'),
+        'queue_id': queue.get('QueueId') or id_from_arn(queue.get('ARN')),
+        'queue_arn': queue.get('ARN'),
+        'queue_enqueuetimestamp': parse_timestamp(queue.get('EnqueueTimestamp')),
+        'queue_dequeuetimestamp': parse_timestamp(queue.get('DequeueTimestamp')),
+        'queue_duration': to_int(queue.get('Duration')),
+        'agent_id': agent.get('AgentId') or id_from_arn(agent.get('ARN')),
+        'agent_arn': agent.get('ARN'),
+        'agent_username': agent.get('Username'),
+        'agent_connectedtoagenttimestamp': parse_timestamp(agent.get('ConnectedToAgentTimestamp')),
+        'agent_interactionduration': to_int(agent.get('AgentInteractionDuration')),
+        'agent_aftercontactworkduration': to_int(agent.get('AfterContactWorkDuration')),
+        'recording_status': recording.get('Status'),
+        'recording_location': recording.get('Location'),
+        'customervoiceactivity_talktime': to_int(voice_activity.get('TalkTime')),
+        'customervoiceactivity_listentime': to_int(voice_activity.get('ListenTime')),
+    }
+    
+    other_attributes = {}
+    for name, value in attributes.items():
+        if name in KNOWN_ATTRIBUTES:
+            row[KNOWN_ATTRIBUTES[name]] = None if value is None else str(value)
+        else:
+            other_attributes[name] = value
+    
+    for column in KNOWN_ATTRIBUTES.values():
+        row.setdefault(column, None)
+    
+    row['attributes_other'] = json.dumps(other_attributes, sort_keys=True) if other_attributes else None
+    
+    return row
+
+def parse_timestamp(value):
+    """Convert an ISO 8601 CTR timestamp to epoch milliseconds"""
+    
+    if not value:
+        return None
+    
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    
+    return int(parsed.timestamp() * 1000)
+
+def to_int(value):
+    """Convert a numeric CTR field to an int, keeping missing values as None"""
+    
+    if value is None or value == '':
+        return None
+    
+    return int(float(value))
+
+def id_from_arn(arn):
+    """Return the last path segment of an ARN, or None"""
+    
+    if not arn:
+        return None
+    
+    return arn.split('/')[-1]
@@ -11,6 +11,61 @@ resource "random_string" "suffix" {
   upper   = false
 }
 
+# Current account and region, used to build Glue ARNs
+data "aws_caller_identity" "current" {}
+
+data "aws_region" "current" {}
+
+# Columns of the flattened CTR table, matching CTR_COLUMNS in lambda_code/transform_ctr_record.py
+locals {
+  ctr_flat_columns = [
+    { name = "awsaccountid", type = "string" },
+    { name = "instanceid", type = "string" },
+    { name = "contactid", type = "string" },
+    { name = "initialcontactid", type = "string" },
+    { name = "previouscontactid", type = "string" },
+    { name = "channel", type = "string" },
+    { name = "initiationmethod", type = "string" },
+    { name = "disconnectreason", type = "string" },
+    { name = "initiationtimestamp", type = "timestamp" },
+    { name = "connectedtosystemtimestamp", type = "timestamp" },
+    { name = "disconnecttimestamp", type = "timestamp" },
+    { name = "customerendpoint_type", type = "string" },
+    { name = "customerendpoint_address", type = "string" },
+    { name = "systemendpoint_address", type = "string" },
+    { name = "queue_name", type = "string" },
+    { name = "queue_id", type = "string" },
+    { name = "queue_arn", type = "string" },
+    { name = "queue_enqueuetimestamp", type = "timestamp" },
+    { name = "queue_dequeuetimestamp", type = "timestamp" },
+    { name = "queue_duration", type = "bigint" },
+    { name = "agent_id", type = "string" },
+    { name = "agent_arn", type = "string" },
+    { name = "agent_username", type = "string" },
+    { name = "agent_connectedtoagenttimestamp", type = "timestamp" },
+    { name = "agent_interactionduration", type = "bigint" },
+    { name = "agent_aftercontactworkduration", type = "bigint" },
+    { name = "recording_status", type = "string" },
+    { name = "recording_location", type = "string" },
+    { name = "customervoiceactivity_talktime", type = "bigint" },
+    { name = "customervoiceactivity_listentime", type = "bigint" },
+    { name = "attributes_customerfirstname", type = "string" },
+    { name = "attributes_customerlastname", type = "string" },
+    { name = "attributes_agentname", type = "string" },
+    { name = "attributes_sentiment", type = "string" },
+    { name = "attributes_resolution", type = "string" },
+    { name = "attributes_other", type = "string" },
+  ]
+  
+  # Parquet output is delivered under its own prefix so it never mixes with raw JSON
+  delivery_prefix = var.enable_parquet_conversion ? var.s3_parquet_prefix : var.s3_prefix
+  
+  # Raw JSON keeps the layout of var.s3_prefix, which the crawler, the
+  # partition registrar and the lake scripts read
+  raw_prefix              = var.enable_s3_partitioning ? "${var.s3_prefix}year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/hour=!{timestamp:HH}/" : var.s3_prefix
+  raw_error_output_prefix = var.enable_s3_partitioning ? "${var.s3_prefix_error}!{firehose:error-output-type}/year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/hour=!{timestamp:HH}/" : "${var.s3_prefix_error}!{firehose:error-output-type}/"
+}
+
 # Create a Kinesis Data Stream to receive Contact Trace Records (CTR) from Connect
 resource "aws_kinesis_stream" "connect_ctr" {
   name             = var.kinesis_stream_name
@@ -106,9 +161,158 @@ resource "aws_iam_role_policy" "firehose_role" {
           aws_s3_bucket.connect_ctr_data.arn,
           "${aws_s3_bucket.connect_ctr_data.arn}/*"
         ]
+      },
+      {
+        Action = [
+          "glue:GetTable",
+          "glue:GetTableVersion",
+          "glue:GetTableVersions"
+        ]
+        Effect   = "Allow"
+        Resource = "*"
+      }
+    ]
+  })
+}
+
+# IAM Policy for Firehose to invoke the transform Lambda
+resource "aws_iam_role_policy" "firehose_transform" {
+  count = var.enable_parquet_conversion ? 1 : 0
+  name  = "${var.firehose_policy_name}-transform"
+  role  = aws_iam_role.firehose_role.id
+  
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = [
+          "lambda:InvokeFunction",
+          "lambda:GetFunctionConfiguration"
+        ]
+        Effect   = "Allow"
+        Resource = [
+          aws_lambda_function.ctr_transform[0].arn,
+          "${aws_lambda_function.ctr_transform[0].arn}:*"
+        ]
+      }
+    ]
+  })
+}
+
+# Archive file for the Firehose transform Lambda
+data "archive_file" "transform_ctr_record_zip" {
+  count       = var.enable_parquet_conversion ? 1 : 0
+  type        = "zip"
+  output_path = "${path.module}/lambda_code/transform_ctr_record.zip"
+  
+  source {
+    content  = file("${path.module}/lambda_code/transform_ctr_record.py")
+    filename = "transform_ctr_record.py"
+  }
+  
+  # Payload decoding shared with the Timestream Lambdas that read the same stream
+  source {
+    content  = file("${path.module}/../timestream/lambda_code/kinesis_payload.py")
+    filename = "kinesis_payload.py"
+  }
+}
+
+# IAM Role for the Firehose transform Lambda
+resource "aws_iam_role" "ctr_transform_lambda" {
+  count = var.enable_parquet_conversion ? 1 : 0
+  name  = var.transform_lambda_role_name
+  
+  # Allow Lambda service to assume this role
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
       }
     ]
   })
+  
+  tags = var.tags
+}
+
+# Attach AWS managed policy for Lambda logging
+resource "aws_iam_role_policy_attachment" "ctr_transform_lambda_basic" {
+  count      = var.enable_parquet_conversion ? 1 : 0
+  role       = aws_iam_role.ctr_transform_lambda[0].name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
+}
+
+# Lambda function that flattens CTRs into the columnar schema for Parquet conversion
+resource "aws_lambda_function" "ctr_transform" {
+  count         = var.enable_parquet_conversion ? 1 : 0
+  function_name = var.transform_lambda_name
+  role          = aws_iam_role.ctr_transform_lambda[0].arn
+  handler       = "transform_ctr_record.lambda_handler"
+  runtime       = var.lambda_runtime
+  timeout       = 60   # Firehose waits at most 5 minutes per invocation
+  memory_size   = 256
+  
+  filename         = data.archive_file.transform_ctr_record_zip[0].output_path
+  source_code_hash = data.archive_file.transform_ctr_record_zip[0].output_base64sha256
+  
+  tags = var.tags
+}
+
+# Glue table describing the flattened Parquet CTRs, used by Firehose for conversion and by Athena for queries
+resource "aws_glue_catalog_table" "connect_ctr_flat" {
+  name          = var.glue_flat_table_name
+  database_name = aws_glue_catalog_database.connect_db.name
+  table_type    = "EXTERNAL_TABLE"
+  
+  # Partition projection lets Athena compute partitions, so none are ever registered
+  parameters = {
+    classification              = "parquet"
+    "parquet.compression"       = var.parquet_compression
+    "projection.enabled"        = "true"
+    "projection.year.type"      = "integer"
+    "projection.year.range"     = var.partition_projection_year_range
+    "projection.month.type"     = "integer"
+    "projection.month.range"    = "1,12"
+    "projection.month.digits"   = "2"
+    "projection.day.type"       = "integer"
+    "projection.day.range"      = "1,31"
+    "projection.day.digits"     = "2"
+    "projection.hour.type"      = "integer"
+    "projection.hour.range"     = "0,23"
+    "projection.hour.digits"    = "2"
+    "storage.location.template" = "s3://${aws_s3_bucket.connect_ctr_data.bucket}/${var.s3_parquet_prefix}year=$${year}/month=$${month}/day=$${day}/hour=$${hour}/"
+  }
+  
+  # Same time-based partitions as the raw JSON data
+  dynamic "partition_keys" {
+    for_each = ["year", "month", "day", "hour"]
+    content {
+      name = partition_keys.value
+      type = "string"
+    }
+  }
+  
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.connect_ctr_data.bucket}/${var.s3_parquet_prefix}"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+    
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+    
+    dynamic "columns" {
+      for_each = local.ctr_flat_columns
+      content {
+        name = columns.value.name
+        type = columns.value.type
+      }
+    }
+  }
 }
 
 # Create Kinesis Firehose delivery stream to move data from Kinesis to S3
@@ -128,17 +332,75 @@ resource "aws_kinesis_firehose_delivery_stream" "connect_ctr" {
     bucket_arn         = aws_s3_bucket.connect_ctr_data.arn
     
     # Use time-based partitioning if enabled, otherwise use simple prefix
-    prefix             = var.enable_s3_partitioning ? "${var.s3_prefix}year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/hour=!{timestamp:HH}/" : var.s3_prefix
+    prefix             = var.enable_s3_partitioning ? "${local.delivery_prefix}year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/hour=!{timestamp:HH}/" : local.delivery_prefix
     
     # Add error output prefix for better debugging
-    error_output_prefix = var.enable_s3_partitioning ? "${var.s3_prefix_error}!{firehose:error-output-type}/year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/hour=!{timestamp:HH}/" : "${var.s3_prefix_error}!{firehose:error-output-type}/"
+    error_output_prefix = local.raw_error_output_prefix
     
-    buffering_size     = var.firehose_buffer_size  # Buffer size in MB
+    # Format conversion requires a buffer of at least 64 MB
+    buffering_size     = var.enable_parquet_conversion ? max(var.firehose_buffer_size, 64) : var.firehose_buffer_size  # Buffer size in MB
     buffering_interval = var.firehose_buffer_interval # Buffer interval in seconds
     
-    # Disable processing configuration to avoid validation errors
+    # With Parquet conversion the source records are backed up as raw JSON under
+    # var.s3_prefix, so the tools reading the raw lake keep seeing new data
+    s3_backup_mode = var.enable_parquet_conversion ? "Enabled" : "Disabled"
+    
+    dynamic "s3_backup_configuration" {
+      for_each = var.enable_parquet_conversion ? [1] : []
+      content {
+        role_arn            = aws_iam_role.firehose_role.arn
+        bucket_arn          = aws_s3_bucket.connect_ctr_data.arn
+        prefix              = local.raw_prefix
+        error_output_prefix = local.raw_error_output_prefix
+        buffering_size      = var.firehose_buffer_size
+        buffering_interval  = var.firehose_buffer_interval
+      }
+    }
+    
+    # Flatten CTRs with the transform Lambda when Parquet conversion is enabled
     processing_configuration {
-      enabled = false
+      enabled = var.enable_parquet_conversion
+      
+      dynamic "processors" {
+        for_each = var.enable_parquet_conversion ? [1] : []
+        content {
+          type = "Lambda"
+          
+          parameters {
+            parameter_name  = "LambdaArn"
+            parameter_value = "${aws_lambda_function.ctr_transform[0].arn}:$LATEST"
+          }
+        }
+      }
+    }
+    
+    # Convert the flattened JSON to compressed Parquet using the Glue table schema
+    dynamic "data_format_conversion_configuration" {
+      for_each = var.enable_parquet_conversion ? [1] : []
+      content {
+        input_format_configuration {
+          deserializer {
+            hive_json_ser_de {
+              timestamp_formats = ["millis"]  # The transform emits epoch milliseconds
+            }
+          }
+        }
+        
+        output_format_configuration {
+          serializer {
+            parquet_ser_de {
+              compression      = var.parquet_compression
+              block_size_bytes = var.parquet_block_size_bytes  # Row group size
+            }
+          }
+        }
+        
+        schema_configuration {
+          database_name = aws_glue_catalog_database.connect_db.name
+          table_name    = aws_glue_catalog_table.connect_ctr_flat.name
+          role_arn      = aws_iam_role.firehose_role.arn
+        }
+      }
     }
   }
   
@@ -220,7 +482,8 @@ resource "aws_glue_crawler" "connect_ctr" {
     path = "s3://${aws_s3_bucket.connect_ctr_data.bucket}/${var.s3_prefix}"
   }
   
-  schedule = var.glue_crawler_schedule # Configurable schedule
+  # The partition registrar replaces scheduled crawls; the crawler is then only run on demand for schema changes
+  schedule = var.enable_partition_registrar ? null : var.glue_crawler_schedule
   
   # Configure the crawler to handle partitioning
   configuration = var.enable_s3_partitioning ? jsonencode({
@@ -245,4 +508,146 @@ resource "aws_glue_crawler" "connect_ctr" {
       Name = var.glue_crawler_name
     }
   )
+}
+
+# ===================================================================
+# INCREMENTAL PARTITION REGISTRATION
+# ===================================================================
+# Registers only new hour partitions of the raw CTR table as objects arrive,
+# instead of re-crawling the whole bucket on a schedule
+
+# Archive file for the partition registrar Lambda
+data "archive_file" "register_ctr_partitions_zip" {
+  type        = "zip"
+  source_file = "${path.module}/lambda_code/register_ctr_partitions.py"
+  output_path = "${path.module}/lambda_code/register_ctr_partitions.zip"
+}
+
+# IAM Role for the partition registrar Lambda
+resource "aws_iam_role" "partition_registrar_lambda" {
+  count = var.enable_partition_registrar ? 1 : 0
+  name  = var.partition_registrar_role_name
+  
+  # Allow Lambda service to assume this role
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+  
+  tags = var.tags
+}
+
+# Attach AWS managed policy for Lambda logging
+resource "aws_iam_role_policy_attachment" "partition_registrar_lambda_basic" {
+  count      = var.enable_partition_registrar ? 1 : 0
+  role       = aws_iam_role.partition_registrar_lambda[0].name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
+}
+
+# IAM Policy for the registrar to read the table and add partitions
+resource "aws_iam_role_policy" "partition_registrar_glue" {
+  count = var.enable_partition_registrar ? 1 : 0
+  name  = "${var.partition_registrar_role_name}-glue"
+  role  = aws_iam_role.partition_registrar_lambda[0].id
+  
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = [
+          "glue:GetTable",
+          "glue:GetPartitions",
+          "glue:BatchCreatePartition"
+        ]
+        Effect   = "Allow"
+        Resource = [
+          "arn:aws:glue:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:catalog",
+          "arn:aws:glue:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:database/${aws_glue_catalog_database.connect_db.name}",
+          "arn:aws:glue:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${aws_glue_catalog_database.connect_db.name}/${var.glue_raw_table_name}"
+        ]
+      }
+    ]
+  })
+}
+
+# Lambda function that registers the partitions of newly delivered objects
+resource "aws_lambda_function" "partition_registrar" {
+  count         = var.enable_partition_registrar ? 1 : 0
+  function_name = var.partition_registrar_name
+  role          = aws_iam_role.partition_registrar_lambda[0].arn
+  handler       = "register_ctr_partitions.lambda_handler"
+  runtime       = var.lambda_runtime
+  timeout       = 60
+  memory_size   = 128
+  
+  filename         = data.archive_file.register_ctr_partitions_zip.output_path
+  source_code_hash = data.archive_file.register_ctr_partitions_zip.output_base64sha256
+  
+  environment {
+    variables = {
+      GLUE_DATABASE_NAME = aws_glue_catalog_database.connect_db.name
+      GLUE_TABLE_NAME    = var.glue_raw_table_name
+      S3_BUCKET_NAME     = aws_s3_bucket.connect_ctr_data.bucket
+      S3_PREFIX          = var.s3_prefix
+    }
+  }
+  
+  tags = var.tags
+}
+
+# Allow S3 to invoke the registrar
+resource "aws_lambda_permission" "partition_registrar_s3" {
+  count         = var.enable_partition_registrar ? 1 : 0
+  statement_id  = "AllowExecutionFromS3"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.partition_registrar[0].function_name
+  principal     = "s3.amazonaws.com"
+  source_arn    = aws_s3_bucket.connect_ctr_data.arn
+}
+
+# Notify the registrar when Firehose delivers a new raw CTR object
+resource "aws_s3_bucket_notification" "partition_registrar" {
+  count  = var.enable_partition_registrar ? 1 : 0
+  bucket = aws_s3_bucket.connect_ctr_data.id
+  
+  lambda_function {
+    lambda_function_arn = aws_lambda_function.partition_registrar[0].arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = var.s3_prefix
+  }
+  
+  depends_on = [aws_lambda_permission.partition_registrar_s3]
+}
+
+# Register the upcoming hour's partition shortly before the hour boundary
+resource "aws_cloudwatch_event_rule" "partition_registrar" {
+  count               = var.enable_partition_registrar ? 1 : 0
+  name                = "${var.partition_registrar_name}-hourly"
+  description         = "Pre-register the next CTR hour partition"
+  schedule_expression = "cron(55 * * * ? *)"
+  
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "partition_registrar" {
+  count = var.enable_partition_registrar ? 1 : 0
+  rule  = aws_cloudwatch_event_rule.partition_registrar[0].name
+  arn   = aws_lambda_function.partition_registrar[0].arn
+}
+
+resource "aws_lambda_permission" "partition_registrar_events" {
+  count         = var.enable_partition_registrar ? 1 : 0
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.partition_registrar[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.partition_registrar[0].arn
 }
\ No newline at end of file
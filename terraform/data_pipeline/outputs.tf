@@ -20,4 +20,9 @@ output "s3_data_bucket" {
 output "glue_database_name" {
   description = "Name of the Glue catalog database"
   value       = aws_glue_catalog_database.connect_db.name
+}
+
+output "glue_flat_table_name" {
+  description = "Name of the Glue table for flattened Parquet CTRs"
+  value       = aws_glue_catalog_table.connect_ctr_flat.name
 }
\ No newline at end of file
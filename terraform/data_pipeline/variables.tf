@@ -50,6 +50,60 @@ variable "s3_prefix_error" {
   default     = "connect-ctr-data-errors/"
 }
 
+variable "enable_parquet_conversion" {
+  description = "Flatten CTRs with the transform Lambda and deliver them to S3 as Parquet, backing up the raw JSON under s3_prefix"
+  type        = bool
+  default     = false
+}
+
+variable "s3_parquet_prefix" {
+  description = "S3 prefix for flattened Parquet CTRs"
+  type        = string
+  default     = "connect-ctr-parquet/"
+}
+
+variable "parquet_compression" {
+  description = "Compression codec for Parquet output (SNAPPY, GZIP or UNCOMPRESSED)"
+  type        = string
+  default     = "SNAPPY"
+}
+
+variable "parquet_block_size_bytes" {
+  description = "Parquet row group size in bytes (Firehose minimum is 64 MiB)"
+  type        = number
+  default     = 134217728  # 128 MiB, within Athena's recommended range
+}
+
+variable "partition_projection_year_range" {
+  description = "Year range for partition projection on the flattened Parquet table"
+  type        = string
+  default     = "2024,2040"
+}
+
+variable "glue_flat_table_name" {
+  description = "Name of the Glue table for flattened Parquet CTRs"
+  type        = string
+  default     = "connect_ctr_flat"
+}
+
+variable "transform_lambda_name" {
+  description = "Name of the Firehose transform Lambda function"
+  type        = string
+  default     = "connect-ctr-transform"
+}
+
+variable "transform_lambda_role_name" {
+  description = "Name of the IAM role for the Firehose transform Lambda"
+  type        = string
+  default     = "connect-ctr-transform-role"
+}
+
+variable "lambda_runtime" {
+  description = "Runtime for the Firehose transform Lambda"
+  type        = string
+  default     = "python3.9"
+}
+
 variable "enable_s3_partitioning" {
   description = "Enable time-based partitioning for S3 data"
   type        = bool
@@ -74,6 +128,30 @@ variable "glue_crawler_schedule" {
   default     = "cron(0 */3 * * ? *)" # Run every 3 hours
 }
 
+variable "enable_partition_registrar" {
+  description = "Register new raw CTR partitions as objects arrive instead of running the Glue crawler on a schedule"
+  type        = bool
+  default     = false
+}
+
+variable "glue_raw_table_name" {
+  description = "Name of the crawler-created table for raw CTR JSON"
+  type        = string
+  default     = "connect_ctr_data"
+}
+
+variable "partition_registrar_name" {
+  description = "Name of the partition registrar Lambda function"
+  type        = string
+  default     = "connect-ctr-partition-registrar"
+}
+
+variable "partition_registrar_role_name" {
+  description = "Name of the IAM role for the partition registrar Lambda"
+  type        = string
+  default     = "connect-ctr-partition-registrar-role"
+}
+
 variable "s3_bucket_prefix" {
   description = "Prefix for the S3 bucket name"
   type        = string
@@ -52,6 +52,8 @@ module "data_pipeline" {
   firehose_name           = "${var.project_name}-delivery-stream"
   firehose_buffer_size    = var.firehose_buffer_size
   firehose_buffer_interval = var.firehose_buffer_interval
+  enable_parquet_conversion = var.enable_parquet_conversion
+  enable_partition_registrar = var.enable_partition_registrar
   
   # Pass tags with module-specific prefix
   tags = merge(
@@ -0,0 +1,145 @@
+"""
+Decoding of Kinesis record payloads
+
+Producers may KPL-aggregate records and compress them with gzip or zstd
+(see scripts/generate_ctr_data.py). Every consumer of the streams unpacks
+payloads here, so each Lambda that reads them is packaged with this file.
+"""
+import gzip
+import hashlib
+import json
+
+# zstd support is optional - it needs the zstandard package in a Lambda layer
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Magic prefixes used to detect aggregated and compressed Kinesis payloads
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+KPL_DIGEST_SIZE = 16
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Limit on nested aggregation/compression layers in a single record
+MAX_PAYLOAD_DEPTH = 4
+
+def decode_kinesis_payload(raw_data):
+    """Decode a raw Kinesis record into the JSON documents it carries
+    
+    A record may hold a single JSON document, a gzip or zstd compressed
+    blob, or a KPL aggregated record whose user records are themselves
+    any of these. Compressed blobs may contain several concatenated or
+    newline-delimited documents.
+    """
+    
+    documents = []
+    for payload in unpack_payload(raw_data):
+        documents.extend(parse_json_documents(payload.decode('utf-8')))
+    
+    return documents
+
+def unpack_payload(data, depth=0):
+    """Recursively strip compression and KPL aggregation from a payload"""
+    
+    if depth > MAX_PAYLOAD_DEPTH:
+        raise ValueError(f"Payload nested deeper than {MAX_PAYLOAD_DEPTH} layers")
+    
+    if data.startswith(GZIP_MAGIC):
+        return unpack_payload(gzip.decompress(data), depth + 1)
+    
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("Received zstd payload but zstandard is not installed")
+        decompressed = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return unpack_payload(decompressed, depth + 1)
+    
+    if data.startswith(KPL_MAGIC):
+        user_records = deaggregate_kpl_record(data)
+        if user_records is not None:
+            payloads = []
+            for user_data in user_records:
+                payloads.extend(unpack_payload(user_data, depth + 1))
+            return payloads
+    
+    return [data]
+
+def deaggregate_kpl_record(data):
+    """Extract the user record payloads from a KPL aggregated record
+    
+    Returns None when the checksum does not match, in which case the
+    record is treated as a plain payload, as the KPL deaggregators do.
+    """
+    
+    message = data[len(KPL_MAGIC):-KPL_DIGEST_SIZE]
+    digest = data[-KPL_DIGEST_SIZE:]
+    if len(data) < len(KPL_MAGIC) + KPL_DIGEST_SIZE or hashlib.md5(message).digest() != digest:
+        return None
+    
+    # AggregatedRecord field 3 holds the repeated Record messages,
+    # and Record field 3 holds the user payload bytes
+    user_records = []
+    for field_number, value in iter_protobuf_fields(message):
+        if field_number == 3:
+            for record_field, record_value in iter_protobuf_fields(value):
+                if record_field == 3:
+                    user_records.append(record_value)
+    
+    return user_records
+
+def iter_protobuf_fields(message):
+    """Yield (field number, value) pairs from a protobuf message
+    
+    Only varint and length-delimited wire types are used by the KPL
+    aggregation format; other wire types are rejected.
+    """
+    
+    position = 0
+    while position < len(message):
+        key, position = read_varint(message, position)
+        field_number, wire_type = key >> 3, key & 0x7
+        
+        if wire_type == 0:
+            value, position = read_varint(message, position)
+        elif wire_type == 2:
+            length, position = read_varint(message, position)
+            value = message[position:position + length]
+            if len(value) != length:
+                raise ValueError("Truncated KPL aggregated record")
+            position += length
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        
+        yield field_number, value
+
+def read_varint(message, position):
+    """Read a protobuf varint and return it with the next position"""
+    
+    result = 0
+    shift = 0
+    while True:
+        if position >= len(message):
+            raise ValueError("Truncated varint in KPL aggregated record")
+        byte = message[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+def parse_json_documents(text):
+    """Parse one or more concatenated JSON documents from a string"""
+    
+    decoder = json.JSONDecoder()
+    documents = []
+    position = 0
+    while True:
+        # Skip whitespace and newlines between documents
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text):
+            break
+        document, position = decoder.raw_decode(text, position)
+        documents.append(document)
+    
+    return documents
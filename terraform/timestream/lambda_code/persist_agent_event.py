@@ -1,43 +1,160 @@
 import json
 import base64
+import marshal
+import multiprocessing
 import os
+import threading
+import zlib
 import boto3
 import time
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from kinesis_payload import decode_kinesis_payload
+import timestream_common
+from timestream_common import (WRITE_CHUNK_SIZE, add_duration_measure, add_timestamp_measure, dimension_catalog,
+                               parse_timestamp_ms, spool_failed_batch, write_ledger, write_records_to_timestream)
 
-# Initialize Timestream client
-timestream_write = boto3.client('timestream-write', 
-                               region_name=os.environ.get('TIMESTREAM_REGION', 'eu-west-2'))
-database_name = os.environ.get('TIMESTREAM_DATABASE_NAME', 'connect-analytics')
+# Pipelined mode: number of concurrent writer lanes (0 disables it) and
+# the maximum number of chunks queued or being written at any time (at
+# least one, or the first chunk would wait forever)
+PIPELINE_WRITERS = int(os.environ.get('PIPELINE_WRITERS', '0'))
+PIPELINE_MAX_IN_FLIGHT = max(1, int(os.environ.get('PIPELINE_MAX_IN_FLIGHT', '8')))
+
+# Writer lanes are created on first use and reused across warm invocations
+writer_lanes = []
+
+# Parallel transform: worker processes that decode and build records (0
+# disables it), used only for batches of at least TRANSFORM_MIN_RECORDS
+# Kinesis records, below which the pipe overhead outweighs the extra cores
+TRANSFORM_PROCESSES = int(os.environ.get('TRANSFORM_PROCESSES', '0'))
+TRANSFORM_MIN_RECORDS = int(os.environ.get('TRANSFORM_MIN_RECORDS', '1000'))
+
+# Transform workers are started on first use and reused across warm invocations
+transform_workers = []
+
+# Contact-state delta writes: maximum (AgentARN, ContactId) entries kept
+# (0 writes every contact on every event) and how long an entry lives
+CONTACT_STATE_CACHE_SIZE = int(os.environ.get('CONTACT_STATE_CACHE_SIZE', '10000'))
+CONTACT_STATE_CACHE_TTL = int(os.environ.get('CONTACT_STATE_CACHE_TTL_SECONDS', '3600'))
+
+# Hierarchy group names published by persist_instance_data (s3://bucket/key
+# or a local file path) and how long a loaded copy is used before reloading
+HIERARCHY_CACHE_LOCATION = os.environ.get('HIERARCHY_CACHE_LOCATION', '')
+HIERARCHY_CACHE_TTL = int(os.environ.get('HIERARCHY_CACHE_TTL_SECONDS', '300'))
+s3 = boto3.client('s3', region_name=os.environ.get('AWS_REGION', 'eu-west-2'))
+
+# Connect names hierarchy levels LevelOne..LevelFive (agent events may also use Level1..Level5)
+HIERARCHY_LEVELS = {'LevelOne': 1, 'LevelTwo': 2, 'LevelThree': 3, 'LevelFour': 4, 'LevelFive': 5}
+
+# Per-contact CTR rows: table name (empty disables them and CTRs on the
+# stream are skipped, as before) and the contact attributes written as
+# Attribute_<name> measures, comma separated
+CONTACT_RECORD_TABLE = os.environ.get('CONTACT_RECORD_TABLE', '')
+CONTACT_RECORD_ATTRIBUTES = [name.strip() for name in os.environ.get('CONTACT_RECORD_ATTRIBUTES', '').split(',')
+                             if name.strip()]
+
+# CTR numbers written as BIGINT measures: (object, field, measure name);
+# durations are in seconds, as Connect reports them
+CONTACT_RECORD_NUMBERS = [
+    ('Queue', 'Duration', 'QueueDuration'),
+    ('Agent', 'AgentInteractionDuration', 'AgentInteractionDuration'),
+    ('Agent', 'AfterContactWorkDuration', 'AfterContactWorkDuration'),
+    ('Agent', 'CustomerHoldDuration', 'CustomerHoldDuration'),
+    ('Agent', 'LongestHoldDuration', 'LongestHoldDuration'),
+    ('Agent', 'NumberOfHolds', 'NumberOfHolds'),
+    ('CustomerVoiceActivity', 'TalkTime', 'TalkTime'),
+    ('CustomerVoiceActivity', 'ListenTime', 'ListenTime')
+]
+
+# Timestream limits VARCHAR measure values to 2 KB; contact attributes can be longer
+MAX_VARCHAR_MEASURE_BYTES = 2048
 
 def lambda_handler(event, context):
     """
     Process agent events from Kinesis stream and write to Timestream
     
     This Lambda processes Connect CTR records containing agent events
-    and persists them to Timestream tables.
+    and persists them to Timestream tables. With CONTACT_RECORD_TABLE set,
+    the CTRs on the stream are written there as one row per contact.
     """
     
     print(f"Processing {len(event['Records'])} records")
     
-    # Records for each table
-    agent_event_records = []
-    agent_event_contact_records = []
+    contact_state_cache.begin()
+    write_ledger.begin()
+    try:
+        if PIPELINE_WRITERS > 0:
+            process_records_pipelined(event['Records'])
+        else:
+            process_records(event['Records'])
+        contact_state_cache.commit()
+        write_ledger.end()
+    except Exception as e:
+        # The batch's contact rows may not have been written, so a retry must not suppress them
+        contact_state_cache.rollback()
+        
+        # A captured batch is replayed later; only let Kinesis retry when capture fails
+        if not spool_failed_batch('agent-event', event['Records'], e, write_ledger.end()):
+            raise e
+    
+    dimension_catalog.flush()
+    
+    print(f"Contact state cache: {json.dumps(contact_state_cache.pop_counters())}")
+    print(f"Timestream writes: {json.dumps(timestream_common.timestream_writer.pop_stats())}")
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'Processed {len(event["Records"])} records')
+    }
+
+def iter_agent_events(records):
+    """Decode Kinesis records and yield the agent events they contain"""
     
-    # Process each record from Kinesis
-    for record in event['Records']:
+    for data in iter_documents(records):
+        if is_agent_event(data):
+            yield data
+
+def iter_documents(records):
+    """Decode Kinesis records and yield every JSON document they contain"""
+    
+    for record in records:
         try:
-            # Decode and parse the payload
-            payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
-            data = json.loads(payload)
-            
-            # Check if this is a Connect CTR record with agent event data
-            if 'Agent' in data and 'EventType' in data:
-                process_agent_event(data, agent_event_records, agent_event_contact_records)
-            
+            # Decode the payload, unpacking KPL aggregation and compression
+            raw_data = base64.b64decode(record['kinesis']['data'])
+            documents = decode_kinesis_payload(raw_data)
         except Exception as e:
             print(f"Error processing record: {str(e)}")
             continue
+        
+        yield from documents
+
+def is_agent_event(data):
+    """Whether a stream document is an agent event"""
+    
+    return 'Agent' in data and 'EventType' in data
+
+def is_contact_trace_record(data):
+    """Whether a stream document is a contact trace record (CTR)"""
+    
+    return 'ContactId' in data and 'EventType' not in data
+
+def process_records(records):
+    """Transform the whole batch, then write each table in turn"""
+    
+    # Records for each table
+    agent_event_records = []
+    agent_event_contact_records = []
+    contact_record_records = []
+    
+    for key, event_records, contact_records, ctr_records in iter_processed_events(records):
+        agent_event_records.extend(event_records)
+        agent_event_contact_records.extend(contact_records)
+        contact_record_records.extend(ctr_records)
+    
+    write_ledger.add("AgentEvent", agent_event_records)
+    write_ledger.add("AgentEvent_Contact", agent_event_contact_records)
+    write_ledger.add(CONTACT_RECORD_TABLE, contact_record_records)
+    write_ledger.seal()
     
     # Write records to Timestream (if any)
     if agent_event_records:
@@ -46,17 +163,605 @@ def lambda_handler(event, context):
     if agent_event_contact_records:
         write_records_to_timestream("AgentEvent_Contact", agent_event_contact_records)
     
+    if contact_record_records:
+        write_records_to_timestream(CONTACT_RECORD_TABLE, contact_record_records)
+
+def process_records_pipelined(records):
+    """Transform the batch while completed chunks are written concurrently
+    
+    Each AgentARN (or ContactId, for CTRs) is pinned to one writer lane,
+    and each lane writes its chunks in submission order, so records for
+    the same agent are written in the order they were received.
+    """
+    
+    writer = PipelinedWriter(get_writer_lanes(), PIPELINE_MAX_IN_FLIGHT)
+    
+    try:
+        for key, agent_event_records, agent_event_contact_records, ctr_records in iter_processed_events(records):
+            writer.add("AgentEvent", key, agent_event_records)
+            writer.add("AgentEvent_Contact", key, agent_event_contact_records)
+            writer.add(CONTACT_RECORD_TABLE, key, ctr_records)
+    except Exception:
+        # Let the chunks already submitted finish, then raise the original failure
+        writer.abort()
+        raise
+    
+    # Every record is built, so from here on only chunk writes can fail
+    write_ledger.seal()
+    
+    # Flush partial chunks and wait for every write, re-raising the first failure
+    writer.close()
+
+def get_writer_lanes():
+    """Return the single-threaded writer lanes, creating them on first use"""
+    
+    while len(writer_lanes) < PIPELINE_WRITERS:
+        writer_lanes.append(ThreadPoolExecutor(max_workers=1))
+    
+    return writer_lanes[:PIPELINE_WRITERS]
+
+class PipelinedWriter:
+    """Buffers records per writer lane and table and submits full chunks"""
+
+    def __init__(self, lanes, max_in_flight):
+        self.lanes = lanes
+        self.buffers = {}
+        self.futures = []
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def add(self, table_name, key, records):
+        """Queue records for an agent or contact, submitting any chunk that fills up"""
+        
+        if not records:
+            return
+        
+        write_ledger.add(table_name, records)
+        lane = zlib.crc32(key.encode('utf-8')) % len(self.lanes)
+        buffer = self.buffers.setdefault((lane, table_name), [])
+        buffer.extend(records)
+        
+        while len(buffer) >= WRITE_CHUNK_SIZE:
+            self.submit(lane, table_name, buffer[:WRITE_CHUNK_SIZE])
+            del buffer[:WRITE_CHUNK_SIZE]
+
+    def submit(self, lane, table_name, chunk):
+        """Hand a chunk to a lane, blocking while too many chunks are in flight"""
+        
+        self.in_flight.acquire()
+        try:
+            future = self.lanes[lane].submit(self.write_chunk, table_name, chunk)
+        except Exception:
+            self.in_flight.release()
+            raise
+        self.futures.append(future)
+
+    def write_chunk(self, table_name, chunk):
+        try:
+            write_records_to_timestream(table_name, chunk)
+        finally:
+            self.in_flight.release()
+
+    def close(self):
+        """Submit the remaining partial chunks and wait for all writes"""
+        
+        for (lane, table_name), buffer in self.buffers.items():
+            if buffer:
+                self.submit(lane, table_name, buffer)
+        self.buffers = {}
+        
+        errors = [future.exception() for future in self.futures]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            print(f"{len(errors)} of {len(self.futures)} chunk writes failed")
+            raise errors[0]
+
+    def abort(self):
+        """Drop the partial chunks and wait for the writes already submitted"""
+        
+        self.buffers = {}
+        wait(self.futures)
+        failed = sum(1 for future in self.futures if future.exception() is not None)
+        if failed:
+            print(f"{failed} of {len(self.futures)} chunk writes failed")
+
+def iter_processed_events(records):
+    """Yield (key, AgentEvent, AgentEvent_Contact and ContactRecord records) per document
+    
+    The key is the AgentARN of an agent event or the ContactId of a CTR.
+    Large batches are decoded and transformed by the worker processes
+    when parallel transform is enabled. Either way the stateful steps
+    (contact deltas and the dimension catalog) run in this process, in
+    the order the events were received.
+    """
+    
+    if TRANSFORM_PROCESSES > 1 and len(records) >= TRANSFORM_MIN_RECORDS:
+        yield from iter_parallel_events(records)
+    else:
+        yield from iter_local_events(records)
+
+def iter_local_events(records):
+    """Transform the events of a batch in this process"""
+    
+    for data in iter_documents(records):
+        if CONTACT_RECORD_TABLE and is_contact_trace_record(data):
+            try:
+                contact_record = build_contact_record(data, str(int(time.time() * 1000)))
+            except Exception as e:
+                print(f"Error processing record: {str(e)}")
+                continue
+            
+            yield contact_record['Dimensions'][0]['Value'], [], [], [contact_record]
+            continue
+        
+        if not is_agent_event(data):
+            continue
+        
+        agent_event_records = []
+        agent_event_contact_records = []
+        try:
+            process_agent_event(data, agent_event_records, agent_event_contact_records)
+        except Exception as e:
+            print(f"Error processing record: {str(e)}")
+            continue
+        
+        yield data.get('Agent', {}).get('ARN', 'unknown'), agent_event_records, agent_event_contact_records, []
+
+def iter_parallel_events(records):
+    """Split a batch across the transform workers and merge their results in order"""
+    
+    workers = get_transform_workers()
+    size = -(-len(records) // len(workers))
+    pending = []
+    for index, worker in enumerate(workers):
+        records_slice = records[index * size:(index + 1) * size]
+        if records_slice:
+            worker.send(records_slice)
+            pending.append((worker, records_slice))
+    
+    try:
+        while pending:
+            worker, records_slice = pending.pop(0)
+            result = worker.receive()
+            if result is None:
+                # The worker failed; transform its slice here instead
+                yield from iter_local_events(records_slice)
+                continue
+            
+            results, observed = result
+            for dimension, value in observed:
+                dimension_catalog.observe(dimension, value)
+            
+            for summary, record, contacts, signatures in results:
+                # A CTR has no summary; its record's first dimension is the ContactId
+                if summary is None:
+                    yield record['Dimensions'][0]['Value'], [], [], [record]
+                    continue
+                
+                if record is None:
+                    continue
+                
+                agent_event_contact_records = []
+                if contacts is not None:
+                    agent_event_contact_records = contact_delta_records(summary, contacts, record['Time'], signatures)
+                yield summary['Agent']['ARN'], [record], agent_event_contact_records, []
+    finally:
+        # Leave every pipe empty for the next invocation, even if the caller stopped early
+        for worker, records_slice in pending:
+            worker.receive()
+
+def get_transform_workers():
+    """Return the transform workers, replacing any that have exited"""
+    
+    transform_workers[:] = [worker for worker in transform_workers if worker.is_alive()]
+    while len(transform_workers) < TRANSFORM_PROCESSES:
+        transform_workers.append(TransformWorker())
+    
+    return transform_workers[:TRANSFORM_PROCESSES]
+
+class TransformWorker:
+    """A forked process that transforms slices of a batch sent over a pipe
+    
+    Lambda has no /dev/shm, so multiprocessing.Pool and Queue (which need
+    POSIX semaphores) are unavailable; each worker is a plain Process with
+    its own Pipe. Workers are forked from a forkserver that has only
+    imported this module, never from the container itself: by the time a
+    worker is started or replaced, the writer lanes and the secondary
+    region's threads may hold locks (logging, boto3, the timestamp cache)
+    that a forked child would inherit held. As with any forkserver, a
+    script that starts workers needs an if __name__ == '__main__' guard,
+    as the Lambda runtime's bootstrap has. Workers read the same
+    configuration and load hierarchy names themselves, but the contact
+    state cache stays in the parent: workers return each contact with its
+    signature and the parent builds rows only for the ones that changed.
+    Slices and results cross the pipe marshalled, which loads faster than
+    pickle. A worker that fails is stopped and replaced on the next batch,
+    and its slice is transformed locally.
+    """
+
+    def __init__(self):
+        context = multiprocessing.get_context('forkserver')
+        # Preload this module so each worker forks with it already imported
+        context.set_forkserver_preload([__name__])
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=run_transform_worker, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.failed = False
+
+    def is_alive(self):
+        return not self.failed and self.process.is_alive()
+
+    def send(self, records):
+        try:
+            self.connection.send_bytes(marshal.dumps(records))
+        except Exception as e:
+            self.fail(e)
+
+    def receive(self):
+        """Return the worker's (results, observed dimensions), or None if it failed"""
+        
+        if self.failed:
+            return None
+        
+        try:
+            error, results, observed = marshal.loads(self.connection.recv_bytes())
+        except Exception as e:
+            self.fail(e)
+            return None
+        
+        if error is not None:
+            self.fail(error)
+            return None
+        return results, observed
+
+    def fail(self, error):
+        print(f"Transform worker {self.process.pid} failed: {str(error)}")
+        self.failed = True
+        self.connection.close()
+        self.process.kill()
+
+def run_transform_worker(connection):
+    """Transform each slice received on the pipe until the parent closes it"""
+    
+    while True:
+        try:
+            records = marshal.loads(connection.recv_bytes())
+        except EOFError:
+            break
+        
+        try:
+            result = (None,) + transform_slice(records)
+        except Exception as e:
+            result = (str(e), None, None)
+        connection.send_bytes(marshal.dumps(result))
+
+def transform_slice(records):
+    """Transform a slice of a batch in a worker process
+    
+    Returns a (summary, AgentEvent record, contacts, contact signatures)
+    tuple per agent event, with a None record for an event that failed,
+    a (None, ContactRecord record, None, None) tuple per CTR, and the
+    dimension values observed in the slice.
+    """
+    
+    results = []
+    for data in iter_documents(records):
+        if CONTACT_RECORD_TABLE and is_contact_trace_record(data):
+            try:
+                results.append((None, build_contact_record(data, str(int(time.time() * 1000))), None, None))
+            except Exception as e:
+                print(f"Error processing record: {str(e)}")
+            continue
+        
+        if not is_agent_event(data):
+            continue
+        
+        summary = event_summary(data)
+        try:
+            agent_event_record = build_agent_event_record(data, str(int(time.time() * 1000)))
+        except Exception as e:
+            print(f"Error processing record: {str(e)}")
+            results.append((summary, None, None, None))
+            continue
+        
+        contacts = data.get('Contacts', []) if 'Contacts' in data else None
+        signatures = [ContactStateCache.contact_signature(contact) for contact in contacts or []]
+        results.append((summary, agent_event_record, contacts, signatures))
+    
+    observed = sorted(dimension_catalog.pending)
+    dimension_catalog.pending.clear()
+    return results, observed
+
+def event_summary(data):
+    """The fields of an agent event the contact rows need"""
+    
     return {
-        'statusCode': 200,
-        'body': json.dumps(f'Processed {len(event["Records"])} records')
+        'Agent': {'ARN': data.get('Agent', {}).get('ARN', 'unknown')},
+        'InstanceId': data.get('InstanceId', 'unknown'),
+        'EventType': data.get('EventType', 'unknown'),
+        'EventTimestamp': data.get('EventTimestamp')
     }
 
+class ContactStateCache:
+    """Last written state of each (AgentARN, ContactId) pair
+    
+    Used to suppress AgentEvent_Contact rows that would repeat the
+    previous row for the same contact. Entries are kept in least recently
+    seen order and evicted when the cache is full or older than the TTL.
+    An evicted contact simply gets written again the next time it is seen.
+    
+    Between begin() and commit() the entries a batch changes are journaled,
+    so rollback() can restore them when the batch's rows were not written
+    and a retried batch writes its contact rows again.
+    """
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.agent_contacts = {}
+        self.journal = None
+        self.agent_journal = None
+        self.counters = self.new_counters()
+
+    @staticmethod
+    def new_counters():
+        return {'emitted': 0, 'suppressed': 0, 'ended': 0, 'evicted': 0, 'rolled_back': 0}
+
+    @staticmethod
+    def contact_signature(contact):
+        """The fields whose change makes a contact row worth writing"""
+        
+        return (
+            contact.get('State'),
+            contact.get('Channel'),
+            json.dumps(contact.get('Queue'), sort_keys=True),
+            contact.get('StateStartTimestamp'),
+            contact.get('ConnectedToAgentTimestamp')
+        )
+
+    def has_changed(self, agent_arn, contact, signature=None):
+        """Record the contact's state and report whether it needs a row"""
+        
+        if self.max_size <= 0:
+            self.counters['emitted'] += 1
+            return True
+        
+        now = time.time()
+        self.evict_expired(now)
+        
+        key = (agent_arn, contact.get('ContactId', 'unknown'))
+        if signature is None:
+            signature = self.contact_signature(contact)
+        entry = self.entries.get(key)
+        
+        if entry is not None and entry[0] == signature:
+            entry[2] = now
+            self.entries.move_to_end(key)
+            self.counters['suppressed'] += 1
+            return False
+        
+        self.remember(key)
+        self.entries[key] = [signature, contact, now]
+        self.entries.move_to_end(key)
+        self.remember_agent(agent_arn)
+        self.agent_contacts.setdefault(agent_arn, set()).add(key[1])
+        self.evict_overflow()
+        self.counters['emitted'] += 1
+        return True
+
+    def remove_missing(self, agent_arn, contacts):
+        """Forget the agent's contacts that are absent from this event
+        
+        Returns the last known state of each contact that disappeared and
+        has not already been written as ENDED.
+        """
+        
+        if self.max_size <= 0:
+            return []
+        
+        current_ids = {contact.get('ContactId', 'unknown') for contact in contacts}
+        known_ids = self.agent_contacts.get(agent_arn, set())
+        
+        ended = []
+        if known_ids - current_ids:
+            self.remember_agent(agent_arn)
+        for contact_id in known_ids - current_ids:
+            self.remember((agent_arn, contact_id))
+            entry = self.entries.pop((agent_arn, contact_id), None)
+            if entry is not None and entry[1].get('State') != 'ENDED':
+                ended.append(entry[1])
+                self.counters['ended'] += 1
+        
+        if current_ids & known_ids:
+            self.agent_contacts[agent_arn] = current_ids & known_ids
+        else:
+            self.agent_contacts.pop(agent_arn, None)
+        
+        return ended
+
+    def evict_expired(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if now - entry[2] <= self.ttl_seconds:
+                break
+            self.evict(key)
+
+    def evict_overflow(self):
+        while len(self.entries) > self.max_size:
+            self.evict(next(iter(self.entries)))
+
+    def evict(self, key):
+        self.remember(key)
+        self.entries.pop(key)
+        agent_arn, contact_id = key
+        self.remember_agent(agent_arn)
+        contact_ids = self.agent_contacts.get(agent_arn)
+        if contact_ids is not None:
+            contact_ids.discard(contact_id)
+            if not contact_ids:
+                del self.agent_contacts[agent_arn]
+        self.counters['evicted'] += 1
+
+    def begin(self):
+        """Start journaling the changes of a batch"""
+        
+        self.journal = {}
+        self.agent_journal = {}
+
+    def commit(self):
+        """Keep the batch's changes once its rows are written"""
+        
+        self.journal = None
+        self.agent_journal = None
+
+    def rollback(self):
+        """Restore the entries the batch changed, as its rows were not written"""
+        
+        if self.journal is None:
+            return
+        
+        for key, entry in self.journal.items():
+            if entry is None:
+                self.entries.pop(key, None)
+            else:
+                self.entries[key] = entry
+        for agent_arn, contact_ids in self.agent_journal.items():
+            if contact_ids is None:
+                self.agent_contacts.pop(agent_arn, None)
+            else:
+                self.agent_contacts[agent_arn] = contact_ids
+        
+        self.counters['rolled_back'] += len(self.journal)
+        self.commit()
+
+    def remember(self, key):
+        """Journal an entry's state before the batch first changes it"""
+        
+        if self.journal is not None and key not in self.journal:
+            self.journal[key] = self.entries.get(key)
+
+    def remember_agent(self, agent_arn):
+        """Journal an agent's contact ids before the batch first changes them"""
+        
+        if self.agent_journal is not None and agent_arn not in self.agent_journal:
+            contact_ids = self.agent_contacts.get(agent_arn)
+            self.agent_journal[agent_arn] = set(contact_ids) if contact_ids is not None else None
+
+    def pop_counters(self):
+        """Return the counters accumulated since the last call and reset them"""
+        
+        counters = self.counters
+        self.counters = self.new_counters()
+        return counters
+
+# The cache lives at module level so it carries over between warm invocations
+contact_state_cache = ContactStateCache(CONTACT_STATE_CACHE_SIZE, CONTACT_STATE_CACHE_TTL)
+
+class HierarchyNameCache:
+    """Hierarchy group names and paths published by persist_instance_data
+    
+    The published map is loaded on first use and reloaded once it is
+    older than the TTL, so a warm container reads it at most once per TTL.
+    If a reload fails the previous copy keeps being used.
+    """
+
+    def __init__(self, location, ttl_seconds):
+        self.location = location
+        self.ttl_seconds = ttl_seconds
+        self.groups = {}
+        self.loaded_at = None
+
+    def get_groups(self):
+        now = time.time()
+        if self.location and (self.loaded_at is None or now - self.loaded_at > self.ttl_seconds):
+            # Set before loading so a failing location is not retried on every event
+            self.loaded_at = now
+            try:
+                if self.location.startswith('s3://'):
+                    bucket, _, key = self.location[len('s3://'):].partition('/')
+                    body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+                else:
+                    with open(self.location, 'rb') as f:
+                        body = f.read()
+                self.groups = json.loads(body).get('groups', {})
+            except Exception as e:
+                print(f"Error loading hierarchy groups from {self.location}: {str(e)}")
+        return self.groups
+
+    def name(self, group_id):
+        """Return the name of a hierarchy group, or None if it is unknown"""
+        
+        return self.get_groups().get(group_id, {}).get('Name')
+
+    def path(self, group_id):
+        """Return {level number: name} for the group and its parents"""
+        
+        path = self.get_groups().get(group_id, {}).get('Path', {})
+        return {int(level): name for level, name in path.items()}
+
+# Shared across warm invocations like the contact state cache
+hierarchy_cache = HierarchyNameCache(HIERARCHY_CACHE_LOCATION, HIERARCHY_CACHE_TTL)
+
+def hierarchy_level_number(level):
+    """Return the level number of a hierarchy path key, or None"""
+    
+    if level in HIERARCHY_LEVELS:
+        return HIERARCHY_LEVELS[level]
+    digits = level[len('Level'):] if level.startswith('Level') else level
+    return int(digits) if digits.isdigit() and 1 <= int(digits) <= 5 else None
+
+def hierarchy_dimensions(data):
+    """Flatten an agent's hierarchy into HierarchyLevel1..5 dimensions
+    
+    Each level of the path is an object ({Id, Name, Arn}); levels without
+    a name are resolved through the hierarchy cache, and an agent that only
+    carries a HierarchyGroupId gets its whole path from the cache.
+    """
+    
+    agent = data.get('Agent', {})
+    configuration = data.get('CurrentAgentSnapshot', {}).get('Configuration', {})
+    path = agent.get('HierarchyPath') or configuration.get('AgentHierarchyGroups') or {}
+    
+    levels = {}
+    for level, group in path.items():
+        number = hierarchy_level_number(level)
+        if number is None or not group:
+            continue
+        
+        if isinstance(group, dict):
+            group_id = group.get('Id') or group.get('Arn', '').split('/')[-1]
+            name = group.get('Name') or hierarchy_cache.name(group_id) or group_id
+        else:
+            name = str(group)
+        
+        if name:
+            levels[number] = name
+    
+    group_id = agent.get('HierarchyGroupId') or configuration.get('HierarchyGroupId')
+    if group_id:
+        for number, name in hierarchy_cache.path(group_id).items():
+            levels.setdefault(number, name)
+    
+    return [{'Name': f'HierarchyLevel{number}', 'Value': levels[number]} for number in sorted(levels)]
+
 def process_agent_event(data, agent_event_records, agent_event_contact_records):
     """Process a single agent event and prepare records for Timestream"""
     
     # Get current time for the record
     current_time = str(int(time.time() * 1000))
     
+    # Add the record to the batch
+    agent_event_records.append(build_agent_event_record(data, current_time))
+    
+    # Process Contact information if available
+    if 'Contacts' in data:
+        agent_event_contact_records.extend(
+            contact_delta_records(data, data.get('Contacts', []), current_time))
+
+def build_agent_event_record(data, current_time):
+    """Build the AgentEvent record for an agent event"""
+    
     # Prepare dimensions for the agent event record
     dimensions = [
         {'Name': 'AgentARN', 'Value': data.get('Agent', {}).get('ARN', 'unknown')},
@@ -65,11 +770,11 @@ def process_agent_event(data, agent_event_records, agent_event_contact_records):
         {'Name': 'EventTimestamp', 'Value': data.get('EventTimestamp', 'unknown')}
     ]
     
-    # Add hierarchyPath dimensions if available
-    if 'HierarchyPath' in data.get('Agent', {}):
-        hierarchy = data.get('Agent', {}).get('HierarchyPath', {})
-        for level, name in hierarchy.items():
-            dimensions.append({'Name': f'Hierarchy{level}', 'Value': name})
+    # Add HierarchyLevel1..5 dimensions so dashboards can filter by team
+    hierarchy = hierarchy_dimensions(data)
+    dimensions.extend(hierarchy)
+    for dimension in hierarchy:
+        dimension_catalog.observe(dimension['Name'], dimension['Value'])
     
     # Prepare measures for the agent event record
     measures = []
@@ -96,6 +801,7 @@ def process_agent_event(data, agent_event_records, agent_event_contact_records):
         # Add agent configuration data
         if 'Configuration' in snapshot:
             config = snapshot.get('Configuration', {})
+            dimension_catalog.observe('RoutingProfile', config.get('RoutingProfile', {}).get('Name'))
             
             # Add username
             if 'Username' in config:
@@ -126,6 +832,7 @@ def process_agent_event(data, agent_event_records, agent_event_contact_records):
             
             # Add state name
             if 'Name' in status:
+                dimension_catalog.observe('AgentStatusName', status.get('Name'))
                 measures.append({
                     'Name': 'AgentStatusName',
                     'Value': status.get('Name', ''),
@@ -147,6 +854,13 @@ def process_agent_event(data, agent_event_records, agent_event_contact_records):
                     'Value': str(status.get('Duration', 0)),
                     'Type': 'BIGINT'
                 })
+        
+        # Add the number of contacts, for the on-contact time of the state rollups
+        measures.append({
+            'Name': 'ContactCount',
+            'Value': str(len(data.get('Contacts') or snapshot.get('Contacts') or [])),
+            'Type': 'BIGINT'
+        })
     
     # Create the record for the agent event
     agent_event_record = {
@@ -157,83 +871,167 @@ def process_agent_event(data, agent_event_records, agent_event_contact_records):
         'Time': current_time
     }
     
-    # Add the record to the batch
-    agent_event_records.append(agent_event_record)
+    return agent_event_record
+
+def contact_delta_records(data, contacts, current_time, signatures=None):
+    """Return the AgentEvent_Contact records to write for an agent event's contacts
     
-    # Process Contact information if available
-    if 'Contacts' in data:
-        for contact in data.get('Contacts', []):
-            # Prepare dimensions for the agent event contact record
-            contact_dimensions = [
-                {'Name': 'AgentARN', 'Value': data.get('Agent', {}).get('ARN', 'unknown')},
-                {'Name': 'InstanceId', 'Value': data.get('InstanceId', 'unknown')},
-                {'Name': 'ContactId', 'Value': contact.get('ContactId', 'unknown')},
-                {'Name': 'Channel', 'Value': contact.get('Channel', 'unknown')},
-                {'Name': 'EventType', 'Value': data.get('EventType', 'unknown')}
-            ]
-            
-            # Prepare measures for the agent event contact record
-            contact_measures = []
-            
-            # Add state durations if available
-            if 'StateStartTimestamp' in contact:
-                contact_measures.append({
-                    'Name': 'StateStartTimestamp',
-                    'Value': contact.get('StateStartTimestamp', ''),
-                    'Type': 'VARCHAR'
-                })
-            
-            if 'State' in contact:
-                contact_measures.append({
-                    'Name': 'ContactState',
-                    'Value': contact.get('State', ''),
-                    'Type': 'VARCHAR'
-                })
-            
-            if 'ConnectedToAgentTimestamp' in contact:
-                contact_measures.append({
-                    'Name': 'ConnectedToAgentTimestamp',
-                    'Value': contact.get('ConnectedToAgentTimestamp', ''),
-                    'Type': 'VARCHAR'
-                })
-            
-            if 'Queue' in contact and 'Name' in contact['Queue']:
-                contact_measures.append({
-                    'Name': 'QueueName',
-                    'Value': contact.get('Queue', {}).get('Name', ''),
-                    'Type': 'VARCHAR'
-                })
-            
-            # Create the record for the agent event contact
-            agent_event_contact_record = {
-                'Dimensions': contact_dimensions,
-                'MeasureName': 'AgentEventContact',
-                'MeasureValueType': 'MULTI',
-                'MeasureValues': contact_measures,
-                'Time': current_time
-            }
-            
-            # Add the record to the batch
-            agent_event_contact_records.append(agent_event_contact_record)
+    signatures, when given, holds each contact's signature as computed by
+    a transform worker; otherwise they are computed here.
+    """
+    
+    agent_arn = data.get('Agent', {}).get('ARN', 'unknown')
+    records = []
+    
+    for index, contact in enumerate(contacts):
+        # Skip contacts whose state is unchanged since the last event
+        signature = signatures[index] if signatures is not None else None
+        if not contact_state_cache.has_changed(agent_arn, contact, signature):
+            continue
+        
+        records.append(build_agent_event_contact_record(data, contact, current_time))
+    
+    # Emit a final row for contacts that are no longer on the agent
+    for contact in contact_state_cache.remove_missing(agent_arn, contacts):
+        ended_contact = dict(contact, State='ENDED')
+        records.append(build_agent_event_contact_record(data, ended_contact, current_time))
+    
+    return records
 
-def write_records_to_timestream(table_name, records):
-    """Write a batch of records to the specified Timestream table"""
+def build_agent_event_contact_record(data, contact, current_time):
+    """Build the AgentEvent_Contact record for one contact of an agent event"""
     
-    try:
-        # Split records into chunks of 100 (Timestream limit)
-        chunk_size = 100
-        for i in range(0, len(records), chunk_size):
-            chunk = records[i:i + chunk_size]
-            
-            response = timestream_write.write_records(
-                DatabaseName=database_name,
-                TableName=table_name,
-                Records=chunk,
-                CommonAttributes={}
-            )
-            
-            print(f"Successfully wrote {len(chunk)} records to table {table_name}")
-            
-    except Exception as e:
-        print(f"Error writing to Timestream: {str(e)}")
-        raise e
\ No newline at end of file
+    # Prepare dimensions for the agent event contact record
+    contact_dimensions = [
+        {'Name': 'AgentARN', 'Value': data.get('Agent', {}).get('ARN', 'unknown')},
+        {'Name': 'InstanceId', 'Value': data.get('InstanceId', 'unknown')},
+        {'Name': 'ContactId', 'Value': contact.get('ContactId', 'unknown')},
+        {'Name': 'Channel', 'Value': contact.get('Channel', 'unknown')},
+        {'Name': 'EventType', 'Value': data.get('EventType', 'unknown')}
+    ]
+    
+    # Prepare measures for the agent event contact record
+    contact_measures = []
+    
+    # Add state durations if available
+    if 'StateStartTimestamp' in contact:
+        add_timestamp_measure(contact_measures, 'StateStartTimestamp', contact.get('StateStartTimestamp'))
+        add_duration_measure(contact_measures, 'StateDurationMs', contact.get('StateStartTimestamp'),
+                             data.get('EventTimestamp'))
+    
+    if 'State' in contact:
+        contact_measures.append({
+            'Name': 'ContactState',
+            'Value': contact.get('State', ''),
+            'Type': 'VARCHAR'
+        })
+    
+    if 'ConnectedToAgentTimestamp' in contact:
+        add_timestamp_measure(contact_measures, 'ConnectedToAgentTimestamp', contact.get('ConnectedToAgentTimestamp'))
+    
+    if 'Queue' in contact and 'Name' in contact['Queue']:
+        contact_measures.append({
+            'Name': 'QueueName',
+            'Value': contact.get('Queue', {}).get('Name', ''),
+            'Type': 'VARCHAR'
+        })
+    
+    # Create the record for the agent event contact
+    agent_event_contact_record = {
+        'Dimensions': contact_dimensions,
+        'MeasureName': 'AgentEventContact',
+        'MeasureValueType': 'MULTI',
+        'MeasureValues': contact_measures,
+        'Time': current_time
+    }
+    
+    return agent_event_contact_record
+
+def build_contact_record(data, current_time):
+    """Build the ContactRecord record for a CTR
+    
+    The record is timed at the contact's disconnect (the current time for a
+    CTR without one), so a CTR delivered twice writes the same record. A
+    CTR Connect updates later carries a newer LastUpdateTimestamp, which is
+    used as the record version so Timestream replaces the earlier row.
+    """
+    
+    queue = data.get('Queue') or {}
+    # Connect CTRs carry Agent; older exports and the generator use AgentInfo
+    agent = data.get('Agent') or data.get('AgentInfo') or {}
+    objects = {'Queue': queue, 'Agent': agent, 'CustomerVoiceActivity': data.get('CustomerVoiceActivity') or {}}
+    
+    # Prepare dimensions for the contact record
+    dimensions = [
+        {'Name': 'ContactId', 'Value': data.get('ContactId') or 'unknown'},
+        {'Name': 'InstanceId', 'Value': (data.get('InstanceId') or data.get('InstanceARN') or 'unknown').split('/')[-1]},
+        {'Name': 'Channel', 'Value': data.get('Channel') or 'unknown'},
+        {'Name': 'InitiationMethod', 'Value': data.get('InitiationMethod') or 'unknown'},
+        {'Name': 'QueueName', 'Value': queue.get('Name') or queue.get('QueueName') or 'unknown'}
+    ]
+    
+    # Prepare measures for the contact record
+    measures = []
+    
+    # Contact timestamps as TIMESTAMP measures only; this table never had the VARCHAR ones
+    for name in ('InitiationTimestamp', 'DisconnectTimestamp'):
+        if data.get(name):
+            add_timestamp_measure(measures, name, data.get(name), keep_varchar=False)
+    
+    if agent.get('ConnectedToAgentTimestamp'):
+        add_timestamp_measure(measures, 'ConnectedToAgentTimestamp', agent.get('ConnectedToAgentTimestamp'),
+                              keep_varchar=False)
+    
+    add_duration_measure(measures, 'ContactDurationMs', data.get('InitiationTimestamp'),
+                         data.get('DisconnectTimestamp'))
+    
+    # Add the CTR's own durations and counts
+    for source, field, name in CONTACT_RECORD_NUMBERS:
+        value = objects[source].get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            measures.append({'Name': name, 'Value': str(int(value)), 'Type': 'BIGINT'})
+    
+    if data.get('DisconnectReason'):
+        measures.append({
+            'Name': 'DisconnectReason',
+            'Value': data.get('DisconnectReason'),
+            'Type': 'VARCHAR'
+        })
+    
+    if agent.get('ARN') or agent.get('AgentId'):
+        measures.append({
+            'Name': 'AgentARN',
+            'Value': agent.get('ARN') or agent.get('AgentId'),
+            'Type': 'VARCHAR'
+        })
+    
+    # Add the configured contact attributes
+    attributes = data.get('Attributes') or {}
+    for name in CONTACT_RECORD_ATTRIBUTES:
+        value = attributes.get(name)
+        if value is None or value == '':
+            continue
+        measures.append({
+            'Name': f'Attribute_{name}',
+            'Value': str(value).encode('utf-8')[:MAX_VARCHAR_MEASURE_BYTES].decode('utf-8', 'ignore'),
+            'Type': 'VARCHAR'
+        })
+    
+    if not measures:
+        raise ValueError(f"CTR {data.get('ContactId')} has no measures to write")
+    
+    # Create the record for the contact
+    disconnect_ms = parse_timestamp_ms(data.get('DisconnectTimestamp'))
+    contact_record = {
+        'Dimensions': dimensions,
+        'MeasureName': 'ContactRecord',
+        'MeasureValueType': 'MULTI',
+        'MeasureValues': measures,
+        'Time': str(disconnect_ms) if disconnect_ms is not None else current_time
+    }
+    
+    version = parse_timestamp_ms(data.get('LastUpdateTimestamp'))
+    if version is not None:
+        contact_record['Version'] = version
+    
+    return contact_record
@@ -1,13 +1,14 @@
 import json
 import os
-import boto3
 import time
-from datetime import datetime
+import timestream_common
+from timestream_common import (add_duration_measure, add_timestamp_measure, dimension_catalog, spool_failed_batch,
+                               write_records_to_timestream)
 
-# Initialize Timestream client
-timestream_write = boto3.client('timestream-write', 
-                               region_name=os.environ.get('TIMESTREAM_REGION', 'eu-west-2'))
-database_name = os.environ.get('TIMESTREAM_DATABASE_NAME', 'connect-analytics')
+# EventBridge sources accepted as contact events, comma separated; custom
+# PutEvents sources cannot start with "aws.", so load tests use their own
+CONTACT_EVENT_SOURCES = [source.strip() for source in os.environ.get('CONTACT_EVENT_SOURCES', 'aws.connect').split(',')
+                         if source.strip()]
 
 def lambda_handler(event, context):
     """
@@ -20,7 +21,7 @@ def lambda_handler(event, context):
     print(f"Processing event: {json.dumps(event)}")
     
     # Ensure this is a Connect Contact Event
-    if event.get('source') != 'aws.connect' or event.get('detail-type') != 'Amazon Connect Contact Event':
+    if event.get('source') not in CONTACT_EVENT_SOURCES or event.get('detail-type') != 'Amazon Connect Contact Event':
         print(f"Ignoring non-Connect contact event")
         return {
             'statusCode': 200,
@@ -40,10 +41,16 @@ def lambda_handler(event, context):
         # Write records to Timestream (if any)
         if contact_event_records:
             write_records_to_timestream("ContactEvent", contact_event_records)
-        
+    
     except Exception as e:
         print(f"Error processing event: {str(e)}")
-        raise e
+        # A captured event is replayed later; only let Lambda retry when capture fails
+        if not spool_failed_batch('contact-event', [event], e):
+            raise e
+    
+    dimension_catalog.flush()
+    
+    print(f"Timestream writes: {json.dumps(timestream_common.timestream_writer.pop_stats())}")
     
     return {
         'statusCode': 200,
@@ -73,32 +80,23 @@ def process_contact_event(detail, contact_event_records):
     if 'InitiationMethod' in detail:
         dimensions.append({'Name': 'InitiationMethod', 'Value': detail.get('InitiationMethod', 'unknown')})
     
+    dimension_catalog.observe('Channel', channel)
+    dimension_catalog.observe('InitiationMethod', detail.get('InitiationMethod'))
+    
     # Prepare measures for the contact event record
     measures = []
     
     # Add ContactEventTimestamp
     if 'EventTimestamp' in detail:
-        measures.append({
-            'Name': 'ContactEventTimestamp',
-            'Value': detail.get('EventTimestamp', ''),
-            'Type': 'VARCHAR'
-        })
+        add_timestamp_measure(measures, 'ContactEventTimestamp', detail.get('EventTimestamp'))
     
     # Add InitiationTimestamp if available
     if 'InitiationTimestamp' in detail:
-        measures.append({
-            'Name': 'InitiationTimestamp',
-            'Value': detail.get('InitiationTimestamp', ''),
-            'Type': 'VARCHAR'
-        })
+        add_timestamp_measure(measures, 'InitiationTimestamp', detail.get('InitiationTimestamp'))
     
     # Add DisconnectTimestamp if available
     if 'DisconnectTimestamp' in detail:
-        measures.append({
-            'Name': 'DisconnectTimestamp',
-            'Value': detail.get('DisconnectTimestamp', ''),
-            'Type': 'VARCHAR'
-        })
+        add_timestamp_measure(measures, 'DisconnectTimestamp', detail.get('DisconnectTimestamp'))
     
     # Add Queue information if available
     if 'Queue' in detail:
@@ -106,6 +104,7 @@ def process_contact_event(detail, contact_event_records):
         
         # Add queue name
         if 'Name' in queue:
+            dimension_catalog.observe('QueueName', queue.get('Name'))
             measures.append({
                 'Name': 'QueueName',
                 'Value': queue.get('Name', ''),
@@ -122,18 +121,10 @@ def process_contact_event(detail, contact_event_records):
         
         # Add queue info timestamps
         if 'EnqueueTimestamp' in queue:
-            measures.append({
-                'Name': 'EnqueueTimestamp',
-                'Value': queue.get('EnqueueTimestamp', ''),
-                'Type': 'VARCHAR'
-            })
+            add_timestamp_measure(measures, 'EnqueueTimestamp', queue.get('EnqueueTimestamp'))
         
         if 'DequeueTimestamp' in queue:
-            measures.append({
-                'Name': 'DequeueTimestamp',
-                'Value': queue.get('DequeueTimestamp', ''),
-                'Type': 'VARCHAR'
-            })
+            add_timestamp_measure(measures, 'DequeueTimestamp', queue.get('DequeueTimestamp'))
     
     # Add Agent information if available
     if 'Agent' in detail:
@@ -149,11 +140,15 @@ def process_contact_event(detail, contact_event_records):
         
         # Add agent info timestamps
         if 'ConnectedToAgentTimestamp' in agent:
-            measures.append({
-                'Name': 'ConnectedToAgentTimestamp',
-                'Value': agent.get('ConnectedToAgentTimestamp', ''),
-                'Type': 'VARCHAR'
-            })
+            add_timestamp_measure(measures, 'ConnectedToAgentTimestamp', agent.get('ConnectedToAgentTimestamp'))
+    
+    # Precompute the durations dashboards would otherwise derive row by row
+    queue = detail.get('Queue') or {}
+    agent = detail.get('Agent') or {}
+    add_duration_measure(measures, 'QueueWaitMs', queue.get('EnqueueTimestamp'),
+                         queue.get('DequeueTimestamp') or agent.get('ConnectedToAgentTimestamp'))
+    add_duration_measure(measures, 'HandleMs', agent.get('ConnectedToAgentTimestamp'), detail.get('DisconnectTimestamp'))
+    add_duration_measure(measures, 'ContactDurationMs', detail.get('InitiationTimestamp'), detail.get('DisconnectTimestamp'))
     
     # Add CustomerEndpoint information if available
     if 'CustomerEndpoint' in detail:
@@ -206,25 +201,3 @@ def process_contact_event(detail, contact_event_records):
     
     # Add the record to the batch
     contact_event_records.append(contact_event_record)
-
-def write_records_to_timestream(table_name, records):
-    """Write a batch of records to the specified Timestream table"""
-    
-    try:
-        # Split records into chunks of 100 (Timestream limit)
-        chunk_size = 100
-        for i in range(0, len(records), chunk_size):
-            chunk = records[i:i + chunk_size]
-            
-            response = timestream_write.write_records(
-                DatabaseName=database_name,
-                TableName=table_name,
-                Records=chunk,
-                CommonAttributes={}
-            )
-            
-            print(f"Successfully wrote {len(chunk)} records to table {table_name}")
-            
-    except Exception as e:
-        print(f"Error writing to Timestream: {str(e)}")
-        raise e
\ No newline at end of file
@@ -2,14 +2,24 @@ import json
 import os
 import boto3
 import time
-from datetime import datetime
+import timestream_common
+from timestream_common import dimension_catalog, write_records_to_timestream
 
-# Initialize AWS clients
-timestream_write = boto3.client('timestream-write', 
-                               region_name=os.environ.get('TIMESTREAM_REGION', 'eu-west-2'))
+# Initialize AWS clients; Timestream is written through timestream_common
 connect = boto3.client('connect')
 
-database_name = os.environ.get('TIMESTREAM_DATABASE_NAME', 'connect-analytics')
+# Where hierarchy group names are published for persist_agent_event
+# (s3://bucket/key or a local file path; empty disables publishing) and how
+# long a described group is reused before it is described again
+HIERARCHY_CACHE_LOCATION = os.environ.get('HIERARCHY_CACHE_LOCATION', '')
+HIERARCHY_CACHE_TTL = int(os.environ.get('HIERARCHY_CACHE_TTL_SECONDS', '3600'))
+s3 = boto3.client('s3', region_name=os.environ.get('AWS_REGION', 'eu-west-2'))
+
+# Connect names hierarchy levels LevelOne..LevelFive
+HIERARCHY_LEVELS = {'LevelOne': 1, 'LevelTwo': 2, 'LevelThree': 3, 'LevelFour': 4, 'LevelFive': 5}
+
+# Described hierarchy groups, memoized across warm invocations: group id -> (described at, entry)
+hierarchy_group_cache = {}
 
 def lambda_handler(event, context):
     """
@@ -24,6 +34,9 @@ def lambda_handler(event, context):
     # Get current timestamp for the records
     current_time = str(int(time.time() * 1000))
     
+    # Hierarchy groups of every instance, published once all are collected
+    hierarchy_groups = {}
+    
     try:
         # List Connect instances
         instances = list_connect_instances()
@@ -32,6 +45,13 @@ def lambda_handler(event, context):
         for instance in instances:
             instance_id = instance['Id']
             
+            # Collect hierarchy group names; a failure here must not stop the data collection
+            if HIERARCHY_CACHE_LOCATION:
+                try:
+                    hierarchy_groups.update(collect_hierarchy_groups(instance_id))
+                except Exception as e:
+                    print(f"Error collecting hierarchy groups for {instance_id}: {str(e)}")
+            
             # Records for each table
             instance_records = []
             queue_records = []
@@ -60,9 +80,20 @@ def lambda_handler(event, context):
             if user_records:
                 write_records_to_timestream("User", user_records)
         
+        if hierarchy_groups:
+            try:
+                publish_hierarchy_groups(hierarchy_groups)
+            except Exception as e:
+                print(f"Error publishing hierarchy groups: {str(e)}")
+        
+        # Runs are minutes apart, so write new values on every run
+        dimension_catalog.flush(force=True)
+    
     except Exception as e:
         print(f"Error collecting instance data: {str(e)}")
         raise e
+    finally:
+        print(f"Timestream writes: {json.dumps(timestream_common.timestream_writer.pop_stats())}")
     
     return {
         'statusCode': 200,
@@ -145,6 +176,96 @@ def list_users(instance_id):
     
     return users
 
+def list_hierarchy_groups(instance_id):
+    """List all user hierarchy groups for a Connect instance"""
+    
+    groups = []
+    next_token = None
+    
+    while True:
+        if next_token:
+            response = connect.list_user_hierarchy_groups(
+                InstanceId=instance_id,
+                NextToken=next_token,
+                MaxResults=1000
+            )
+        else:
+            response = connect.list_user_hierarchy_groups(
+                InstanceId=instance_id,
+                MaxResults=1000
+            )
+        
+        groups.extend(response.get('UserHierarchyGroupSummaryList', []))
+        
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+    
+    return groups
+
+def describe_hierarchy_group(instance_id, group_id, now):
+    """Return a group's name, level and path names, describing it at most once per TTL"""
+    
+    cached = hierarchy_group_cache.get(group_id)
+    if cached is not None and now - cached[0] <= HIERARCHY_CACHE_TTL:
+        return cached[1]
+    
+    group = connect.describe_user_hierarchy_group(
+        InstanceId=instance_id,
+        HierarchyGroupId=group_id
+    ).get('HierarchyGroup', {})
+    
+    path = {}
+    for level, parent in group.get('HierarchyPath', {}).items():
+        if level in HIERARCHY_LEVELS and parent.get('Name'):
+            path[str(HIERARCHY_LEVELS[level])] = parent['Name']
+    
+    entry = {
+        'Name': group.get('Name', ''),
+        'Level': group.get('LevelId', ''),
+        'Path': path
+    }
+    hierarchy_group_cache[group_id] = (now, entry)
+    return entry
+
+def collect_hierarchy_groups(instance_id):
+    """Return {group id: name, level and path} for every hierarchy group of an instance
+    
+    All groups are listed in one paginated call; only groups that are new or
+    whose cached description has expired are described again.
+    """
+    
+    now = time.time()
+    groups = {}
+    for summary in list_hierarchy_groups(instance_id):
+        group_id = summary.get('Id')
+        if not group_id:
+            continue
+        try:
+            groups[group_id] = describe_hierarchy_group(instance_id, group_id, now)
+        except Exception as e:
+            print(f"Error describing hierarchy group {group_id}: {str(e)}")
+            groups[group_id] = {'Name': summary.get('Name', ''), 'Path': {}}
+    
+    return groups
+
+def publish_hierarchy_groups(groups):
+    """Write the hierarchy group map where persist_agent_event reads it"""
+    
+    body = json.dumps({
+        'updated_at': int(time.time() * 1000),
+        'groups': groups
+    }).encode('utf-8')
+    
+    if HIERARCHY_CACHE_LOCATION.startswith('s3://'):
+        bucket, _, key = HIERARCHY_CACHE_LOCATION[len('s3://'):].partition('/')
+        s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/json')
+    else:
+        with open(HIERARCHY_CACHE_LOCATION, 'wb') as f:
+            f.write(body)
+    
+    print(f"Published {len(groups)} hierarchy groups to {HIERARCHY_CACHE_LOCATION}")
+
 def process_instance(instance, instance_records, current_time):
     """Process a Connect instance and prepare a record for Timestream"""
     
@@ -168,6 +289,7 @@ def process_instance(instance, instance_records, current_time):
         'Type': 'VARCHAR'
     })
     
+    dimension_catalog.observe('InstanceAlias', instance.get('InstanceAlias'))
     measures.append({
         'Name': 'InstanceAlias',
         'Value': instance.get('InstanceAlias', ''),
@@ -243,6 +365,7 @@ def process_queue(instance_id, queue, queue_records, current_time):
         'Type': 'VARCHAR'
     })
     
+    dimension_catalog.observe('QueueName', queue_data.get('Name'))
     measures.append({
         'Name': 'QueueName',
         'Value': queue_data.get('Name', ''),
@@ -394,25 +517,3 @@ def process_user(instance_id, user, user_records, current_time):
     
     # Add the record to the batch
     user_records.append(user_record)
-
-def write_records_to_timestream(table_name, records):
-    """Write a batch of records to the specified Timestream table"""
-    
-    try:
-        # Split records into chunks of 100 (Timestream limit)
-        chunk_size = 100
-        for i in range(0, len(records), chunk_size):
-            chunk = records[i:i + chunk_size]
-            
-            response = timestream_write.write_records(
-                DatabaseName=database_name,
-                TableName=table_name,
-                Records=chunk,
-                CommonAttributes={}
-            )
-            
-            print(f"Successfully wrote {len(chunk)} records to table {table_name}")
-            
-    except Exception as e:
-        print(f"Error writing to Timestream: {str(e)}")
-        raise e
\ No newline at end of file
@@ -0,0 +1,462 @@
+"""
+Timestream writing shared by the persist_* Lambdas
+
+Each function's zip is packaged with this file (see main.tf). It holds
+the pooled multi-region writer, the dimension catalog, the capture of
+failed batches and the timestamp measure builders, all configured from
+the same environment variables in every function.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# Timestream is written through timestream_writer, which pools a client per region
+database_name = os.environ.get('TIMESTREAM_DATABASE_NAME', 'connect-analytics')
+
+# Secondary Timestream region (empty for none) and how it is used:
+# 'primary' ignores it, 'failover' writes there for TIMESTREAM_FAILOVER_SECONDS
+# after a primary write fails, and 'dual' writes every chunk to both regions
+TIMESTREAM_SECONDARY_REGION = os.environ.get('TIMESTREAM_SECONDARY_REGION', '')
+TIMESTREAM_WRITE_MODE = os.environ.get('TIMESTREAM_WRITE_MODE', 'primary')
+TIMESTREAM_FAILOVER_SECONDS = int(os.environ.get('TIMESTREAM_FAILOVER_SECONDS', '60'))
+
+# Connections kept open to each region, matched to the concurrent writes
+TIMESTREAM_MAX_CONNECTIONS = int(os.environ.get('TIMESTREAM_MAX_CONNECTIONS', '10'))
+
+# Optional JSON map of region -> endpoint URL that replaces endpoint
+# discovery, e.g. to point the writer at local stub endpoints
+TIMESTREAM_ENDPOINT_URLS = json.loads(os.environ.get('TIMESTREAM_ENDPOINT_URLS') or '{}')
+
+# Failed batches are captured to s3://bucket/prefix/ or, when running locally,
+# a directory path; an empty value disables capture. The S3 client is
+# created on the first capture, so functions that never spool skip it
+FAILURE_SPOOL = os.environ.get('FAILURE_SPOOL', '')
+s3 = None
+
+# Timestream accepts at most 100 records per WriteRecords call
+WRITE_CHUNK_SIZE = 100
+
+# Dimension catalog for the dashboard template variables: table name (empty
+# disables it), seconds between flushes of newly seen values, and seconds
+# after which a value already written is written again
+DIMENSION_CATALOG_TABLE = os.environ.get('DIMENSION_CATALOG_TABLE', '')
+DIMENSION_CATALOG_FLUSH_SECONDS = int(os.environ.get('DIMENSION_CATALOG_FLUSH_SECONDS', '60'))
+DIMENSION_CATALOG_REFRESH_SECONDS = int(os.environ.get('DIMENSION_CATALOG_REFRESH_SECONDS', '86400'))
+
+# Timestamp fields are written as TIMESTAMP measures (InitiationTimestamp
+# becomes InitiationTime, in epoch milliseconds); while dashboards migrate,
+# the original VARCHAR measures are written as well
+KEEP_VARCHAR_TIMESTAMPS = os.environ.get('KEEP_VARCHAR_TIMESTAMPS', 'true').lower() == 'true'
+
+# Distinct timestamp strings whose parsed value is cached; the events of a
+# batch repeat the same contact and state timestamps many times
+TIMESTAMP_CACHE_SIZE = int(os.environ.get('TIMESTAMP_CACHE_SIZE', '4096'))
+
+def spool_failed_batch(source, payloads, error, records=None):
+    """Store the original payloads of a failed batch with the error
+    
+    When the batch's records were all built, the ones not written (by
+    table, with their original times) are stored too, so a replay writes
+    only those and never duplicates the chunks that succeeded.
+    
+    Returns True once the capture is stored, so the caller can drop the
+    batch; scripts/replay_failed_batches.py re-drives captured batches.
+    """
+    
+    global s3
+    
+    if not FAILURE_SPOOL:
+        return False
+    
+    captured_at = int(time.time() * 1000)
+    capture = {
+        'source': source,
+        'function': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local'),
+        'captured_at': captured_at,
+        'error_type': type(error).__name__,
+        'error': str(error),
+        'payloads': payloads
+    }
+    if records is not None:
+        capture['records'] = records
+    key = f"{datetime.utcfromtimestamp(captured_at / 1000):%Y/%m/%d/%H}/{source}-{captured_at}-{uuid.uuid4()}.json"
+    body = json.dumps(capture).encode('utf-8')
+    
+    try:
+        if FAILURE_SPOOL.startswith('s3://'):
+            bucket, _, prefix = FAILURE_SPOOL[len('s3://'):].partition('/')
+            if s3 is None:
+                s3 = boto3.client('s3', region_name=os.environ.get('AWS_REGION', 'eu-west-2'))
+            s3.put_object(Bucket=bucket, Key=f"{prefix}{key}", Body=body)
+        else:
+            path = os.path.join(FAILURE_SPOOL, *key.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(body)
+    except Exception as e:
+        print(f"Error capturing failed batch: {str(e)}")
+        return False
+    
+    unwritten = f", {sum(len(table_records) for table_records in records.values())} unwritten records" if records else ''
+    print(f"Captured failed batch of {len(payloads)} payloads{unwritten} to {FAILURE_SPOOL}{key}: {str(error)}")
+    return True
+
+class WriteLedger:
+    """Records of the current batch that have not been written yet
+    
+    Between begin() and end(), records are added once built and removed
+    when the chunk holding them is written, so a failed batch knows which
+    records are still outstanding: the failed chunks and any never
+    attempted. seal() marks that every record of the batch was built; a
+    batch that failed before then has no complete set of records.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = None
+        self.sealed = False
+
+    def begin(self):
+        with self.lock:
+            self.records = {}
+            self.sealed = False
+
+    def add(self, table_name, records):
+        with self.lock:
+            if self.records is not None:
+                for record in records:
+                    self.records[id(record)] = (table_name, record)
+
+    def written(self, records):
+        with self.lock:
+            if self.records is not None:
+                for record in records:
+                    self.records.pop(id(record), None)
+
+    def seal(self):
+        self.sealed = True
+
+    def end(self):
+        """Stop tracking and return the outstanding records by table, or None if the batch was not sealed"""
+        
+        with self.lock:
+            records, self.records = self.records, None
+        if records is None or not self.sealed:
+            return None
+        
+        tables = {}
+        for table_name, record in records.values():
+            tables.setdefault(table_name, []).append(record)
+        return tables
+
+# Tracks one batch at a time, as each container handles one invocation at a time
+write_ledger = WriteLedger()
+
+class DimensionCatalog:
+    """Distinct dimension values written to the DimensionCatalog table
+    
+    Values are collected in an in-memory seen-set, so only a value this
+    container has not written yet (or has not written for the refresh
+    interval, which keeps it inside the dashboards' lookback) is queued.
+    Queued values are written at most once per flush interval; a value
+    lost with a recycled container is queued again when next seen.
+    """
+
+    def __init__(self, table_name, flush_seconds, refresh_seconds):
+        self.table_name = table_name
+        self.flush_seconds = flush_seconds
+        self.refresh_seconds = refresh_seconds
+        self.seen = {}
+        self.pending = set()
+        self.flushed_at = 0
+        self.refresh_before = 0
+
+    def observe(self, dimension, value):
+        """Queue a dimension value unless it was written recently"""
+        
+        if not self.table_name or not value or value == 'unknown':
+            return
+        
+        key = (dimension, value)
+        if key not in self.seen or self.seen[key] < self.refresh_before:
+            self.pending.add(key)
+
+    def flush(self, force=False):
+        """Write the queued values once the flush interval has passed"""
+        
+        now = time.time()
+        self.refresh_before = now - self.refresh_seconds
+        if not self.pending or (not force and now - self.flushed_at < self.flush_seconds):
+            return 0
+        
+        current_time = str(int(now * 1000))
+        pending = sorted(self.pending)
+        records = [{
+            'Dimensions': [
+                {'Name': 'Dimension', 'Value': dimension},
+                {'Name': 'Value', 'Value': value}
+            ],
+            'MeasureName': 'Seen',
+            'MeasureValueType': 'BIGINT',
+            'MeasureValue': '1',
+            'Time': current_time
+        } for dimension, value in pending]
+        
+        # A failed flush keeps the values queued for the next one
+        self.flushed_at = now
+        try:
+            write_records_to_timestream(self.table_name, records)
+        except Exception as e:
+            print(f"Error flushing dimension catalog: {str(e)}")
+            return 0
+        
+        for key in pending:
+            self.seen[key] = now
+            self.pending.discard(key)
+        return len(records)
+
+# The seen-set carries over between warm invocations
+dimension_catalog = DimensionCatalog(DIMENSION_CATALOG_TABLE, DIMENSION_CATALOG_FLUSH_SECONDS,
+                                     DIMENSION_CATALOG_REFRESH_SECONDS)
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_timestamp_ms(value):
+    """Return an ISO 8601 timestamp as epoch milliseconds, or None"""
+    
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def add_timestamp_measure(measures, name, value, keep_varchar=KEEP_VARCHAR_TIMESTAMPS):
+    """Add a *Timestamp field as a TIMESTAMP *Time measure
+    
+    The original VARCHAR measure is added too while KEEP_VARCHAR_TIMESTAMPS
+    is set (keep_varchar=False for tables that never had it). A value that
+    does not parse is only kept as VARCHAR.
+    """
+    
+    if keep_varchar:
+        measures.append({'Name': name, 'Value': value or '', 'Type': 'VARCHAR'})
+    
+    epoch_ms = parse_timestamp_ms(value)
+    if epoch_ms is not None:
+        measures.append({
+            'Name': name[:-len('Timestamp')] + 'Time',
+            'Value': str(epoch_ms),
+            'Type': 'TIMESTAMP'
+        })
+
+def add_duration_measure(measures, name, start, end):
+    """Add the milliseconds between two timestamp strings as a BIGINT measure"""
+    
+    start_ms = parse_timestamp_ms(start)
+    end_ms = parse_timestamp_ms(end)
+    if start_ms is not None and end_ms is not None and end_ms >= start_ms:
+        measures.append({'Name': name, 'Value': str(end_ms - start_ms), 'Type': 'BIGINT'})
+
+class TimestreamWriter:
+    """Writes record chunks to the primary and optional secondary region
+    
+    Timestream lives in a different region from Connect and Kinesis, so
+    one client per region is created on first use and kept for the life
+    of the container: its keep-alive connection pool and the endpoints
+    botocore discovers (cached for the period Timestream returns) are
+    reused by every invocation instead of being set up again cross-region.
+    Write latency and errors are tracked per region.
+    """
+    
+    MODES = ('primary', 'failover', 'dual')
+
+    def __init__(self, primary_region, secondary_region='', mode='primary', failover_seconds=60,
+                 endpoint_urls=None, max_connections=10, database=None, retries=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown Timestream write mode {mode}, expected one of {', '.join(self.MODES)}")
+        
+        self.primary_region = primary_region
+        self.secondary_region = secondary_region
+        self.mode = mode if secondary_region else 'primary'
+        self.failover_seconds = failover_seconds
+        self.endpoint_urls = endpoint_urls or {}
+        self.max_connections = max_connections
+        self.database = database or database_name
+        self.retries = retries or {'max_attempts': 3, 'mode': 'standard'}
+        self.clients = {}
+        self.failover_until = 0
+        self.secondary_paused_until = 0
+        self.secondary_lane = None
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def client(self, region):
+        """Return the pooled client for a region, creating it on first use"""
+        
+        with self.lock:
+            client = self.clients.get(region)
+            if client is None:
+                # Short connect timeout so an unreachable region fails over quickly
+                config = Config(max_pool_connections=self.max_connections, tcp_keepalive=True,
+                                connect_timeout=5, read_timeout=30, retries=self.retries)
+                client = boto3.client('timestream-write', region_name=region,
+                                      endpoint_url=self.endpoint_urls.get(region), config=config)
+                self.clients[region] = client
+        return client
+
+    def write_region(self, region, table_name, records):
+        start = time.perf_counter()
+        try:
+            self.client(region).write_records(
+                DatabaseName=self.database,
+                TableName=table_name,
+                Records=records,
+                CommonAttributes={}
+            )
+        except Exception:
+            self.record_latency(region, start, len(records), failed=True)
+            raise
+        self.record_latency(region, start, len(records))
+
+    def record_latency(self, region, start, record_count, failed=False):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            stats = self.stats.setdefault(region, {'writes': 0, 'records': 0, 'errors': 0,
+                                                   'total_ms': 0.0, 'max_ms': 0.0})
+            stats['writes'] += 1
+            stats['errors'] += 1 if failed else 0
+            stats['records'] += 0 if failed else record_count
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    def write(self, table_name, records):
+        """Write one chunk according to the write mode"""
+        
+        if self.mode == 'dual':
+            if time.time() < self.secondary_paused_until:
+                self.write_region(self.primary_region, table_name, records)
+                return
+            
+            # The secondary copy is best effort and must not fail the batch; a
+            # failing secondary is skipped for a while so it does not slow every write
+            with self.lock:
+                if self.secondary_lane is None:
+                    self.secondary_lane = ThreadPoolExecutor(max_workers=self.max_connections)
+            future = self.secondary_lane.submit(self.write_region, self.secondary_region, table_name, records)
+            try:
+                self.write_region(self.primary_region, table_name, records)
+            finally:
+                error = future.exception()
+                if error is not None:
+                    print(f"Error writing to secondary region {self.secondary_region}, "
+                          f"skipping it for {self.failover_seconds}s: {str(error)}")
+                    self.secondary_paused_until = time.time() + self.failover_seconds
+            return
+        
+        if self.mode == 'failover':
+            if time.time() < self.failover_until:
+                self.write_region(self.secondary_region, table_name, records)
+                return
+            try:
+                self.write_region(self.primary_region, table_name, records)
+            except Exception as e:
+                # Rejected records would be rejected by the secondary too
+                if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'RejectedRecordsException':
+                    raise
+                print(f"Failing over from {self.primary_region} to {self.secondary_region} "
+                      f"for {self.failover_seconds}s: {str(e)}")
+                self.failover_until = time.time() + self.failover_seconds
+                self.write_region(self.secondary_region, table_name, records)
+            return
+        
+        self.write_region(self.primary_region, table_name, records)
+
+    def pop_stats(self):
+        """Return per-region write counts and latency since the last call and reset them"""
+        
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        return {
+            region: {
+                'writes': region_stats['writes'],
+                'records': region_stats['records'],
+                'errors': region_stats['errors'],
+                'avg_ms': round(region_stats['total_ms'] / region_stats['writes'], 1),
+                'max_ms': round(region_stats['max_ms'], 1)
+            }
+            for region, region_stats in stats.items()
+        }
+
+# Clients and their connection pools carry over between warm invocations
+timestream_writer = TimestreamWriter(os.environ.get('TIMESTREAM_REGION', 'eu-west-2'), TIMESTREAM_SECONDARY_REGION,
+                                     TIMESTREAM_WRITE_MODE, TIMESTREAM_FAILOVER_SECONDS,
+                                     TIMESTREAM_ENDPOINT_URLS, TIMESTREAM_MAX_CONNECTIONS)
+
+class RateLimiter:
+    """Spreads writes over time at records_per_second (0 for no limit)
+    
+    Bulk writers such as the backfill and replay scripts use it so live
+    ingestion keeps its share of the table's write throughput.
+    """
+
+    def __init__(self, records_per_second):
+        self.records_per_second = records_per_second
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count):
+        if self.records_per_second <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + count / self.records_per_second
+        time.sleep(max(0.0, start - now))
+
+def write_chunk(writer, table_name, chunk, limiter):
+    """Write one chunk through a TimestreamWriter at the limiter's rate
+    
+    Returns the number of records Timestream rejected; rejected records
+    fail the same way on every retry, so they are counted, not raised.
+    """
+    
+    limiter.acquire(len(chunk))
+    try:
+        writer.write(table_name, chunk)
+        return 0
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'RejectedRecordsException':
+            raise
+        rejected = e.response.get('RejectedRecords', [])
+        for item in rejected[:3]:
+            print(f"Rejected record in {table_name}: {item.get('Reason')}")
+        return len(rejected) or len(chunk)
+
+def write_records_to_timestream(table_name, records):
+    """Write a batch of records to the specified Timestream table"""
+    
+    try:
+        # Split records into chunks of 100 (Timestream limit)
+        chunk_size = WRITE_CHUNK_SIZE
+        for i in range(0, len(records), chunk_size):
+            chunk = records[i:i + chunk_size]
+            
+            timestream_writer.write(table_name, chunk)
+            write_ledger.written(chunk)
+            
+            print(f"Successfully wrote {len(chunk)} records to table {table_name}")
+    
+    except Exception as e:
+        print(f"Error writing to Timestream: {str(e)}")
+        raise e
\ No newline at end of file
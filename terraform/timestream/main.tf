@@ -10,28 +10,68 @@ provider "aws" {
   region = var.timestream_region  # Must be a region where Timestream is available
 }
 
+# Provider for the optional secondary Timestream region; it falls back to the
+# primary region when none is set, and nothing is created with it then
+provider "aws" {
+  alias  = "timestream_secondary"
+  region = var.timestream_secondary_region != "" ? var.timestream_secondary_region : var.timestream_region
+}
+
 # Get current AWS account ID and region
 data "aws_caller_identity" "current" {
   provider = aws.timestream
 }
 
-# Archive files for Lambda functions
+# Archive files for Lambda functions; each one packages the shared
+# timestream_common.py module next to its handler
 data "archive_file" "persist_agent_event_zip" {
   type        = "zip"
-  source_file = "${path.module}/lambda_code/persist_agent_event.py"
   output_path = "${path.module}/lambda_code/persist_agent_event.zip"
+  
+  source {
+    content  = file("${path.module}/lambda_code/persist_agent_event.py")
+    filename = "persist_agent_event.py"
+  }
+  
+  source {
+    content  = file("${path.module}/lambda_code/kinesis_payload.py")
+    filename = "kinesis_payload.py"
+  }
+  
+  source {
+    content  = file("${path.module}/lambda_code/timestream_common.py")
+    filename = "timestream_common.py"
+  }
 }
 
 data "archive_file" "persist_contact_event_zip" {
   type        = "zip"
-  source_file = "${path.module}/lambda_code/persist_contact_event.py"
   output_path = "${path.module}/lambda_code/persist_contact_event.zip"
+  
+  source {
+    content  = file("${path.module}/lambda_code/persist_contact_event.py")
+    filename = "persist_contact_event.py"
+  }
+  
+  source {
+    content  = file("${path.module}/lambda_code/timestream_common.py")
+    filename = "timestream_common.py"
+  }
 }
 
 data "archive_file" "persist_instance_data_zip" {
   type        = "zip"
-  source_file = "${path.module}/lambda_code/persist_instance_data.py"
   output_path = "${path.module}/lambda_code/persist_instance_data.zip"
+  
+  source {
+    content  = file("${path.module}/lambda_code/persist_instance_data.py")
+    filename = "persist_instance_data.py"
+  }
+  
+  source {
+    content  = file("${path.module}/lambda_code/timestream_common.py")
+    filename = "timestream_common.py"
+  }
 }
 
 # ===================================================================
@@ -117,6 +157,11 @@ resource "aws_timestreamwrite_table" "agent_event" {
     magnetic_store_retention_period_in_days = var.timestream_retention_magnetic
   }
   
+  # Allows backfills of records older than the memory store retention
+  magnetic_store_write_properties {
+    enable_magnetic_store_writes = var.enable_magnetic_store_writes
+  }
+  
   tags = {
     Project = "ConnectAnalytics"
     Module  = "Timestream"
@@ -134,6 +179,11 @@ resource "aws_timestreamwrite_table" "agent_event_contact" {
     magnetic_store_retention_period_in_days = var.timestream_retention_magnetic
   }
   
+  # Allows backfills of records older than the memory store retention
+  magnetic_store_write_properties {
+    enable_magnetic_store_writes = var.enable_magnetic_store_writes
+  }
+  
   tags = var.tags
 }
 
@@ -147,6 +197,11 @@ resource "aws_timestreamwrite_table" "contact_event" {
     magnetic_store_retention_period_in_days = var.timestream_retention_magnetic
   }
   
+  # Allows backfills of records older than the memory store retention
+  magnetic_store_write_properties {
+    enable_magnetic_store_writes = var.enable_magnetic_store_writes
+  }
+  
   tags = var.tags
 }
 
@@ -189,6 +244,115 @@ resource "aws_timestreamwrite_table" "user" {
   tags = var.tags
 }
 
+# Distinct dimension values written by the Lambdas for the dashboard template variables
+resource "aws_timestreamwrite_table" "dimension_catalog" {
+  provider      = aws.timestream
+  database_name = aws_timestreamwrite_database.connect_db.database_name
+  table_name    = "DimensionCatalog"
+  
+  retention_properties {
+    memory_store_retention_period_in_hours = var.timestream_retention_memory
+    magnetic_store_retention_period_in_days = var.timestream_retention_magnetic
+  }
+  
+  tags = var.tags
+}
+
+# Per-queue minute aggregates built from ContactEvent by a scheduled query
+resource "aws_timestreamwrite_table" "queue_rollup_1m" {
+  provider      = aws.timestream
+  database_name = aws_timestreamwrite_database.connect_db.database_name
+  table_name    = "QueueRollup1m"
+  
+  retention_properties {
+    memory_store_retention_period_in_hours = var.timestream_retention_memory
+    magnetic_store_retention_period_in_days = var.timestream_retention_magnetic
+  }
+  
+  tags = var.tags
+}
+
+# Per-agent 15-minute state time built from AgentEvent by a scheduled query
+resource "aws_timestreamwrite_table" "agent_state_rollup_15m" {
+  provider      = aws.timestream
+  database_name = aws_timestreamwrite_database.connect_db.database_name
+  table_name    = "AgentStateRollup15m"
+  
+  retention_properties {
+    memory_store_retention_period_in_hours = var.timestream_retention_memory
+    magnetic_store_retention_period_in_days = var.timestream_retention_magnetic
+  }
+  
+  tags = var.tags
+}
+
+# One row per contact from the CTRs on the stream, for recent-window
+# post-contact metrics without an Athena scan
+resource "aws_timestreamwrite_table" "contact_record" {
+  provider      = aws.timestream
+  database_name = aws_timestreamwrite_database.connect_db.database_name
+  table_name    = "ContactRecord"
+  
+  retention_properties {
+    memory_store_retention_period_in_hours = var.timestream_retention_memory
+    magnetic_store_retention_period_in_days = var.timestream_retention_magnetic
+  }
+  
+  # Rows are timed at the disconnect, so late CTRs and backfills can be older
+  # than the memory store retention
+  magnetic_store_write_properties {
+    enable_magnetic_store_writes = var.enable_magnetic_store_writes
+  }
+  
+  tags = var.tags
+}
+
+# ===================================================================
+# SECONDARY REGION
+# ===================================================================
+# With a secondary region and a failover or dual write mode, the Lambdas
+# write to a copy of the database there. It is encrypted with the
+# Timestream service key.
+
+locals {
+  enable_secondary_region = var.timestream_secondary_region != "" && var.timestream_write_mode != "primary"
+  secondary_region        = local.enable_secondary_region ? var.timestream_secondary_region : ""
+  timestream_table_names = [
+    "AgentEvent",
+    "AgentEvent_Contact",
+    "ContactEvent",
+    "Instance",
+    "Queue",
+    "User",
+    "DimensionCatalog",
+    "QueueRollup1m",
+    "AgentStateRollup15m",
+    "ContactRecord"
+  ]
+}
+
+resource "aws_timestreamwrite_database" "secondary" {
+  count         = local.enable_secondary_region ? 1 : 0
+  provider      = aws.timestream_secondary
+  database_name = var.stack_name
+  
+  tags = var.tags
+}
+
+resource "aws_timestreamwrite_table" "secondary" {
+  for_each      = local.enable_secondary_region ? toset(local.timestream_table_names) : toset([])
+  provider      = aws.timestream_secondary
+  database_name = aws_timestreamwrite_database.secondary[0].database_name
+  table_name    = each.value
+  
+  retention_properties {
+    memory_store_retention_period_in_hours = var.timestream_retention_memory
+    magnetic_store_retention_period_in_days = var.timestream_retention_magnetic
+  }
+  
+  tags = var.tags
+}
+
 # ===================================================================
 # IAM POLICIES AND ROLES
 # ===================================================================
@@ -227,7 +391,10 @@ resource "aws_iam_policy" "timestream_table_access" {
         Sid      = "TimestreamTableWrite",
         Effect   = "Allow",
         Action   = "timestream:WriteRecords",
-        Resource = "${aws_timestreamwrite_database.connect_db.arn}/table/*"
+        Resource = concat(
+          ["${aws_timestreamwrite_database.connect_db.arn}/table/*"],
+          [for database in aws_timestreamwrite_database.secondary : "${database.arn}/table/*"]
+        )
       },
       {
         Sid      = "TimestreamKMSAccess",
@@ -318,6 +485,13 @@ resource "aws_iam_policy" "agent_event_lambda_basic" {
         Resource = [
           "arn:aws:logs:${var.aws_region}:${data.aws_caller_identity.current.account_id}:log-group:/aws/lambda/${var.stack_name}-Persist-AgentEvent:*"
         ]
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "s3:GetObject"
+        ],
+        Resource = "${aws_s3_bucket.reference_data.arn}/hierarchy/*"
       }
     ]
   })
@@ -456,9 +630,18 @@ resource "aws_iam_policy" "instance_data_lambda_basic" {
           "connect:ListQueues",
           "connect:DescribeQueue",
           "connect:ListUsers",
-          "connect:DescribeUser"
+          "connect:DescribeUser",
+          "connect:ListUserHierarchyGroups",
+          "connect:DescribeUserHierarchyGroup"
         ],
         Resource = "*"
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "s3:PutObject"
+        ],
+        Resource = "${aws_s3_bucket.reference_data.arn}/hierarchy/*"
       }
     ]
   })
@@ -532,6 +715,498 @@ resource "aws_iam_role_policy_attachment" "scheduler_invoke_lambda" {
   policy_arn = aws_iam_policy.scheduler_invoke_lambda.arn
 }
 
+# ===================================================================
+# REFERENCE DATA
+# ===================================================================
+# persist_instance_data publishes hierarchy group names here, and
+# persist_agent_event reads them to fill in missing hierarchy level names
+
+locals {
+  hierarchy_cache_location = "s3://${aws_s3_bucket.reference_data.bucket}/hierarchy/groups.json"
+}
+
+resource "aws_s3_bucket" "reference_data" {
+  bucket        = "${lower(var.stack_name)}-reference-${data.aws_caller_identity.current.account_id}"
+  force_destroy = true
+  
+  tags = var.tags
+}
+
+resource "aws_s3_bucket_public_access_block" "reference_data" {
+  bucket = aws_s3_bucket.reference_data.id
+  
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+# ===================================================================
+# FAILED BATCH CAPTURE
+# ===================================================================
+# Batches the Lambdas cannot write to Timestream are captured here with the
+# error and replayed later with scripts/replay_failed_batches.py
+
+locals {
+  # S3 location the Lambdas capture failed batches to (empty disables capture)
+  failure_spool = join("", [for bucket in aws_s3_bucket.failed_batches : "s3://${bucket.bucket}/${var.failure_spool_prefix}"])
+}
+
+# S3 bucket for failed batch captures
+resource "aws_s3_bucket" "failed_batches" {
+  count         = var.enable_failure_capture ? 1 : 0
+  bucket        = "${lower(var.stack_name)}-failed-batches-${data.aws_caller_identity.current.account_id}"
+  force_destroy = true
+  
+  tags = var.tags
+}
+
+resource "aws_s3_bucket_public_access_block" "failed_batches" {
+  count  = var.enable_failure_capture ? 1 : 0
+  bucket = aws_s3_bucket.failed_batches[0].id
+  
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+# Captures that were never replayed expire after the retention period
+resource "aws_s3_bucket_lifecycle_configuration" "failed_batches" {
+  count  = var.enable_failure_capture ? 1 : 0
+  bucket = aws_s3_bucket.failed_batches[0].id
+  
+  rule {
+    id     = "expire-captures"
+    status = "Enabled"
+    
+    filter {
+      prefix = var.failure_spool_prefix
+    }
+    
+    expiration {
+      days = var.failure_spool_retention_days
+    }
+  }
+}
+
+# On-failure destination for events that could not be captured or processed
+resource "aws_sqs_queue" "failed_events" {
+  count                     = var.enable_failure_capture ? 1 : 0
+  name                      = "${var.stack_name}-FailedEvents"
+  message_retention_seconds = 1209600
+  
+  tags = var.tags
+}
+
+# IAM Policy allowing the Lambdas to capture failed batches
+resource "aws_iam_policy" "failure_capture" {
+  count       = var.enable_failure_capture ? 1 : 0
+  name        = "${var.stack_name}-FailureCapture"
+  path        = "/"
+  description = "Allows Lambda functions to capture failed batches"
+  
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Sid      = "FailureSpoolWrite",
+        Effect   = "Allow",
+        Action   = "s3:PutObject",
+        Resource = "${aws_s3_bucket.failed_batches[0].arn}/${var.failure_spool_prefix}*"
+      },
+      {
+        Sid      = "FailureDestination",
+        Effect   = "Allow",
+        Action   = "sqs:SendMessage",
+        Resource = aws_sqs_queue.failed_events[0].arn
+      }
+    ]
+  })
+  
+  tags = var.tags
+}
+
+resource "aws_iam_role_policy_attachment" "agent_event_lambda_failure_capture" {
+  count      = var.enable_failure_capture ? 1 : 0
+  role       = aws_iam_role.persist_agent_event_lambda.name
+  policy_arn = aws_iam_policy.failure_capture[0].arn
+}
+
+resource "aws_iam_role_policy_attachment" "contact_event_lambda_failure_capture" {
+  count      = var.enable_failure_capture ? 1 : 0
+  role       = aws_iam_role.persist_contact_event_lambda.name
+  policy_arn = aws_iam_policy.failure_capture[0].arn
+}
+
+# ===================================================================
+# ROLLUP QUERIES
+# ===================================================================
+# Timestream scheduled queries build the rollup tables from the raw event
+# tables, so every event counts once however the Lambdas scale. Timestream
+# checks the query columns when a query is created, so enable them once
+# the source tables hold events written by the current Lambdas.
+
+locals {
+  rollup_query_count = var.enable_rollup_queries ? 1 : 0
+  
+  # Each 15-minute period, and each 5 minutes of queue rollups, is built
+  # once its grace period has passed
+  agent_state_rollup_offset_minutes = min(14, ceil(var.agent_state_rollup_grace_seconds / 60))
+  queue_rollup_offset_minutes       = min(4, ceil(var.queue_rollup_grace_seconds / 60))
+  
+  # Queue rollup minutes are rebuilt on every run until they leave the
+  # lookback, in whole 5-minute runs
+  queue_rollup_lookback_minutes = max(5, ceil(var.queue_rollup_lookback_minutes / 5) * 5)
+}
+
+# Notifications of scheduled query runs
+resource "aws_sns_topic" "rollup_queries" {
+  count    = local.rollup_query_count
+  provider = aws.timestream
+  name     = "${var.stack_name}-RollupQueries"
+  
+  tags = var.tags
+}
+
+# S3 bucket for the error reports of failed scheduled query runs
+resource "aws_s3_bucket" "rollup_query_errors" {
+  count         = local.rollup_query_count
+  provider      = aws.timestream
+  bucket        = "${lower(var.stack_name)}-rollup-errors-${data.aws_caller_identity.current.account_id}"
+  force_destroy = true
+  
+  tags = var.tags
+}
+
+resource "aws_s3_bucket_public_access_block" "rollup_query_errors" {
+  count    = local.rollup_query_count
+  provider = aws.timestream
+  bucket   = aws_s3_bucket.rollup_query_errors[0].id
+  
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+# IAM Role the scheduled queries run as
+resource "aws_iam_role" "rollup_queries" {
+  count = local.rollup_query_count
+  name  = "${var.stack_name}-RollupQueriesRole"
+  
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Action = "sts:AssumeRole",
+        Effect = "Allow",
+        Principal = {
+          Service = "timestream.amazonaws.com"
+        }
+      }
+    ]
+  })
+  
+  tags = var.tags
+}
+
+# IAM Policy allowing the scheduled queries to read the events and write the rollups
+resource "aws_iam_policy" "rollup_queries" {
+  count       = local.rollup_query_count
+  name        = "${var.stack_name}-RollupQueries"
+  path        = "/"
+  description = "Allows Timestream scheduled queries to build the rollup tables"
+  
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Sid      = "TimestreamDescribeEndpoints",
+        Effect   = "Allow",
+        Action   = "timestream:DescribeEndpoints",
+        Resource = "*"
+      },
+      {
+        Sid      = "TimestreamSelect",
+        Effect   = "Allow",
+        Action   = "timestream:Select",
+        Resource = "${aws_timestreamwrite_database.connect_db.arn}/table/*"
+      },
+      {
+        Sid      = "TimestreamRollupWrite",
+        Effect   = "Allow",
+        Action   = "timestream:WriteRecords",
+        Resource = [
+          aws_timestreamwrite_table.queue_rollup_1m.arn,
+          aws_timestreamwrite_table.agent_state_rollup_15m.arn
+        ]
+      },
+      {
+        Sid      = "TimestreamKMSAccess",
+        Effect   = "Allow",
+        Action   = [
+          "kms:Decrypt",
+          "kms:GenerateDataKey*",
+          "kms:DescribeKey"
+        ],
+        Resource = aws_kms_key.timestream_db_key.arn
+      },
+      {
+        Sid      = "RunNotifications",
+        Effect   = "Allow",
+        Action   = "sns:Publish",
+        Resource = aws_sns_topic.rollup_queries[0].arn
+      },
+      {
+        Sid      = "ErrorReports",
+        Effect   = "Allow",
+        Action   = "s3:PutObject",
+        Resource = "${aws_s3_bucket.rollup_query_errors[0].arn}/*"
+      }
+    ]
+  })
+  
+  tags = var.tags
+}
+
+resource "aws_iam_role_policy_attachment" "rollup_queries" {
+  count      = local.rollup_query_count
+  role       = aws_iam_role.rollup_queries[0].name
+  policy_arn = aws_iam_policy.rollup_queries[0].arn
+}
+
+# Per-queue, per-channel minute aggregates of contact events. Every run rebuilds
+# all the minutes in the lookback, so events that reach ContactEvent late are
+# counted when their minutes are upserted again with the complete counts.
+# Events are deduplicated on contact and event type within each minute, so
+# EventBridge redeliveries and Lambda retries count once.
+resource "aws_timestreamquery_scheduled_query" "queue_rollup_1m" {
+  count              = local.rollup_query_count
+  provider           = aws.timestream
+  name               = "${var.stack_name}-QueueRollup1m"
+  execution_role_arn = aws_iam_role.rollup_queries[0].arn
+  
+  query_string = <<-EOT
+    WITH events AS (
+      SELECT ContactId, InstanceId, Channel, EventType,
+             bin(ContactEventTime, 1m) AS minute,
+             min(ContactEventTime) AS event_time,
+             arbitrary(QueueName) AS queue_name,
+             arbitrary(EnqueueTime) AS enqueue_time,
+             arbitrary(DequeueTime) AS dequeue_time,
+             arbitrary(ConnectedToAgentTime) AS connected_time,
+             arbitrary(DisconnectTime) AS disconnect_time
+      FROM "${aws_timestreamwrite_database.connect_db.database_name}"."${aws_timestreamwrite_table.contact_event.table_name}"
+      WHERE measure_name = 'ContactEvent'
+        AND QueueName IS NOT NULL
+        AND time BETWEEN bin(@scheduled_runtime, 5m) - ${local.queue_rollup_lookback_minutes}m AND @scheduled_runtime
+        AND ContactEventTime >= bin(@scheduled_runtime, 5m) - ${local.queue_rollup_lookback_minutes}m
+        AND ContactEventTime < bin(@scheduled_runtime, 5m)
+      GROUP BY ContactId, InstanceId, Channel, EventType, bin(ContactEventTime, 1m)
+    ), durations AS (
+      SELECT InstanceId, queue_name, Channel, EventType, minute,
+             EventType = 'DISCONNECTED' AND enqueue_time IS NOT NULL AND connected_time IS NULL AS abandoned,
+             CASE
+               WHEN EventType = 'CONNECTED_TO_AGENT' AND enqueue_time IS NOT NULL
+                 THEN to_milliseconds(coalesce(dequeue_time, connected_time) - enqueue_time) / 1000.0
+               WHEN EventType = 'DISCONNECTED' AND enqueue_time IS NOT NULL AND connected_time IS NULL
+                 THEN to_milliseconds(coalesce(dequeue_time, event_time) - enqueue_time) / 1000.0
+             END AS wait_seconds,
+             CASE
+               WHEN EventType = 'DISCONNECTED' AND connected_time IS NOT NULL
+                 THEN to_milliseconds(coalesce(disconnect_time, event_time) - connected_time) / 1000.0
+             END AS handle_seconds
+      FROM events
+    ), valid AS (
+      SELECT InstanceId, queue_name, Channel, EventType, minute, abandoned,
+             CASE WHEN wait_seconds >= 0 THEN wait_seconds END AS wait_seconds,
+             CASE WHEN handle_seconds >= 0 THEN handle_seconds END AS handle_seconds
+      FROM durations
+    )
+    SELECT InstanceId, queue_name AS QueueName, Channel, minute AS time,
+           SUM(CASE WHEN EventType = 'INITIATED' THEN 1 ELSE 0 END) AS Initiated,
+           SUM(CASE WHEN EventType = 'QUEUED' THEN 1 ELSE 0 END) AS Queued,
+           SUM(CASE WHEN EventType = 'CONNECTED_TO_AGENT' THEN 1 ELSE 0 END) AS ConnectedToAgent,
+           SUM(CASE WHEN EventType = 'DISCONNECTED' THEN 1 ELSE 0 END) AS Disconnected,
+           SUM(CASE WHEN EventType NOT IN ('INITIATED', 'QUEUED', 'CONNECTED_TO_AGENT', 'DISCONNECTED') THEN 1 ELSE 0 END) AS OtherEvents,
+           SUM(CASE WHEN abandoned THEN 1 ELSE 0 END) AS Abandoned,
+           count(wait_seconds) AS WaitCount,
+           coalesce(SUM(wait_seconds), 0.0) AS WaitSumSeconds,
+           coalesce(MAX(wait_seconds), 0.0) AS WaitMaxSeconds,
+           count(handle_seconds) AS Handled,
+           coalesce(SUM(handle_seconds), 0.0) AS HandleSumSeconds
+    FROM valid
+    GROUP BY InstanceId, queue_name, Channel, minute
+  EOT
+  
+  schedule_configuration {
+    schedule_expression = "cron(${local.queue_rollup_offset_minutes}/5 * * * ? *)"
+  }
+  
+  notification_configuration {
+    sns_configuration {
+      topic_arn = aws_sns_topic.rollup_queries[0].arn
+    }
+  }
+  
+  error_report_configuration {
+    s3_configuration {
+      bucket_name       = aws_s3_bucket.rollup_query_errors[0].bucket
+      object_key_prefix = "queue-rollup"
+    }
+  }
+  
+  target_configuration {
+    timestream_configuration {
+      database_name = aws_timestreamwrite_database.connect_db.database_name
+      table_name    = aws_timestreamwrite_table.queue_rollup_1m.table_name
+      time_column   = "time"
+      
+      dimension_mapping {
+        name                 = "InstanceId"
+        dimension_value_type = "VARCHAR"
+      }
+      
+      dimension_mapping {
+        name                 = "QueueName"
+        dimension_value_type = "VARCHAR"
+      }
+      
+      dimension_mapping {
+        name                 = "Channel"
+        dimension_value_type = "VARCHAR"
+      }
+      
+      multi_measure_mappings {
+        target_multi_measure_name = "QueueRollup"
+        
+        dynamic "multi_measure_attribute_mapping" {
+          for_each = {
+            Initiated        = "BIGINT"
+            Queued           = "BIGINT"
+            ConnectedToAgent = "BIGINT"
+            Disconnected     = "BIGINT"
+            OtherEvents      = "BIGINT"
+            Abandoned        = "BIGINT"
+            WaitCount        = "BIGINT"
+            WaitSumSeconds   = "DOUBLE"
+            WaitMaxSeconds   = "DOUBLE"
+            Handled          = "BIGINT"
+            HandleSumSeconds = "DOUBLE"
+          }
+          content {
+            source_column      = multi_measure_attribute_mapping.key
+            measure_value_type = multi_measure_attribute_mapping.value
+          }
+        }
+      }
+    }
+  }
+  
+  depends_on = [aws_iam_role_policy_attachment.rollup_queries]
+  
+  tags = var.tags
+}
+
+# Seconds each agent spends in each status type and on contact, per 15-minute
+# period. Events are deduplicated on agent, type and event time, so retried
+# batches count once; each event's state holds until the agent's next event,
+# for at most agent_state_max_gap_seconds, and LOGOUT ends it.
+resource "aws_timestreamquery_scheduled_query" "agent_state_rollup_15m" {
+  count              = local.rollup_query_count
+  provider           = aws.timestream
+  name               = "${var.stack_name}-AgentStateRollup15m"
+  execution_role_arn = aws_iam_role.rollup_queries[0].arn
+  
+  query_string = <<-EOT
+    WITH events AS (
+      SELECT AgentARN, InstanceId, EventType,
+             from_iso8601_timestamp(EventTimestamp) AS event_time,
+             arbitrary(AgentStatusType) AS status_type,
+             arbitrary(ContactCount) AS contact_count
+      FROM "${aws_timestreamwrite_database.connect_db.database_name}"."${aws_timestreamwrite_table.agent_event.table_name}"
+      WHERE measure_name = 'AgentEvent'
+        AND EventTimestamp <> 'unknown'
+        AND time BETWEEN bin(@scheduled_runtime, 15m) - 15m - ${var.agent_state_max_gap_seconds}s AND @scheduled_runtime
+      GROUP BY AgentARN, InstanceId, EventType, EventTimestamp
+    ), intervals AS (
+      SELECT AgentARN, InstanceId, EventType, status_type, contact_count, event_time,
+             least(coalesce(lead(event_time) OVER (PARTITION BY AgentARN ORDER BY event_time),
+                            event_time + ${var.agent_state_max_gap_seconds}s),
+                   event_time + ${var.agent_state_max_gap_seconds}s) AS end_time
+      FROM events
+    ), clipped AS (
+      SELECT AgentARN, InstanceId, status_type, contact_count,
+             to_milliseconds(least(end_time, bin(@scheduled_runtime, 15m))
+                             - greatest(event_time, bin(@scheduled_runtime, 15m) - 15m)) / 1000.0 AS seconds
+      FROM intervals
+      WHERE EventType <> 'LOGOUT'
+        AND end_time > bin(@scheduled_runtime, 15m) - 15m
+        AND event_time < bin(@scheduled_runtime, 15m)
+    )
+    SELECT AgentARN, InstanceId, bin(@scheduled_runtime, 15m) - 15m AS time,
+           SUM(CASE WHEN status_type = 'ROUTABLE' THEN seconds ELSE 0.0 END) AS RoutableSeconds,
+           SUM(CASE WHEN status_type = 'CUSTOM' THEN seconds ELSE 0.0 END) AS CustomSeconds,
+           SUM(CASE WHEN status_type = 'OFFLINE' THEN seconds ELSE 0.0 END) AS OfflineSeconds,
+           SUM(CASE WHEN coalesce(status_type, '') NOT IN ('ROUTABLE', 'CUSTOM', 'OFFLINE') THEN seconds ELSE 0.0 END) AS OtherSeconds,
+           SUM(CASE WHEN contact_count > 0 THEN seconds ELSE 0.0 END) AS OnContactSeconds
+    FROM clipped
+    GROUP BY AgentARN, InstanceId
+  EOT
+  
+  schedule_configuration {
+    schedule_expression = "cron(${local.agent_state_rollup_offset_minutes}/15 * * * ? *)"
+  }
+  
+  notification_configuration {
+    sns_configuration {
+      topic_arn = aws_sns_topic.rollup_queries[0].arn
+    }
+  }
+  
+  error_report_configuration {
+    s3_configuration {
+      bucket_name       = aws_s3_bucket.rollup_query_errors[0].bucket
+      object_key_prefix = "agent-state-rollup"
+    }
+  }
+  
+  target_configuration {
+    timestream_configuration {
+      database_name = aws_timestreamwrite_database.connect_db.database_name
+      table_name    = aws_timestreamwrite_table.agent_state_rollup_15m.table_name
+      time_column   = "time"
+      
+      dimension_mapping {
+        name                 = "AgentARN"
+        dimension_value_type = "VARCHAR"
+      }
+      
+      dimension_mapping {
+        name                 = "InstanceId"
+        dimension_value_type = "VARCHAR"
+      }
+      
+      multi_measure_mappings {
+        target_multi_measure_name = "AgentStateRollup"
+        
+        dynamic "multi_measure_attribute_mapping" {
+          for_each = ["RoutableSeconds", "CustomSeconds", "OfflineSeconds", "OtherSeconds", "OnContactSeconds"]
+          content {
+            source_column      = multi_measure_attribute_mapping.value
+            measure_value_type = "DOUBLE"
+          }
+        }
+      }
+    }
+  }
+  
+  depends_on = [aws_iam_role_policy_attachment.rollup_queries]
+  
+  tags = var.tags
+}
+
 # ===================================================================
 # LAMBDA FUNCTIONS
 # ===================================================================
@@ -550,8 +1225,27 @@ resource "aws_lambda_function" "persist_agent_event" {
   
   environment {
     variables = {
-      TIMESTREAM_DATABASE_NAME = aws_timestreamwrite_database.connect_db.database_name
-      TIMESTREAM_REGION        = var.timestream_region
+      TIMESTREAM_DATABASE_NAME          = aws_timestreamwrite_database.connect_db.database_name
+      TIMESTREAM_REGION                 = var.timestream_region
+      TIMESTREAM_SECONDARY_REGION       = local.secondary_region
+      TIMESTREAM_WRITE_MODE             = var.timestream_write_mode
+      TIMESTREAM_FAILOVER_SECONDS       = var.timestream_failover_seconds
+      TIMESTREAM_MAX_CONNECTIONS        = max(10, var.agent_event_pipeline_writers)
+      PIPELINE_WRITERS                  = var.agent_event_pipeline_writers
+      PIPELINE_MAX_IN_FLIGHT            = var.agent_event_pipeline_max_in_flight
+      TRANSFORM_PROCESSES               = var.agent_event_transform_processes
+      TRANSFORM_MIN_RECORDS             = var.agent_event_transform_min_records
+      CONTACT_STATE_CACHE_SIZE          = var.contact_state_cache_size
+      CONTACT_STATE_CACHE_TTL_SECONDS   = var.contact_state_cache_ttl
+      FAILURE_SPOOL                     = local.failure_spool
+      HIERARCHY_CACHE_LOCATION          = local.hierarchy_cache_location
+      HIERARCHY_CACHE_TTL_SECONDS       = var.hierarchy_cache_ttl
+      DIMENSION_CATALOG_TABLE           = aws_timestreamwrite_table.dimension_catalog.table_name
+      DIMENSION_CATALOG_FLUSH_SECONDS   = var.dimension_catalog_flush_seconds
+      DIMENSION_CATALOG_REFRESH_SECONDS = var.dimension_catalog_refresh_seconds
+      KEEP_VARCHAR_TIMESTAMPS           = var.keep_varchar_timestamps
+      CONTACT_RECORD_TABLE              = var.enable_contact_record ? aws_timestreamwrite_table.contact_record.table_name : ""
+      CONTACT_RECORD_ATTRIBUTES         = join(",", var.contact_record_attributes)
     }
   }
   
@@ -565,10 +1259,21 @@ resource "aws_lambda_event_source_mapping" "kinesis_agent_event_mapping" {
   starting_position         = "LATEST"
   batch_size                = var.kinesis_batch_size
   maximum_batching_window_in_seconds = var.kinesis_batch_window
-  parallelization_factor    = 10
+  parallelization_factor    = var.kinesis_parallelization_factor
   maximum_retry_attempts    = 3
+  bisect_batch_on_function_error = var.enable_failure_capture
   enabled                   = true
   
+  # Batches that fail even to be captured are recorded by shard and sequence range
+  dynamic "destination_config" {
+    for_each = aws_sqs_queue.failed_events
+    content {
+      on_failure {
+        destination_arn = destination_config.value.arn
+      }
+    }
+  }
+  
   depends_on = [
     aws_lambda_function.persist_agent_event,
     aws_iam_role_policy_attachment.agent_event_lambda_kinesis
@@ -589,21 +1294,45 @@ resource "aws_lambda_function" "persist_contact_event" {
   
   environment {
     variables = {
-      TIMESTREAM_DATABASE_NAME = aws_timestreamwrite_database.connect_db.database_name
-      TIMESTREAM_REGION        = var.timestream_region
+      TIMESTREAM_DATABASE_NAME          = aws_timestreamwrite_database.connect_db.database_name
+      TIMESTREAM_REGION                 = var.timestream_region
+      TIMESTREAM_SECONDARY_REGION       = local.secondary_region
+      TIMESTREAM_WRITE_MODE             = var.timestream_write_mode
+      TIMESTREAM_FAILOVER_SECONDS       = var.timestream_failover_seconds
+      FAILURE_SPOOL                     = local.failure_spool
+      DIMENSION_CATALOG_TABLE           = aws_timestreamwrite_table.dimension_catalog.table_name
+      DIMENSION_CATALOG_FLUSH_SECONDS   = var.dimension_catalog_flush_seconds
+      DIMENSION_CATALOG_REFRESH_SECONDS = var.dimension_catalog_refresh_seconds
+      KEEP_VARCHAR_TIMESTAMPS           = var.keep_varchar_timestamps
+      CONTACT_EVENT_SOURCES             = join(",", var.contact_event_sources)
     }
   }
   
   tags = var.tags
 }
 
+# Send contact events that still fail after the async retries to the failed events queue
+resource "aws_lambda_function_event_invoke_config" "persist_contact_event" {
+  count                  = var.enable_failure_capture ? 1 : 0
+  function_name          = aws_lambda_function.persist_contact_event.function_name
+  maximum_retry_attempts = 2
+  
+  destination_config {
+    on_failure {
+      destination = aws_sqs_queue.failed_events[0].arn
+    }
+  }
+  
+  depends_on = [aws_iam_role_policy_attachment.contact_event_lambda_failure_capture]
+}
+
 # EventBridge rule for Amazon Connect contact events
 resource "aws_cloudwatch_event_rule" "persist_contact_event" {
   name        = "${var.stack_name}-PersistContactEvent"
   description = "Capture Amazon Connect Contact Events"
   
   event_pattern = jsonencode({
-    source = ["aws.connect"],
+    source = var.contact_event_sources,
     "detail-type" = ["Amazon Connect Contact Event"]
   })
   
@@ -640,8 +1369,15 @@ resource "aws_lambda_function" "persist_instance_data" {
   
   environment {
     variables = {
-      TIMESTREAM_DATABASE_NAME = aws_timestreamwrite_database.connect_db.database_name
-      TIMESTREAM_REGION        = var.timestream_region
+      TIMESTREAM_DATABASE_NAME          = aws_timestreamwrite_database.connect_db.database_name
+      TIMESTREAM_REGION                 = var.timestream_region
+      TIMESTREAM_SECONDARY_REGION       = local.secondary_region
+      TIMESTREAM_WRITE_MODE             = var.timestream_write_mode
+      TIMESTREAM_FAILOVER_SECONDS       = var.timestream_failover_seconds
+      HIERARCHY_CACHE_LOCATION          = local.hierarchy_cache_location
+      HIERARCHY_CACHE_TTL_SECONDS       = var.hierarchy_describe_ttl
+      DIMENSION_CATALOG_TABLE           = aws_timestreamwrite_table.dimension_catalog.table_name
+      DIMENSION_CATALOG_REFRESH_SECONDS = var.dimension_catalog_refresh_seconds
     }
   }
   
@@ -40,11 +40,30 @@ output "instance_data_lambda_arn" {
 output "timestream_table_names" {
   description = "Names of the Timestream tables"
   value = {
-    agent_event        = aws_timestreamwrite_table.agent_event.table_name
-    agent_event_contact = aws_timestreamwrite_table.agent_event_contact.table_name
-    contact_event      = aws_timestreamwrite_table.contact_event.table_name
-    instance           = aws_timestreamwrite_table.instance.table_name
-    queue              = aws_timestreamwrite_table.queue.table_name
-    user               = aws_timestreamwrite_table.user.table_name
+    agent_event            = aws_timestreamwrite_table.agent_event.table_name
+    agent_event_contact    = aws_timestreamwrite_table.agent_event_contact.table_name
+    contact_event          = aws_timestreamwrite_table.contact_event.table_name
+    instance               = aws_timestreamwrite_table.instance.table_name
+    queue                  = aws_timestreamwrite_table.queue.table_name
+    user                   = aws_timestreamwrite_table.user.table_name
+    dimension_catalog      = aws_timestreamwrite_table.dimension_catalog.table_name
+    queue_rollup_1m        = aws_timestreamwrite_table.queue_rollup_1m.table_name
+    agent_state_rollup_15m = aws_timestreamwrite_table.agent_state_rollup_15m.table_name
+    contact_record         = aws_timestreamwrite_table.contact_record.table_name
   }
-}
\ No newline at end of file
+}
+
+output "failure_spool" {
+  description = "S3 location of failed batch captures (empty when capture is disabled)"
+  value       = local.failure_spool
+}
+
+output "failed_events_queue_url" {
+  description = "URL of the on-failure destination queue for the Timestream Lambdas"
+  value       = join("", aws_sqs_queue.failed_events[*].url)
+}
+
+output "timestream_secondary_region" {
+  description = "Region of the secondary Timestream database (empty when not in use)"
+  value       = local.secondary_region
+}
@@ -19,6 +19,24 @@ variable "timestream_region" {
   default     = "eu-west-1"
 }
 
+variable "timestream_secondary_region" {
+  description = "Optional second Timestream region for failover or dual writes (empty for none)"
+  type        = string
+  default     = ""
+}
+
+variable "timestream_write_mode" {
+  description = "How the Lambdas use the secondary region: primary (ignore it), failover (write there while the primary fails) or dual (write to both)"
+  type        = string
+  default     = "primary"
+}
+
+variable "timestream_failover_seconds" {
+  description = "Seconds writes stay on the secondary region after a primary failure (and a failing secondary is skipped in dual mode)"
+  type        = number
+  default     = 60
+}
+
 variable "existing_kinesis_stream_arn" {
   description = "ARN of the existing Kinesis stream for CTR data"
   type        = string
@@ -42,6 +60,30 @@ variable "timestream_retention_magnetic" {
   default     = 365
 }
 
+variable "enable_magnetic_store_writes" {
+  description = "Accept writes older than the memory store retention on the event tables (needed to backfill from the CTR lake)"
+  type        = bool
+  default     = false
+}
+
+variable "enable_failure_capture" {
+  description = "Capture batches that fail to write to Timestream in S3 (with an SQS on-failure destination) for replay"
+  type        = bool
+  default     = true
+}
+
+variable "failure_spool_prefix" {
+  description = "Prefix for failed batch captures in the failure spool bucket"
+  type        = string
+  default     = "failed-batches/"
+}
+
+variable "failure_spool_retention_days" {
+  description = "Days to keep failed batch captures before they expire"
+  type        = number
+  default     = 30
+}
+
 variable "lambda_runtime" {
   description = "Runtime for Lambda functions"
   type        = string
@@ -72,6 +114,126 @@ variable "kinesis_batch_window" {
   default     = 5
 }
 
+variable "kinesis_parallelization_factor" {
+  description = "Concurrent agent event Lambda invocations per Kinesis shard (1-10)"
+  type        = number
+  default     = 10
+}
+
+variable "agent_event_pipeline_writers" {
+  description = "Concurrent Timestream writer lanes for the agent event Lambda (0 writes after the whole batch is transformed)"
+  type        = number
+  default     = 0
+}
+
+variable "agent_event_pipeline_max_in_flight" {
+  description = "Maximum 100-record chunks queued or being written at once in pipelined mode (at least 1)"
+  type        = number
+  default     = 8
+}
+
+variable "agent_event_transform_processes" {
+  description = "Worker processes the agent event Lambda splits large batches across for decoding and record building (0 or 1 transforms in a single process; Lambda allocates one vCPU per 1,769 MB of lambda_memory_size)"
+  type        = number
+  default     = 0
+}
+
+variable "agent_event_transform_min_records" {
+  description = "Smallest Kinesis batch transformed by the worker processes (see scripts/benchmark_parallel_transform.py for the crossover point)"
+  type        = number
+  default     = 1000
+}
+
+variable "contact_state_cache_size" {
+  description = "Maximum agent/contact pairs tracked to suppress unchanged AgentEvent_Contact rows (0 writes every row)"
+  type        = number
+  default     = 10000
+}
+
+variable "contact_state_cache_ttl" {
+  description = "Seconds an unchanged agent/contact pair stays in the contact state cache"
+  type        = number
+  default     = 3600
+}
+
+variable "hierarchy_cache_ttl" {
+  description = "Seconds the agent event Lambda uses a loaded copy of the hierarchy group names before reloading"
+  type        = number
+  default     = 300
+}
+
+variable "hierarchy_describe_ttl" {
+  description = "Seconds the instance data Lambda reuses a described hierarchy group before describing it again"
+  type        = number
+  default     = 3600
+}
+
+variable "dimension_catalog_flush_seconds" {
+  description = "Minimum seconds between writes of newly seen dimension values to the DimensionCatalog table"
+  type        = number
+  default     = 60
+}
+
+variable "dimension_catalog_refresh_seconds" {
+  description = "Seconds after which a dimension value already in the DimensionCatalog table is written again (keep below the dashboards' 7 day lookback)"
+  type        = number
+  default     = 86400
+}
+
+variable "queue_rollup_grace_seconds" {
+  description = "Seconds after the end of each 5 minutes before their QueueRollup1m rows are built (rounded up to whole minutes, at most 4)"
+  type        = number
+  default     = 30
+}
+
+variable "queue_rollup_lookback_minutes" {
+  description = "Minutes of QueueRollup1m rows rebuilt on every run, so ContactEvent rows written up to this late are counted (rounded up to a multiple of 5)"
+  type        = number
+  default     = 60
+}
+
+variable "enable_rollup_queries" {
+  description = "Create the Timestream scheduled queries that build the rollup tables (enable once the source tables hold events, as Timestream checks the query columns on creation)"
+  type        = bool
+  default     = false
+}
+
+variable "agent_state_rollup_grace_seconds" {
+  description = "Seconds after the end of a 15-minute period before its AgentStateRollup15m rows are built (rounded up to whole minutes, at most 14)"
+  type        = number
+  default     = 300
+}
+
+variable "agent_state_max_gap_seconds" {
+  description = "Seconds an agent's state is assumed to hold after its last event (Connect sends heartbeats every 120 seconds)"
+  type        = number
+  default     = 600
+}
+
+variable "keep_varchar_timestamps" {
+  description = "Keep writing the original ISO 8601 *Timestamp VARCHAR measures next to the typed *Time TIMESTAMP measures (disable once dashboards use the typed measures)"
+  type        = bool
+  default     = true
+}
+
+variable "enable_contact_record" {
+  description = "Write a row per contact to the ContactRecord table from the CTRs the agent event Lambda reads off the stream"
+  type        = bool
+  default     = true
+}
+
+variable "contact_record_attributes" {
+  description = "Contact attributes written to ContactRecord as Attribute_<name> VARCHAR measures"
+  type        = list(string)
+  default     = []
+}
+
+variable "contact_event_sources" {
+  description = "EventBridge sources routed to the contact event Lambda (add e.g. connect.loadtest for scripts/generate_contact_events.py --sink eventbridge)"
+  type        = list(string)
+  default     = ["aws.connect"]
+}
+
 variable "instance_data_schedule" {
   description = "Schedule expression for instance data collection"
   type        = string
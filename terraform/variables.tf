@@ -70,6 +70,18 @@ variable "firehose_buffer_interval" {
   default     = 60
 }
 
+variable "enable_parquet_conversion" {
+  description = "Flatten CTRs and deliver them to S3 as Parquet, keeping a raw JSON copy of the source records"
+  type        = bool
+  default     = false
+}
+
+variable "enable_partition_registrar" {
+  description = "Register new CTR partitions as objects arrive instead of running the Glue crawler on a schedule"
+  type        = bool
+  default     = false
+}
+
 # SSH Key Variables
 variable "ssh_key_path" {
   description = "Path to the SSH public key file for EC2 instance"
@@ -0,0 +1,22 @@
+"""
+Shared setup for the tests of the scripts and Lambda code
+
+The scripts and Lambdas are not packaged, so their directories are put on
+the import path the way the scripts do it themselves. The tests run
+offline: boto3 clients are created but AWS is never called.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (
+    os.path.join(ROOT, 'scripts'),
+    os.path.join(ROOT, 'terraform', 'timestream', 'lambda_code'),
+    os.path.join(ROOT, 'terraform', 'data_pipeline', 'lambda_code'),
+):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Module-level clients need a region even though they are never used
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
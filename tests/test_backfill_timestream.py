@@ -0,0 +1,159 @@
+import datetime
+import json
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+import backfill_timestream
+import ctr_lake
+from timestream_common import TimestreamWriter
+
+PREFIX = "connect-ctr-data/"
+REGION = "eu-west-1"
+HOURS = ['10', '11', '12']
+NOW_MS = int(datetime.datetime(2026, 10, 18, 20, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+class StubTimestream:
+    """Records what the backfill writes, failing writes of the hours in fail_hours"""
+
+    def __init__(self, fail_hours=(), magnetic_writes=False):
+        self.fail_hours = set(fail_hours)
+        self.magnetic_writes = magnetic_writes
+        self.lock = threading.Lock()
+        self.written = {}
+
+    def describe_table(self, DatabaseName, TableName):
+        return {'Table': {
+            'RetentionProperties': {'MemoryStoreRetentionPeriodInHours': 25, 'MagneticStoreRetentionPeriodInDays': 365},
+            'MagneticStoreWriteProperties': {'EnableMagneticStoreWrites': self.magnetic_writes},
+        }}
+
+    def write_records(self, DatabaseName, TableName, Records, CommonAttributes):
+        assert len(Records) <= backfill_timestream.WRITE_CHUNK_SIZE
+        hours = {datetime.datetime.fromtimestamp(int(record['Time']) / 1000, datetime.timezone.utc).strftime('%H')
+                 for record in Records}
+        if hours & self.fail_hours:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'WriteRecords')
+        with self.lock:
+            self.written.setdefault(TableName, []).extend(Records)
+
+    def count(self, table):
+        return len(self.written.get(table, []))
+
+# Build a writer that writes through the stub, as the backfill's own writer does through boto3
+def make_writer(client):
+    writer = TimestreamWriter(REGION, database=backfill_timestream.DATABASE)
+    writer.clients[REGION] = client
+    return writer
+
+# Build a CTR that disconnected at the given minute of an hour on 2026-10-18
+def make_ctr(contact_id, hour, minute):
+    return {
+        'ContactId': contact_id,
+        'InstanceId': 'instance-1',
+        'Channel': 'VOICE',
+        'InitiationMethod': 'INBOUND',
+        'InitiationTimestamp': f"2026-10-18T{hour}:{minute - 5:02d}:00.000Z",
+        'DisconnectTimestamp': f"2026-10-18T{hour}:{minute:02d}:00.000Z",
+        'Queue': {'QueueName': 'SupportQueue', 'Duration': 30},
+        'AgentInfo': {'AgentId': 'agent-1', 'AgentInteractionDuration': 240},
+    }
+
+@pytest.fixture
+def lake(tmp_path):
+    store = ctr_lake.LocalStore(str(tmp_path / 'lake'))
+    for hour in HOURS:
+        body = '\n'.join(json.dumps(make_ctr(f"contact-{hour}-{minute}", hour, minute)) for minute in (10, 40))
+        store.write_bytes(f"{PREFIX}year=2026/month=10/day=18/hour={hour}/ctr-{hour}.json", body.encode('utf-8'))
+    return store
+
+def run(store, client, checkpoint_path, now_ms=NOW_MS):
+    partitions = ctr_lake.list_partitions(store, PREFIX)
+    return backfill_timestream.run_backfill(store, make_writer(client), partitions,
+                                            checkpoint_path=str(checkpoint_path), parse_workers=1, write_threads=2,
+                                            rate=0, now_ms=now_ms)
+
+def test_backfill_records_each_partition_in_checkpoint(lake, tmp_path):
+    checkpoint_path = tmp_path / 'checkpoint.json'
+    client = StubTimestream()
+    
+    totals = run(lake, client, checkpoint_path)
+    
+    assert totals == {'partitions': 3, 'failed_partitions': 0, 'incomplete_partitions': 0, 'written': 12, 'rejected': 0}
+    assert client.count('ContactEvent') == 6
+    assert client.count('ContactRecord') == 6
+    
+    completed = json.loads(checkpoint_path.read_text())['completed']
+    assert sorted(completed) == [f"2026/10/18/{hour}" for hour in HOURS]
+    assert completed['2026/10/18/11']['written'] == {'AgentEvent': 0, 'AgentEvent_Contact': 0,
+                                                        'ContactEvent': 2, 'ContactRecord': 2}
+
+def test_rerun_skips_completed_partitions(lake, tmp_path):
+    checkpoint_path = tmp_path / 'checkpoint.json'
+    run(lake, StubTimestream(), checkpoint_path)
+    
+    client = StubTimestream()
+    totals = run(lake, client, checkpoint_path)
+    
+    assert totals['partitions'] == 0
+    assert totals['written'] == 0
+    assert client.written == {}
+
+def test_resume_writes_only_the_failed_partition(lake, tmp_path):
+    checkpoint_path = tmp_path / 'checkpoint.json'
+    
+    totals = run(lake, StubTimestream(fail_hours={'11'}), checkpoint_path)
+    assert totals['partitions'] == 2
+    assert totals['failed_partitions'] == 1
+    assert '2026/10/18/11' not in json.loads(checkpoint_path.read_text())['completed']
+    
+    client = StubTimestream()
+    totals = run(lake, client, checkpoint_path)
+    
+    assert totals == {'partitions': 1, 'failed_partitions': 0, 'incomplete_partitions': 0, 'written': 4,
+                      'rejected': 0}
+    contact_ids = {dimension['Value'] for record in client.written['ContactRecord']
+                   for dimension in record['Dimensions'] if dimension['Name'] == 'ContactId'}
+    assert contact_ids == {'contact-11-10', 'contact-11-40'}
+    assert len(json.loads(checkpoint_path.read_text())['completed']) == 3
+
+def test_backfill_keeps_the_event_time(lake, tmp_path):
+    client = StubTimestream()
+    run(lake, client, tmp_path / 'checkpoint.json')
+    
+    expected = int(datetime.datetime(2026, 10, 18, 12, 40, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    times = {record['Time'] for record in client.written['ContactRecord']}
+    assert str(expected) in times
+
+def test_records_needing_magnetic_writes_are_not_checkpointed(lake, tmp_path):
+    checkpoint_path = tmp_path / 'checkpoint.json'
+    
+    # Two days later every record is past the 25 hour memory store retention
+    later_ms = NOW_MS + 2 * 86400 * 1000
+    client = StubTimestream()
+    totals = run(lake, client, checkpoint_path, later_ms)
+    
+    assert totals['written'] == 0
+    assert totals['incomplete_partitions'] == 3
+    assert client.written == {}
+    assert backfill_timestream.load_checkpoint(str(checkpoint_path))['completed'] == {}
+    
+    # Once magnetic store writes are enabled the rerun writes every partition
+    client = StubTimestream(magnetic_writes=True)
+    totals = run(lake, client, checkpoint_path, later_ms)
+    
+    assert totals['written'] == 12
+    assert totals['incomplete_partitions'] == 0
+    assert len(json.loads(checkpoint_path.read_text())['completed']) == 3
+
+def test_expired_records_do_not_hold_back_the_checkpoint(lake, tmp_path):
+    checkpoint_path = tmp_path / 'checkpoint.json'
+    
+    # Past the 365 day magnetic retention nothing can ever be written
+    later_ms = NOW_MS + 400 * 86400 * 1000
+    totals = run(lake, StubTimestream(), checkpoint_path, later_ms)
+    
+    assert totals['written'] == 0
+    completed = json.loads(checkpoint_path.read_text())['completed']
+    assert completed['2026/10/18/10']['expired'] == 4
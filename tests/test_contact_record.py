@@ -0,0 +1,86 @@
+import copy
+import datetime
+import random
+
+import pytest
+
+import generate_ctr_data
+import persist_agent_event
+from persist_agent_event import build_contact_record
+
+CURRENT_TIME = '1760000000000'
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+@pytest.fixture
+def ctrs():
+    random.seed(43)
+    return [generate_ctr_data.generate_ctr_record() for _ in range(50)]
+
+# The generator writes UTC timestamps in this format
+def epoch_ms(timestamp):
+    parsed = datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT).replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def measures_of(record):
+    return {measure['Name']: measure for measure in record['MeasureValues']}
+
+def test_record_is_timed_at_disconnect(ctrs):
+    for ctr in ctrs:
+        record = build_contact_record(ctr, CURRENT_TIME)
+        assert record['Time'] == str(epoch_ms(ctr['DisconnectTimestamp']))
+
+def test_record_without_disconnect_uses_current_time(ctrs):
+    ctr = ctrs[0]
+    del ctr['DisconnectTimestamp']
+    
+    assert build_contact_record(ctr, CURRENT_TIME)['Time'] == CURRENT_TIME
+
+def test_redelivered_ctr_builds_the_same_record(ctrs):
+    for ctr in ctrs:
+        assert build_contact_record(ctr, CURRENT_TIME) == build_contact_record(copy.deepcopy(ctr), '1770000000000')
+
+def test_record_without_last_update_has_no_version(ctrs):
+    for ctr in ctrs:
+        assert 'Version' not in build_contact_record(ctr, CURRENT_TIME)
+
+def test_updated_ctr_replaces_the_earlier_record(ctrs):
+    for ctr in ctrs:
+        first = dict(ctr, LastUpdateTimestamp=ctr['DisconnectTimestamp'])
+        disconnected_at = datetime.datetime.strptime(ctr['DisconnectTimestamp'], TIMESTAMP_FORMAT)
+        updated_at = disconnected_at + datetime.timedelta(minutes=5)
+        update = dict(ctr, LastUpdateTimestamp=updated_at.strftime(TIMESTAMP_FORMAT))
+        
+        first_record = build_contact_record(first, CURRENT_TIME)
+        update_record = build_contact_record(update, CURRENT_TIME)
+        
+        # Same dimensions and time with a higher version, so Timestream overwrites the row
+        assert first_record['Version'] == epoch_ms(ctr['DisconnectTimestamp'])
+        assert update_record['Version'] == first_record['Version'] + 5 * 60 * 1000
+        assert update_record['Dimensions'] == first_record['Dimensions']
+        assert update_record['Time'] == first_record['Time']
+
+def test_record_carries_numeric_durations(ctrs):
+    for ctr in ctrs:
+        measures = measures_of(build_contact_record(ctr, CURRENT_TIME))
+        
+        assert measures['QueueDuration'] == {'Name': 'QueueDuration', 'Value': str(ctr['Queue']['Duration']),
+                                             'Type': 'BIGINT'}
+        assert measures['AgentInteractionDuration']['Value'] == str(ctr['AgentInfo']['AgentInteractionDuration'])
+        assert measures['DisconnectTime']['Type'] == 'TIMESTAMP'
+        assert 'DisconnectTimestamp' not in measures
+        
+        voice_activity = ctr.get('CustomerVoiceActivity')
+        if voice_activity:
+            assert measures['TalkTime']['Value'] == str(voice_activity['TalkTime'])
+            assert measures['ListenTime']['Value'] == str(voice_activity['ListenTime'])
+        else:
+            assert 'TalkTime' not in measures
+
+def test_record_carries_configured_attributes(ctrs, monkeypatch):
+    monkeypatch.setattr(persist_agent_event, 'CONTACT_RECORD_ATTRIBUTES', ['Sentiment', 'Missing'])
+    
+    for ctr in ctrs:
+        measures = measures_of(build_contact_record(ctr, CURRENT_TIME))
+        assert measures['Attribute_Sentiment']['Value'] == ctr['Attributes']['Sentiment']
+        assert 'Attribute_Missing' not in measures
+        assert 'Attribute_CustomerFirstName' not in measures
@@ -0,0 +1,131 @@
+import datetime
+import json
+
+import pytest
+
+import ctr_lake
+import register_ctr_partitions as registrar
+import sync_ctr_partitions
+
+PREFIX = "connect-ctr-data/"
+
+class RecordingStore(ctr_lake.LocalStore):
+    """A local store that remembers the prefixes it was asked to list"""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.listed = []
+
+    def list_keys(self, prefix=''):
+        self.listed.append(prefix)
+        return super().list_keys(prefix)
+
+class StubGlue:
+    """Accepts BatchCreatePartition calls, reporting the partitions in existing as already registered"""
+
+    def __init__(self, existing=()):
+        self.existing = set(existing)
+        self.created = []
+
+    def get_table(self, DatabaseName, Name):
+        return {'Table': {'StorageDescriptor': {
+            'Location': f"s3://ctr-bucket/{PREFIX}",
+            'InputFormat': 'org.apache.hadoop.mapred.TextInputFormat',
+        }}}
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        errors = []
+        for partition_input in PartitionInputList:
+            values = tuple(partition_input['Values'])
+            if values in self.existing:
+                errors.append({'PartitionValues': list(values),
+                               'ErrorDetail': {'ErrorCode': 'AlreadyExistsException'}})
+            else:
+                self.created.append(partition_input)
+        return {'Errors': errors}
+
+@pytest.fixture
+def lake(tmp_path):
+    store = RecordingStore(str(tmp_path / 'lake'))
+    for day, hour in (('17', '22'), ('17', '23'), ('18', '00'), ('18', '05'), ('18', '06')):
+        store.write_bytes(f"{PREFIX}year=2026/month=10/day={day}/hour={hour}/ctr-{day}{hour}.json", b'{}')
+    # Hidden files never make a partition on their own
+    store.write_bytes(f"{PREFIX}year=2026/month=10/day=18/hour=07/_SUCCESS", b'')
+    store.listed.clear()
+    return store
+
+@pytest.fixture
+def glue(monkeypatch):
+    client = StubGlue()
+    monkeypatch.setattr(registrar, 'glue', client)
+    monkeypatch.setattr(registrar, 'registered_partitions', set())
+    monkeypatch.setattr(registrar, 'table_storage', {})
+    return client
+
+def s3_event(*keys):
+    return {'Records': [{'s3': {'object': {'key': key}}} for key in keys]}
+
+def test_partition_values_from_key():
+    key = f"{PREFIX}year=2026/month=10/day=18/hour=05/ctr-1.json"
+    
+    assert registrar.partition_values_from_key(key, PREFIX) == ('2026', '10', '18', '05')
+    assert registrar.partition_values_from_key(f"other/{key}", PREFIX) is None
+    assert registrar.partition_values_from_key(f"{PREFIX}year=2026/month=10/day=18/hour=05/_SUCCESS", PREFIX) is None
+    assert registrar.partition_values_from_key(f"{PREFIX}manifest.json", PREFIX) is None
+
+def test_diff_partitions_returns_new_partitions_in_time_order():
+    candidates = {('2026', '10', '18', '06'), ('2026', '10', '17', '23'), ('2026', '10', '18', '05')}
+    registered = {('2026', '10', '18', '05'), ('2026', '10', '16', '00')}
+    
+    assert registrar.diff_partitions(candidates, registered) == [('2026', '10', '17', '23'), ('2026', '10', '18', '06')]
+    assert registrar.diff_partitions(registered, registered) == []
+
+def test_hour_partitions_cross_midnight():
+    start = datetime.datetime(2026, 10, 17, 23, 45, tzinfo=datetime.timezone.utc)
+    
+    assert registrar.hour_partitions(start, start + datetime.timedelta(hours=1)) == [
+        ('2026', '10', '17', '23'), ('2026', '10', '18', '00')]
+
+def test_find_partitions_lists_the_whole_prefix(lake):
+    assert sync_ctr_partitions.find_partitions(lake, PREFIX) == {
+        ('2026', '10', '17', '22'), ('2026', '10', '17', '23'), ('2026', '10', '18', '00'),
+        ('2026', '10', '18', '05'), ('2026', '10', '18', '06')}
+
+def test_find_partitions_since_never_lists_older_days(lake):
+    since = sync_ctr_partitions.parse_hour('2026/10/18/05')
+    until = datetime.datetime(2026, 10, 18, 12, tzinfo=datetime.timezone.utc)
+    
+    found = sync_ctr_partitions.find_partitions(lake, PREFIX, since, until)
+    
+    assert found == {('2026', '10', '18', '05'), ('2026', '10', '18', '06')}
+    assert lake.listed == [f"{PREFIX}year=2026/month=10/day=18/"]
+
+def test_diff_against_registered_file(lake, tmp_path):
+    registered_path = tmp_path / 'registered.json'
+    registered_path.write_text(json.dumps(['2026/10/17/22', '2026/10/17/23', '2026/10/18/00']))
+    
+    found = sync_ctr_partitions.find_partitions(lake, PREFIX)
+    registered = sync_ctr_partitions.registered_from_file(str(registered_path))
+    
+    assert registrar.diff_partitions(found, registered) == [('2026', '10', '18', '05'), ('2026', '10', '18', '06')]
+
+def test_handler_registers_only_new_partitions(glue):
+    key = f"{PREFIX}year=2026/month=10/day=18/hour=05/ctr-1.json"
+    
+    registrar.lambda_handler(s3_event(key, key.replace('ctr-1', 'ctr-2')), None)
+    
+    assert [partition['Values'] for partition in glue.created] == [['2026', '10', '18', '05']]
+    location = glue.created[0]['StorageDescriptor']['Location']
+    assert location == f"s3://ctr-bucket/{PREFIX}year=2026/month=10/day=18/hour=05/"
+    
+    # A warm container remembers the partition and makes no further calls
+    registrar.lambda_handler(s3_event(key.replace('ctr-1', 'ctr-3')), None)
+    assert len(glue.created) == 1
+
+def test_existing_partitions_are_not_counted_as_created(glue):
+    glue.existing.add(('2026', '10', '18', '05'))
+    
+    created = registrar.register_partitions([('2026', '10', '18', '05'), ('2026', '10', '18', '06')])
+    
+    assert created == 1
+    assert registrar.registered_partitions == {('2026', '10', '18', '05'), ('2026', '10', '18', '06')}
@@ -0,0 +1,79 @@
+import json
+
+from botocore.exceptions import ClientError
+
+import ctr_lake
+import replay_failed_batches
+from timestream_common import TimestreamWriter
+
+PREFIX = replay_failed_batches.SPOOL_PREFIX
+PRIMARY = 'eu-west-2'
+SECONDARY = 'eu-west-1'
+
+class StubClient:
+    """Keeps the records written to one region, raising error_code when set"""
+
+    def __init__(self, error_code=None):
+        self.error_code = error_code
+        self.written = {}
+
+    def write_records(self, DatabaseName, TableName, Records, CommonAttributes):
+        if self.error_code:
+            raise ClientError({'Error': {'Code': self.error_code, 'Message': self.error_code}}, 'WriteRecords')
+        self.written.setdefault(TableName, []).extend(Records)
+
+# Build a writer whose regions are served by stub clients
+def make_writer(mode, primary, secondary):
+    writer = TimestreamWriter(PRIMARY, SECONDARY, mode)
+    writer.clients[PRIMARY] = primary
+    writer.clients[SECONDARY] = secondary
+    return writer
+
+# Spool a capture holding the records a batch did not write
+def spool_capture(store, name, records):
+    capture = {'source': 'agent-event', 'captured_at': 1760745600000, 'error': 'Throttled',
+               'payloads': [], 'records': records}
+    key = f"{PREFIX}{name}.json"
+    store.write_bytes(key, json.dumps(capture).encode('utf-8'))
+    return key, capture
+
+def build_records(count):
+    return [{'MeasureName': 'AgentEvent', 'MeasureValueType': 'MULTI', 'Time': str(1760745600000 + i)}
+            for i in range(count)]
+
+def test_replay_writes_through_both_regions_in_dual_mode(tmp_path):
+    store = ctr_lake.LocalStore(str(tmp_path))
+    key, capture = spool_capture(store, 'batch-1', {'AgentEvent': build_records(150), 'AgentEvent_Contact': []})
+    primary, secondary = StubClient(), StubClient()
+    
+    totals = replay_failed_batches.replay_all(store, PREFIX, make_writer('dual', primary, secondary),
+                                              [(key, capture, None)], rate=0)
+    
+    assert totals == {'replayed': 1, 'failed': 0, 'recovered': 150, 'rejected': 0}
+    assert len(primary.written['AgentEvent']) == 150
+    assert len(secondary.written['AgentEvent']) == 150
+    assert replay_failed_batches.list_captures(store, PREFIX) == []
+    assert store.exists(f"{PREFIX}{replay_failed_batches.REPLAYED_DIR}batch-1.json")
+
+def test_replay_fails_over_to_the_secondary(tmp_path):
+    store = ctr_lake.LocalStore(str(tmp_path))
+    key, capture = spool_capture(store, 'batch-1', {'AgentEvent': build_records(10)})
+    secondary = StubClient()
+    
+    totals = replay_failed_batches.replay_all(store, PREFIX,
+                                              make_writer('failover', StubClient('ThrottlingException'), secondary),
+                                              [(key, capture, None)], rate=0)
+    
+    assert totals['recovered'] == 10
+    assert len(secondary.written['AgentEvent']) == 10
+
+def test_capture_failing_again_is_kept(tmp_path):
+    store = ctr_lake.LocalStore(str(tmp_path))
+    key, capture = spool_capture(store, 'batch-1', {'AgentEvent': build_records(10)})
+    
+    totals = replay_failed_batches.replay_all(store, PREFIX,
+                                              make_writer('primary', StubClient('ThrottlingException'), StubClient()),
+                                              [(key, capture, None)], rate=0)
+    
+    assert totals['failed'] == 1
+    assert replay_failed_batches.list_captures(store, PREFIX) == [key]
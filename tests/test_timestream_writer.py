@@ -0,0 +1,124 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import timestream_common
+from timestream_common import TimestreamWriter
+
+PRIMARY = 'eu-west-2'
+SECONDARY = 'eu-west-1'
+RECORDS = [{'MeasureName': 'AgentEvent', 'Time': '1760745600000'}]
+
+class StubClient:
+    """Keeps the chunks written to one region, raising error_code when set"""
+
+    def __init__(self, error_code=None):
+        self.error_code = error_code
+        self.writes = []
+
+    def write_records(self, DatabaseName, TableName, Records, CommonAttributes):
+        if self.error_code:
+            raise ClientError({'Error': {'Code': self.error_code, 'Message': self.error_code}}, 'WriteRecords')
+        self.writes.append((TableName, Records))
+
+# Build a writer whose regions are served by stub clients
+def make_writer(mode, primary=None, secondary=None, failover_seconds=60):
+    writer = TimestreamWriter(PRIMARY, SECONDARY, mode, failover_seconds)
+    writer.clients[PRIMARY] = primary or StubClient()
+    writer.clients[SECONDARY] = secondary or StubClient()
+    return writer
+
+def test_primary_mode_writes_only_to_primary():
+    writer = make_writer('primary')
+    
+    writer.write('AgentEvent', RECORDS)
+    
+    assert writer.clients[PRIMARY].writes == [('AgentEvent', RECORDS)]
+    assert writer.clients[SECONDARY].writes == []
+
+def test_mode_without_secondary_region_is_primary():
+    assert TimestreamWriter(PRIMARY, '', 'dual').mode == 'primary'
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        TimestreamWriter(PRIMARY, SECONDARY, 'mirror')
+
+def test_failover_moves_writes_to_secondary():
+    writer = make_writer('failover', primary=StubClient('ThrottlingException'))
+    
+    writer.write('AgentEvent', RECORDS)
+    writer.write('ContactEvent', RECORDS)
+    
+    # The second write goes straight to the secondary without trying the primary again
+    assert writer.clients[SECONDARY].writes == [('AgentEvent', RECORDS), ('ContactEvent', RECORDS)]
+    stats = writer.pop_stats()
+    assert stats[PRIMARY]['errors'] == 1
+    assert stats[PRIMARY]['writes'] == 1
+    assert stats[SECONDARY]['records'] == 2
+
+def test_failover_returns_to_primary_after_the_window():
+    primary = StubClient('InternalServerException')
+    writer = make_writer('failover', primary=primary, failover_seconds=0)
+    
+    writer.write('AgentEvent', RECORDS)
+    primary.error_code = None
+    writer.write('AgentEvent', RECORDS)
+    
+    assert primary.writes == [('AgentEvent', RECORDS)]
+    assert len(writer.clients[SECONDARY].writes) == 1
+
+def test_failover_does_not_retry_rejected_records():
+    writer = make_writer('failover', primary=StubClient('RejectedRecordsException'))
+    
+    with pytest.raises(ClientError):
+        writer.write('AgentEvent', RECORDS)
+    
+    assert writer.clients[SECONDARY].writes == []
+    assert writer.failover_until == 0
+
+def test_failover_raises_when_both_regions_fail():
+    writer = make_writer('failover', primary=StubClient('ThrottlingException'),
+                         secondary=StubClient('ThrottlingException'))
+    
+    with pytest.raises(ClientError):
+        writer.write('AgentEvent', RECORDS)
+
+def test_dual_writes_to_both_regions():
+    writer = make_writer('dual')
+    
+    writer.write('AgentEvent', RECORDS)
+    
+    assert writer.clients[PRIMARY].writes == [('AgentEvent', RECORDS)]
+    assert writer.clients[SECONDARY].writes == [('AgentEvent', RECORDS)]
+
+def test_dual_secondary_failure_does_not_fail_the_write():
+    secondary = StubClient('ThrottlingException')
+    writer = make_writer('dual', secondary=secondary)
+    
+    writer.write('AgentEvent', RECORDS)
+    assert writer.clients[PRIMARY].writes == [('AgentEvent', RECORDS)]
+    assert writer.pop_stats()[SECONDARY]['errors'] == 1
+    
+    # The failing secondary is skipped until its pause ends
+    secondary.error_code = None
+    writer.write('AgentEvent', RECORDS)
+    assert len(writer.clients[PRIMARY].writes) == 2
+    assert secondary.writes == []
+    assert SECONDARY not in writer.pop_stats()
+
+def test_dual_primary_failure_fails_the_write():
+    writer = make_writer('dual', primary=StubClient('ThrottlingException'))
+    
+    with pytest.raises(ClientError):
+        writer.write('AgentEvent', RECORDS)
+    
+    assert writer.clients[SECONDARY].writes == [('AgentEvent', RECORDS)]
+
+def test_write_records_to_timestream_chunks_through_the_shared_writer(monkeypatch):
+    writer = make_writer('dual')
+    monkeypatch.setattr(timestream_common, 'timestream_writer', writer)
+    records = [dict(RECORDS[0], Time=str(i)) for i in range(250)]
+    
+    timestream_common.write_records_to_timestream('AgentEvent', records)
+    
+    for region in (PRIMARY, SECONDARY):
+        assert [len(chunk) for _, chunk in writer.clients[region].writes] == [100, 100, 50]